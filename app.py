@@ -1,38 +1,32 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, send_from_directory, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.security import check_password_hash, generate_password_hash
-from models.user import User, users_db, patients_data, patient_records
-try:
-    from models.model_loader import load_model_conditionally
-    ckd_model = load_model_conditionally()
-    # Check if it's the lightweight model
-    import os
-    if os.environ.get('VERCEL') or os.environ.get('VERCEL_ENV'):
-        print("Using lightweight model for Vercel deployment")
-except ImportError:
-    # Fallback to direct import
-    try:
-        from models.vercel_model import lightweight_model
-        ckd_model = lightweight_model
-        print("Using lightweight model as fallback")
-    except ImportError:
-        from models.ckd_model import ckd_model
-        print("Using full model")
-import io
+from models.user import (users_db, patients_data, patient_records, cohort_trends, pdf_extractions, job_manager,
+                         upload_trials, request_profiles)
+from models.ingest import (ingest_csv, ingest_lab_report, ingest_lab_rows, ingest_pdf_reports, iter_json_rows,
+                           iter_ndjson_rows, pdf_report_rows, score_stream)
+from models.passwords import hash_password, verify_password
+from models import assets, clinical, metrics, pdf_extract, profiling
+from models.model_loader import is_vercel_environment, load_model_conditionally
+from models.memory_report import process_memory
+from models.page_cache import page_cache
+import hmac
+import json
 import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
 
-# Only import pandas when not on Vercel to reduce bundle size
-try:
-    import os as os_env_check
-    if not (os_env_check.environ.get('VERCEL') or os_env_check.environ.get('VERCEL_ENV')):
-        import pandas as pd
-    else:
-        pd = None
-except ImportError:
-    pd = None
+# CSV uploads larger than this are scored by a background job instead of inside the request
+ASYNC_UPLOAD_BYTES = int(os.environ.get('CKD_ASYNC_UPLOAD_BYTES', 256 * 1024))
+
+# Bearer token for machine clients of /api/predict (e.g. the EHR integration); unset means doctors' sessions only
+API_TOKEN = os.environ.get('CKD_API_TOKEN', '')
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
 
-# Track patient free trials for lab uploads
-patient_upload_trials = {}
+# PDF reports accepted per doctor upload; each becomes one patient
+MAX_PDF_FILES = int(os.environ.get('CKD_MAX_PDF_FILES', 50))
 
 # Log environment info
 import logging
@@ -41,8 +35,15 @@ logger = logging.getLogger(__name__)
 logger.info(f"VERCEL environment: {os.environ.get('VERCEL')}")
 logger.info(f"VERCEL_ENV environment: {os.environ.get('VERCEL_ENV')}"),
 
+# The model is imported and loaded on first use; warm-up does it ahead of the first request.
+# 'background' (default off Vercel) loads it on a daemon thread, 'sync' before serving, 'off' never.
+WARM_UP = os.environ.get('CKD_WARM_UP', 'off' if is_vercel_environment() else 'background').lower()
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SESSION_SECRET', 'ckd-diagnostic-system-secret-key-2025')
+assets.init_app(app)
+metrics.init_app(app)
+profiling.init_app(app, request_profiles)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -50,10 +51,7 @@ login_manager.login_view = 'landing'  # type: ignore
 
 @login_manager.user_loader
 def load_user(user_id):
-    for user in users_db.values():
-        if user.id == user_id:
-            return user
-    return None
+    return users_db.get_by_id(user_id)
 
 @app.route('/test')
 def test():
@@ -68,7 +66,7 @@ def index():
 def landing():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
-    return render_template('kidneycompanion_landing.html')
+    return page_cache.response('kidneycompanion_landing.html')
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -76,9 +74,9 @@ def login():
         username = request.form.get('username') or ''
         password = request.form.get('password') or ''
         
-        user = users_db.get(username)
+        user = users_db.get_by_username(username)
         
-        if user and password and check_password_hash(user.password_hash, password):
+        if user and verify_password(user.password_hash, password):
             login_user(user)
             flash(f'Welcome, {user.username}!', 'success')
             if user.is_doctor():
@@ -103,9 +101,9 @@ def doctor_login():
         username = request.form.get('username') or ''
         password = request.form.get('password') or ''
         
-        user = users_db.get(username)
+        user = users_db.get_by_username(username)
         
-        if user and password and check_password_hash(user.password_hash, password):
+        if user and verify_password(user.password_hash, password):
             if user.is_doctor():
                 login_user(user)
                 flash(f'Welcome, Dr. {user.username}!', 'success')
@@ -131,11 +129,11 @@ def patient_login():
         password = request.form.get('password') or ''
         
         if username:
-            user = users_db.get(username)
+            user = users_db.get_by_username(username)
         else:
             user = None
         
-        if user and password and check_password_hash(user.password_hash, password):
+        if user and verify_password(user.password_hash, password):
             if user.is_patient():
                 login_user(user)
                 flash(f'Welcome, {user.username}!', 'success')
@@ -182,51 +180,50 @@ def admin_dashboard():
         return redirect(url_for('admin_login'))
     
     # Get all doctors
-    doctors = [user for user in users_db.values() if user.is_doctor()]
+    doctors = users_db.all(role='doctor')
     
     # Add patients list to each doctor
+    patients = users_db.all(role='patient')
     for doctor in doctors:
-        doctor.patients = [user for user in users_db.values() if user.is_patient()]
+        doctor.patients = patients
     
     # Mock feedback data (in real app, this would come from database)
-    # Handle case where pandas might not be available on Vercel
-    try:
-        feedbacks = [
-            {
-                'patient_name': 'John Doe',
-                'doctor_name': 'doctor1',
-                'rating': 5,
-                'comment': 'Excellent service and very professional care.',
-                'date': pd.Timestamp('2025-01-15') if pd else '2025-01-15'
-            },
-            {
-                'patient_name': 'Jane Smith',
-                'doctor_name': 'doctor1',
-                'rating': 4,
-                'comment': 'Good experience, doctor was very helpful.',
-                'date': pd.Timestamp('2025-01-12') if pd else '2025-01-12'
-            }
-        ]
-    except:
-        # Fallback when pandas is not available
-        feedbacks = [
-            {
-                'patient_name': 'John Doe',
-                'doctor_name': 'doctor1',
-                'rating': 5,
-                'comment': 'Excellent service and very professional care.',
-                'date': '2025-01-15'
-            },
-            {
-                'patient_name': 'Jane Smith',
-                'doctor_name': 'doctor1',
-                'rating': 4,
-                'comment': 'Good experience, doctor was very helpful.',
-                'date': '2025-01-12'
-            }
-        ]
-    
-    return render_template('admin_dashboard.html', doctors=doctors, feedbacks=feedbacks)
+    feedbacks = [
+        {
+            'patient_name': 'John Doe',
+            'doctor_name': 'doctor1',
+            'rating': 5,
+            'comment': 'Excellent service and very professional care.',
+            'date': datetime(2025, 1, 15)
+        },
+        {
+            'patient_name': 'Jane Smith',
+            'doctor_name': 'doctor1',
+            'rating': 4,
+            'comment': 'Good experience, doctor was very helpful.',
+            'date': datetime(2025, 1, 12)
+        }
+    ]
+    
+    return render_template('admin_dashboard.html', doctors=doctors, feedbacks=feedbacks,
+                           profiles=request_profiles.list())
+
+@app.route('/admin/profiles')
+def admin_profiles():
+    """Summaries of the most recently profiled requests, newest first"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify({'profiles': request_profiles.list()})
+
+@app.route('/admin/profiles/<int:profile_id>')
+def admin_profile(profile_id):
+    """One profiled request with its top functions by cumulative time"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Access denied'}), 403
+    profile = request_profiles.get(profile_id)
+    if profile is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(profile)
 
 @app.route('/admin/add_doctor', methods=['POST'])
 def add_doctor():
@@ -244,16 +241,17 @@ def add_doctor():
         return redirect(url_for('admin_dashboard'))
     
     # Check if username already exists
-    if username in users_db:
+    if users_db.exists(username):
         flash('Username already exists', 'danger')
         return redirect(url_for('admin_dashboard'))
     
-    # Create new doctor with proper User model constructor
-    doctor_id = str(len(users_db) + 1)
-    doctor = User(doctor_id, username, generate_password_hash(password), 'doctor')
-    doctor.email = email
-    doctor.specialization = specialization
-    users_db[username] = doctor
+    # The repository allocates the id, so concurrent additions can't collide
+    try:
+        users_db.add(username, hash_password(password), 'doctor',
+                     email=email, specialization=specialization)
+    except sqlite3.IntegrityError:
+        flash('Username already exists', 'danger')
+        return redirect(url_for('admin_dashboard'))
     
     flash(f'Doctor {username} added successfully!', 'success')
     return redirect(url_for('admin_dashboard'))
@@ -272,19 +270,47 @@ def doctor_dashboard():
         flash('Access denied. Doctors only.', 'danger')
         return redirect(url_for('patient_portal'))
     
-    all_patients = []
-    for patient_id, data in patients_data.items():
-        all_patients.append({
-            'patient_id': patient_id,
-            'name': data.get('patient_name', 'Unknown'),
-            'risk_percentage': data.get('risk_percentage', 0),
-            'stage': data.get('stage', 'N/A'),
-            'risk_level': data.get('risk_level', 'Unknown'),
-            'age': data.get('age', 'N/A'),
-            'egfr': data.get('egfr', 'N/A')
-        })
+    # Only the summary and the highest-risk patients are rendered; the table pages in via /api/patients
+    top_patients, _ = patients_data.page(sort='risk', descending=True, limit=3)
+    return render_template('doctor_dashboard.html',
+                           summary=patients_data.summary(),
+                           top_patients=[patient_row(data) for data in top_patients])
+
+def patient_row(data):
+    return {
+        'patient_id': data['patient_id'],
+        'name': data.get('patient_name', 'Unknown'),
+        'risk_percentage': data.get('risk_percentage', 0),
+        'stage': data.get('stage', 'N/A'),
+        'risk_level': data.get('risk_level', 'Unknown'),
+        'age': data.get('age', 'N/A'),
+        'egfr': data.get('egfr', 'N/A')
+    }
+
+@app.route('/api/patients')
+@login_required
+def list_patients():
+    """One page of the doctor's patient list; pass next_cursor back as ?cursor= for the next page"""
+    if not current_user.is_doctor():
+        return jsonify({'error': 'Access denied'}), 403
     
-    return render_template('doctor_dashboard.html', patients=all_patients)
+    try:
+        page, next_cursor = patients_data.page(
+            search=request.args.get('q'),
+            risk_level=request.args.get('risk_level'),
+            stage=request.args.get('stage'),
+            sort=request.args.get('sort', 'risk'),
+            descending=request.args.get('order', 'desc') == 'desc',
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'patients': [patient_row(data) for data in page],
+        'next_cursor': next_cursor
+    })
 
 @app.route('/doctor/add-patient', methods=['GET', 'POST'])
 @login_required
@@ -324,10 +350,10 @@ def add_patient():
             'anemia': int(request.form.get('anemia', 0))
         }
         
-        prediction = ckd_model.predict_risk(patient_data)
+        prediction = load_model_conditionally().predict_risk(patient_data)
         
         patient_data.update(prediction)
-        patients_data[patient_data['patient_id']] = patient_data
+        patients_data.save(patient_data)
         
         flash(f'Patient {patient_data["patient_name"]} added successfully!', 'success')
         return redirect(url_for('results', patient_id=patient_data['patient_id']))
@@ -352,9 +378,11 @@ def upload_file():
     if file and file.filename:
         try:
             if file_type == 'csv' and file.filename.endswith('.csv'):
+                if request.content_length and request.content_length > ASYNC_UPLOAD_BYTES:
+                    return submit_csv_job(file)
                 return process_csv_upload(file)
-            elif file_type == 'pdf' and file.filename.endswith('.pdf'):
-                return process_pdf_upload(file)
+            elif file_type == 'pdf' and file.filename.lower().endswith('.pdf'):
+                return process_pdf_upload(request.files.getlist('file'))
             else:
                 return jsonify({'error': 'Invalid file format'}), 400
         except Exception as e:
@@ -363,30 +391,102 @@ def upload_file():
     return jsonify({'error': 'Invalid file'}), 400
 
 def process_csv_upload(file):
-    # Handle case where pandas might not be available on Vercel
-    if pd is None:
-        flash('CSV processing is not available in this deployment environment', 'warning')
-        return jsonify({'error': 'CSV processing not available'}), 500
-    
-    df = pd.read_csv(io.StringIO(file.stream.read().decode('utf-8')))
+    summary = ingest_csv(file.stream, load_model_conditionally(), patients_data)
     
-    patient_list = df.to_dict('records')
-    results = ckd_model.predict_batch(patient_list)
+    if summary['count'] == 0 and summary['error_count']:
+        return jsonify({'error': 'No valid patient rows found in CSV', 'errors': summary['errors']}), 400
     
-    for result in results:
-        patient_id = result.get('patient_id', f"AUTO_{len(patients_data) + 1}")
-        patients_data[patient_id] = result
-    
-    flash(f'Successfully processed {len(results)} patients from CSV', 'success')
-    return jsonify({'success': True, 'count': len(results)})
+    flash(f'Successfully processed {summary["count"]} patients from CSV', 'success')
+    return jsonify({
+        'success': True,
+        'count': summary['count'],
+        'skipped': summary['error_count'],
+        'errors': summary['errors']
+    })
 
-def process_pdf_upload(file):
-    import PyPDF2
+def submit_csv_job(file):
+    # The request stream is gone once we return, so spool the upload to disk for the job
+    fd, path = tempfile.mkstemp(prefix='ckd-upload-', suffix='.csv')
+    with os.fdopen(fd, 'wb') as out:
+        file.save(out)
     
-    # For now, we'll just acknowledge the PDF upload
-    # In a real implementation, you would extract data from the PDF
-    flash('PDF file uploaded successfully. In a full implementation, patient data would be extracted from the PDF.', 'info')
-    return jsonify({'success': True, 'message': 'PDF processed successfully'})
+    job = job_manager.submit('csv_upload', current_user.id, run_csv_job, path)
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id)
+    }), 202
+
+def run_csv_job(job, path):
+    try:
+        size = os.path.getsize(path) or 1
+        with open(path, 'rb') as fh:
+            def progress(rows, error_count):
+                job.update(rows=rows, error_count=error_count, progress=fh.tell() / size)
+            summary = ingest_csv(fh, load_model_conditionally(), patients_data, progress=progress)
+        job.errors = summary['errors']
+        return {'count': summary['count'], 'skipped': summary['error_count']}
+    finally:
+        os.remove(path)
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None or job.owner != current_user.id:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+def process_pdf_upload(files):
+    files = [file for file in files if file.filename]
+    if any(not file.filename.lower().endswith('.pdf') for file in files):
+        return jsonify({'error': 'Invalid file format'}), 400
+    if len(files) > MAX_PDF_FILES:
+        return jsonify({'error': f'Upload at most {MAX_PDF_FILES} PDF reports at a time'}), 400
+    
+    # Text extraction is slow, so every PDF upload is a job; its pages are spread over the extraction pool
+    paths = []
+    try:
+        for file in files:
+            fd, path = tempfile.mkstemp(prefix='ckd-upload-', suffix='.pdf')
+            paths.append((file.filename, path))
+            with os.fdopen(fd, 'wb') as out:
+                file.save(out)
+        job = job_manager.submit('pdf_upload', current_user.id, run_pdf_job, paths)
+    except Exception:
+        for _, path in paths:
+            os.remove(path)
+        raise
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id)
+    }), 202
+
+def read_spooled_pdfs(paths):
+    """[(file name, bytes)] for spooled uploads, removing the temporary files"""
+    files = []
+    for name, path in paths:
+        try:
+            with open(path, 'rb') as fh:
+                files.append((name, fh.read()))
+        finally:
+            os.remove(path)
+    return files
+
+def run_pdf_job(job, paths):
+    reports = pdf_extract.extract_reports(read_spooled_pdfs(paths), pdf_extractions)
+    job.update(progress=0.9)
+    summary = ingest_pdf_reports(reports, load_model_conditionally(), patients_data,
+                                 progress=lambda rows, error_count: job.update(rows=rows, error_count=error_count))
+    job.errors = summary['errors']
+    if summary['count'] == 0:
+        raise ValueError('No lab values found in the PDF reports')
+    return {
+        'count': summary['count'],
+        'skipped': summary['error_count'],
+        'cached': sum(report['cached'] for report in reports)
+    }
 
 @app.route('/results/<patient_id>')
 @login_required
@@ -394,7 +494,7 @@ def results(patient_id):
     patient_data = patients_data.get(patient_id)
     
     if not patient_data:
-        patient_data = patient_records.get(current_user.username, {})
+        patient_data = patient_records.get(current_user.username) or {}
     
     if not patient_data:
         flash('Patient not found', 'danger')
@@ -417,10 +517,10 @@ def patient_dashboard():
     if current_user.is_doctor():
         return redirect(url_for('doctor_dashboard'))
     
-    patient_data = patient_records.get(current_user.username, {})
+    patient_data = patient_records.get(current_user.username) or {}
     
     # Get patient trial information
-    patient_trials = patient_upload_trials.get(current_user.username, {'remaining': 2, 'used': 0})
+    patient_trials = upload_trials.get(current_user.username)
     
     # Get available doctors
     available_doctors = [
@@ -455,16 +555,6 @@ def upload_lab_report():
     if current_user.is_doctor():
         return jsonify({'error': 'Access denied'}), 403
     
-    # Check if patient has free trials remaining
-    if current_user.username not in patient_upload_trials:
-        patient_upload_trials[current_user.username] = {'remaining': 2, 'used': 0}
-    
-    trials = patient_upload_trials[current_user.username]
-    
-    if trials['remaining'] <= 0:
-        return jsonify({'error': 'No free trials remaining. Please upgrade to continue.'}), 400
-    
-    # Handle file upload (simplified for now)
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
     
@@ -472,28 +562,64 @@ def upload_lab_report():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     
-    # Update trial count
-    trials['remaining'] -= 1
-    trials['used'] += 1
+    suffix = os.path.splitext(file.filename.lower())[1]
+    if suffix not in ('.csv', '.pdf'):
+        return jsonify({'error': 'Only CSV and PDF lab reports can be analyzed at the moment.'}), 400
     
-    # Process the lab report (simplified - would integrate with actual ML model)
-    try:
-        if file.filename.endswith('.csv'):
-            # Handle case where pandas might not be available on Vercel
-            if pd is None:
-                results = {'status': 'warning', 'message': 'CSV analysis not available in this environment', 'file_type': 'csv'}
-            else:
-                df = pd.read_csv(file)
-                # Process CSV data
-                results = {'status': 'success', 'message': 'Lab report analyzed successfully', 'data_points': len(df)}
-        else:
-            # For PDF/Excel files, would need additional processing
-            results = {'status': 'success', 'message': 'Lab report uploaded successfully', 'file_type': file.filename.split('.')[-1]}
-        
-        return jsonify(results)
+    hold = upload_trials.reserve(current_user.username)
+    if hold is None:
+        return jsonify({'error': 'No free trials remaining. Please upgrade to continue.'}), 400
     
+    # Parsing and scoring run on the job pool; the dashboard polls status_url for the result
+    try:
+        fd, path = tempfile.mkstemp(prefix='ckd-lab-', suffix=suffix)
+        with os.fdopen(fd, 'wb') as out:
+            file.save(out)
+        job = job_manager.submit('lab_report', current_user.id, run_lab_job, path, current_user.username, hold)
     except Exception as e:
+        upload_trials.settle(current_user.username, hold, spent=False)
         return jsonify({'error': f'Error processing file: {str(e)}'}), 500
+    
+    return jsonify({
+        'status': 'processing',
+        'message': 'Lab report received. Analyzing...',
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id)
+    }), 202
+
+def run_lab_job(job, path, username, hold):
+    spent = False
+    try:
+        model = load_model_conditionally()
+        progress = lambda rows, error_count: job.update(rows=rows, error_count=error_count)
+        if path.endswith('.pdf'):
+            errors = []
+            with open(path, 'rb') as fh:
+                reports = pdf_extract.extract_reports([('Lab report', fh.read())], pdf_extractions)
+            # The patient's profile supplies age and gender, not what the report prints
+            summary = ingest_lab_rows(pdf_report_rows(reports, errors, include_patient=False),
+                                      model, patient_records, username, progress)
+            summary['errors'] = errors + summary['errors']
+            summary['error_count'] += len(errors)
+        else:
+            with open(path, 'rb') as fh:
+                summary = ingest_lab_report(fh, model, patient_records, username, progress)
+        job.errors = summary['errors']
+        if summary['count'] == 0:
+            raise ValueError('No lab results found in the report')
+        latest = summary['latest']
+        result = {
+            'count': summary['count'],
+            'skipped': summary['error_count'],
+            'latest': {field: latest.get(field) for field in ('date', 'risk_percentage', 'risk_level', 'stage', 'egfr')}
+        }
+        result['trials'] = upload_trials.settle(username, hold, spent=True)
+        spent = True
+        return result
+    finally:
+        if not spent:
+            upload_trials.settle(username, hold, spent=False)
+        os.remove(path)
 
 @app.route('/patient/book-appointment', methods=['POST'])
 @login_required
@@ -516,7 +642,7 @@ def book_appointment():
         'preferred_date': preferred_date,
         'preferred_time': preferred_time,
         'status': 'pending',
-        'created_at': pd.Timestamp.now().isoformat()
+        'created_at': datetime.now().isoformat()
     }
     
     # In a real implementation, this would be saved to a database
@@ -529,11 +655,11 @@ def book_appointment():
 
 @app.route('/modern-dashboard')
 def modern_dashboard():
-    return render_template('modern_dashboard.html')
+    return page_cache.response('modern_dashboard.html')
 
 @app.route('/kidneycompanion')
 def kidneycompanion_landing():
-    return render_template('kidneycompanion_landing.html')
+    return page_cache.response('kidneycompanion_landing.html')
 
 @app.route('/favicon.ico')
 def favicon():
@@ -546,36 +672,120 @@ def patient_trends(username):
     if current_user.username != username and not current_user.is_doctor():
         return jsonify({'error': 'Access denied'}), 403
     
-    patient_data = patient_records.get(username, {})
-    
-    if not patient_data or 'history' not in patient_data:
+    # Served from the columnar lab series: a date-range slice, optionally downsampled with ?max_points=
+    try:
+        series = patient_records.series.get(
+            username,
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            max_points=request.args.get('max_points', type=int)
+        )
+    except ValueError:
+        return jsonify({'error': 'start and end must be YYYY-MM-DD dates'}), 400
+    
+    if not series:
         return jsonify({'error': 'No data available'}), 404
     
-    history = patient_data['history']
-    
-    # Handle case where pandas might not be available
-    if pd is not None:
-        dates = [record['date'] for record in reversed(history)]
-        creatinine = [record['serum_creatinine'] for record in reversed(history)]
-        egfr = [record['egfr'] for record in reversed(history)]
-        blood_urea = [record['blood_urea'] for record in reversed(history)]
-        hemoglobin = [record['hemoglobin'] for record in reversed(history)]
-    else:
-        # Simplified data processing when pandas is not available
-        dates = [record.get('date', '') for record in reversed(history)]
-        creatinine = [record.get('serum_creatinine', 0) for record in reversed(history)]
-        egfr = [record.get('egfr', 0) for record in reversed(history)]
-        blood_urea = [record.get('blood_urea', 0) for record in reversed(history)]
-        hemoglobin = [record.get('hemoglobin', 0) for record in reversed(history)]
+    profile = patient_records.profile(username) or {}
+    creatinine = series.values('serum_creatinine', missing=0)
+    
+    # Chart the stored eGFR; only results without one get it derived from creatinine
+    # with the deployment's formula, in one vectorized call
+    egfr = series.values('egfr')
+    missing = [i for i, value in enumerate(egfr) if value is None and creatinine[i]]
+    computed = clinical.egfr_values(
+        [profile.get('age', 50)] * len(missing),
+        [creatinine[i] for i in missing],
+        [profile.get('gender', 'male')] * len(missing)
+    )
+    for i, value in zip(missing, computed):
+        egfr[i] = value
+    egfr = [0 if value is None else value for value in egfr]
     
     return jsonify({
-        'dates': dates,
+        'dates': series.dates(),
         'creatinine': creatinine,
         'egfr': egfr,
-        'blood_urea': blood_urea,
-        'hemoglobin': hemoglobin
+        'blood_urea': series.values('blood_urea', missing=0),
+        'hemoglobin': series.values('hemoglobin', missing=0)
     })
 
+@app.route('/api/predict', methods=['POST'])
+def api_predict():
+    """Score a JSON array or an NDJSON stream of patient records, streaming NDJSON results back.
+
+    Each output line is the prediction for one input record, in input order,
+    tagged with its 'line' (1-based position); invalid records get an 'error'
+    line instead. Records are scored in chunks as they are read, so results
+    start arriving before the whole request body has been sent.
+    """
+    authorization = request.headers.get('Authorization', '')
+    token_ok = bool(API_TOKEN) and hmac.compare_digest(authorization, f"Bearer {API_TOKEN}")
+    if not token_ok and not (current_user.is_authenticated and current_user.is_doctor()):
+        return jsonify({'error': 'Access denied'}), 403
+    
+    model = load_model_conditionally()
+    if request.mimetype in NDJSON_TYPES:
+        rows = iter_ndjson_rows(request.stream)
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return jsonify({'error': 'Expected a JSON array of patient records or an NDJSON body'}), 400
+        rows = iter_json_rows(items)
+    
+    def generate():
+        for result in score_stream(rows, model):
+            yield json.dumps(result, separators=(',', ':')) + '\n'
+    
+    return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/cohort/declining')
+@login_required
+def cohort_declining():
+    """Patients whose eGFR is falling fastest, steepest least-squares slope first"""
+    if not current_user.is_doctor():
+        return jsonify({'error': 'Access denied'}), 403
+    
+    limit = max(1, min(request.args.get('limit', 20, type=int), 200))
+    min_points = max(2, request.args.get('min_points', 3, type=int))
+    return jsonify({'patients': cohort_trends.fastest_declining(limit=limit, min_points=min_points)})
+
+@app.route('/api/model/status')
+@login_required
+def model_status():
+    if not current_user.is_doctor():
+        return jsonify({'error': 'Access denied'}), 403
+    
+    model = load_model_conditionally()
+    cache = getattr(model, 'prediction_cache', None)
+    return jsonify({
+        'version': getattr(model, 'version', None),
+        'memory': process_memory(),
+        'prediction_cache': cache.stats() if cache is not None else None
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request and stage latency histograms in the Prometheus text format"""
+    if not metrics.ENABLED:
+        return 'Metrics are disabled', 404
+    return metrics.registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+def warm_up():
+    """Import and load the model and score one sample, so the first real request doesn't pay for it"""
+    start = time.perf_counter()
+    model = load_model_conditionally()
+    model.predict_risk({'age': 50, 'gender': 'male', 'serum_creatinine': 1.0})
+    logger.info(f"Model warm-up finished in {time.perf_counter() - start:.2f}s")
+
+# PDF extraction pool workers re-import the main script as __mp_main__ (python app.py); they never need the model
+if __name__ == '__mp_main__':
+    pass
+elif WARM_UP == 'sync':
+    warm_up()
+elif WARM_UP == 'background':
+    threading.Thread(target=warm_up, name='ckd-warm-up', daemon=True).start()
+
 # Vercel requires this for the serverless function
 def main():
     """Entry point for the application."""
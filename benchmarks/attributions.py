@@ -0,0 +1,85 @@
+"""
+Benchmark per-patient feature attributions against the old per-row cost.
+
+    python benchmarks/attributions.py [--rows 10000]
+
+Compares, per patient row:
+  * legacy     - the previous get_feature_importance (global importances re-sorted for every row)
+  * per-row    - tree-path attributions computed one patient at a time
+  * batch      - tree-path attributions + top-k for the whole batch in one pass
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.ckd_model import ckd_model  # noqa: E402
+
+
+def legacy_feature_importance(model, features):
+    importance = model.model.feature_importances_
+    feature_importance = []
+    for name, value, imp in zip(model.feature_names, features, importance):
+        if imp > 0.01:
+            feature_importance.append({
+                'name': name.replace('_', ' ').title(),
+                'value': round(value, 2),
+                'importance': round(imp * 100, 2)
+            })
+    return sorted(feature_importance, key=lambda x: x['importance'], reverse=True)[:5]
+
+
+def synthetic_features(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    scaler = ckd_model.scaler
+    return rng.normal(size=(n_rows, len(ckd_model.feature_names))) * 2 * scaler.scale_ + scaler.mean_
+
+
+def timed(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(n_rows):
+    features = synthetic_features(n_rows)
+    scaled = (features - ckd_model.scaler.mean_) / ckd_model.scaler.scale_
+    sample = features[:min(n_rows, 1000)]
+
+    def legacy():
+        for row in sample.tolist():
+            legacy_feature_importance(ckd_model, row)
+
+    def per_row():
+        for row in sample.tolist():
+            ckd_model.get_feature_importance(row)
+
+    def batch():
+        _, contributions = ckd_model.engine.explain(scaled)
+        ckd_model.get_feature_attributions_batch(features, contributions)
+
+    return {
+        'legacy': timed(legacy) / len(sample),
+        'per-row': timed(per_row) / len(sample),
+        'batch': timed(batch) / n_rows,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    for label, seconds in run(args.rows).items():
+        print(f"{label:>8}: {seconds * 1e6:8.1f} us/row")
+
+
+if __name__ == '__main__':
+    main()
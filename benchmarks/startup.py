@@ -0,0 +1,92 @@
+"""
+Cold-start report: what a fresh process pays before it can serve requests.
+
+    python benchmarks/startup.py [--top 15]
+
+Each measurement runs in a new interpreter so nothing is already imported:
+  * imports    - the slowest modules imported by `import app` (python -X importtime)
+  * landing    - importing app and serving /landing, with warm-up disabled
+  * model      - loading the model and scoring the first patient afterwards
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _python(args, env=None):
+    return subprocess.run([sys.executable] + args, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def import_costs():
+    """(module, self seconds, cumulative seconds) for each module imported by app, slowest first"""
+    result = _python(['-X', 'importtime', '-c', 'import app'], env=dict(os.environ, CKD_WARM_UP='off'))
+    costs = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        costs.append((name.strip(), depth, int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return costs
+
+
+def child():
+    """Runs inside the fresh interpreter and prints the timings as JSON"""
+    timings = {}
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    from app import app
+    timings['import_app'] = time.perf_counter() - start
+
+    client = app.test_client()
+    response = client.get('/landing')
+    timings['landing_status'] = response.status_code
+    timings['first_landing'] = time.perf_counter() - start
+    timings['heavy_modules_loaded'] = sorted(
+        name for name in ('pandas', 'sklearn', 'joblib', 'scipy', 'PIL', 'PyPDF2') if name in sys.modules
+    )
+
+    from models.model_loader import load_model_conditionally
+    mark = time.perf_counter()
+    model = load_model_conditionally()
+    timings['model_load'] = time.perf_counter() - mark
+    mark = time.perf_counter()
+    model.predict_risk({'age': 50, 'gender': 'male', 'serum_creatinine': 1.0})
+    timings['first_prediction'] = time.perf_counter() - mark
+    print(json.dumps(timings))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=15, help='number of modules to list')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child()
+        return
+
+    costs = import_costs()
+    # Top-level packages only: a module's cumulative time already includes its own imports
+    top_level = sorted((cost for cost in costs if cost[1] <= 1), key=lambda cost: cost[3], reverse=True)
+    print(f"{'module':<40} {'self ms':>9} {'total ms':>9}")
+    for name, _, self_s, cumulative_s in top_level[:args.top]:
+        print(f"{name:<40} {self_s * 1e3:9.1f} {cumulative_s * 1e3:9.1f}")
+
+    env = dict(os.environ, CKD_WARM_UP='off')
+    timings = json.loads(_python([os.path.abspath(__file__), '--child'], env=env).stdout.strip().splitlines()[-1])
+    print()
+    print(f"import app:          {timings['import_app'] * 1e3:8.1f} ms")
+    print(f"first /landing:      {timings['first_landing'] * 1e3:8.1f} ms (status {timings['landing_status']})")
+    print(f"heavy modules by then: {', '.join(timings['heavy_modules_loaded']) or 'none'}")
+    print(f"model load:          {timings['model_load'] * 1e3:8.1f} ms")
+    print(f"first prediction:    {timings['first_prediction'] * 1e3:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""
+Reproducible benchmark suite for inference, ingestion, page rendering and startup.
+
+    python benchmarks/suite.py run [--quick] [--only predict dashboard] [--output FILE]
+    python benchmarks/suite.py compare BASELINE.json CANDIDATE.json [--threshold 0.10]
+
+`run` times every case and writes the results as JSON (by default to
+benchmarks/results/<commit>-<timestamp>.json) together with the commit,
+Python and NumPy versions and the host, so two runs can be compared later.
+`compare` lines up two result files case by case on the median and exits
+with status 1 when any case got slower by more than the threshold.
+
+Cases:
+  * predict_single     - CKDModel.predict_risk for one patient, prediction cache cleared
+  * predict_batch/N    - CKDModel.predict_batch on N distinct patients (1k, 10k, 100k)
+  * csv_upload/N       - POST /doctor/upload-file with an N-row CSV, parsed, scored and stored
+  * dashboard/N        - GET /doctor/dashboard with N patients stored
+  * startup/*          - a fresh interpreter importing app, serving /landing and loading the model
+
+Patients are synthetic with a fixed seed, and everything runs against a
+throwaway database (CKD_DB_PATH), so the instance database is never touched.
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+sys.path.insert(0, ROOT)
+
+SEED = 2025
+CSV_COLUMNS = (
+    'patient_id', 'patient_name', 'age', 'gender', 'bp_systolic', 'bp_diastolic', 'serum_creatinine',
+    'blood_urea', 'hemoglobin', 'blood_glucose', 'sodium', 'potassium', 'red_blood_cell_count',
+    'white_blood_cell_count', 'packed_cell_volume', 'specific_gravity', 'albumin', 'sugar',
+    'red_blood_cells', 'pus_cell', 'bacteria', 'hypertension', 'diabetes_mellitus',
+    'coronary_artery_disease', 'appetite', 'pedal_edema', 'anemia'
+)
+
+# (sizes, repeats) per group; --quick trades coverage for a run of a few seconds
+FULL = {
+    'predict_single': ((1,), 200),
+    'predict_batch': ((1000, 10000, 100000), 5),
+    'csv_upload': ((100, 1000, 10000), 5),
+    'dashboard': ((100, 10000, 100000), 20),
+    'startup': ((1,), 3),
+}
+QUICK = {
+    'predict_single': ((1,), 50),
+    'predict_batch': ((1000, 10000), 3),
+    'csv_upload': ((100, 1000), 3),
+    'dashboard': ((100, 10000), 5),
+    'startup': ((1,), 1),
+}
+
+
+def synthetic_patients(count, seed=SEED, prefix='B'):
+    """Distinct, plausible patients (so the prediction cache never answers for them)"""
+    rng = random.Random(seed)
+    patients = []
+    for i in range(count):
+        patients.append({
+            'patient_id': f"{prefix}{i:06d}",
+            'patient_name': f"Patient {i}",
+            'age': rng.randint(20, 90),
+            'gender': rng.choice(('male', 'female')),
+            'bp_systolic': rng.randint(100, 180),
+            'bp_diastolic': rng.randint(60, 110),
+            'serum_creatinine': round(rng.uniform(0.5, 6.0), 2),
+            'blood_urea': rng.randint(10, 150),
+            'hemoglobin': round(rng.uniform(8.0, 17.0), 1),
+            'blood_glucose': rng.randint(70, 300),
+            'sodium': rng.randint(125, 150),
+            'potassium': round(rng.uniform(3.0, 6.5), 1),
+            'red_blood_cell_count': round(rng.uniform(3.0, 6.0), 1),
+            'white_blood_cell_count': rng.randint(4000, 15000),
+            'packed_cell_volume': rng.randint(25, 52),
+            'specific_gravity': rng.choice((1.005, 1.010, 1.015, 1.020, 1.025)),
+            'albumin': rng.randint(0, 5),
+            'sugar': rng.randint(0, 5),
+            'red_blood_cells': rng.randint(0, 1),
+            'pus_cell': rng.randint(0, 1),
+            'bacteria': rng.randint(0, 1),
+            'hypertension': rng.randint(0, 1),
+            'diabetes_mellitus': rng.randint(0, 1),
+            'coronary_artery_disease': rng.randint(0, 1),
+            'appetite': rng.randint(0, 1),
+            'pedal_edema': rng.randint(0, 1),
+            'anemia': rng.randint(0, 1),
+        })
+    return patients
+
+
+def csv_bytes(patients):
+    lines = [','.join(CSV_COLUMNS)]
+    lines.extend(','.join(str(patient[column]) for column in CSV_COLUMNS) for patient in patients)
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def measure(fn, repeat, setup=None):
+    """Call fn `repeat` times (after one untimed warm-up), running setup untimed before each call"""
+    if setup:
+        setup()
+    fn()
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def summarize(samples):
+    return {
+        'repeat': len(samples),
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+class Suite:
+    def __init__(self, plan):
+        self.plan = plan
+        self._client = None
+
+    def client(self):
+        """A Flask test client logged in as the demo doctor"""
+        if self._client is None:
+            from app import app
+            self._client = app.test_client()
+            response = self._client.post('/doctor/login', data={'username': 'doctor1', 'password': 'doctor123'})
+            if response.status_code != 302:
+                raise RuntimeError(f"benchmark login failed with status {response.status_code}")
+        return self._client
+
+    def model(self):
+        from models.model_loader import load_model_conditionally
+        return load_model_conditionally()
+
+    def predict_single(self, _size, repeat):
+        model = self.model()
+        patient = synthetic_patients(1)[0]
+        yield 'predict_single', measure(lambda: model.predict_risk(patient), repeat, model.prediction_cache.clear)
+
+    def predict_batch(self, size, repeat):
+        model = self.model()
+        patients = synthetic_patients(size)
+        result = measure(lambda: model.predict_batch(patients), repeat, model.prediction_cache.clear)
+        result['rows_per_second'] = size / result['median']
+        yield f"predict_batch/{size}", result
+
+    def csv_upload(self, size, repeat):
+        client = self.client()
+        model = self.model()
+        body = csv_bytes(synthetic_patients(size, prefix='U'))
+
+        def upload():
+            response = client.post('/doctor/upload-file', content_type='multipart/form-data',
+                                   data={'file': (io.BytesIO(body), 'patients.csv')})
+            if response.status_code != 200:
+                raise RuntimeError(f"upload failed with status {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+        result = measure(upload, repeat, model.prediction_cache.clear)
+        result['rows_per_second'] = size / result['median']
+        yield f"csv_upload/{size}", result
+
+    def dashboard(self, size, repeat):
+        from models.user import patients_data
+        client = self.client()
+        model = self.model()
+        stored = patients_data.count()
+        if stored < size:
+            # Top the store up to `size` patients, scored the same way an upload would store them
+            patients = synthetic_patients(size - stored, seed=SEED + size, prefix=f"D{size}_")
+            for record, prediction in zip(patients, model.predict_batch(patients)):
+                record.update(prediction)
+            patients_data.save_many(patients)
+
+        def render():
+            response = client.get('/doctor/dashboard')
+            if response.status_code != 200:
+                raise RuntimeError(f"dashboard failed with status {response.status_code}")
+
+        result = measure(render, repeat)
+        result['patients'] = patients_data.count()
+        yield f"dashboard/{size}", result
+
+    def startup(self, _size, repeat):
+        """Run benchmarks/startup.py's child in fresh interpreters, one sample per process"""
+        env = dict(os.environ, CKD_WARM_UP='off')
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, os.path.join(ROOT, 'benchmarks', 'startup.py'), '--child'],
+                cwd=ROOT, env=env, capture_output=True, text=True, check=True
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        for key in ('import_app', 'first_landing', 'model_load', 'first_prediction'):
+            yield f"startup/{key}", summarize([run[key] for run in runs])
+
+    def run(self, only=None):
+        results = {}
+        for group, (sizes, repeat) in self.plan.items():
+            if only and group not in only:
+                continue
+            for size in sizes:
+                for name, result in getattr(self, group)(size, repeat):
+                    results[name] = result
+                    print(f"{name:<28} median {result['median'] * 1e3:10.3f} ms   "
+                          f"min {result['min'] * 1e3:10.3f} ms   n={result['repeat']}", flush=True)
+        return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': numpy_version,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(args):
+    # Set before the app is imported: a throwaway database, no background warm-up, uploads handled inline
+    workdir = tempfile.mkdtemp(prefix='ckd-bench-')
+    os.environ['CKD_DB_PATH'] = os.path.join(workdir, 'bench.sqlite3')
+    os.environ['CKD_WARM_UP'] = 'off'
+    os.environ['CKD_ASYNC_UPLOAD_BYTES'] = str(1 << 40)
+
+    meta = environment()
+    meta['mode'] = 'quick' if args.quick else 'full'
+    results = Suite(QUICK if args.quick else FULL).run(args.only)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{meta['commit'] or 'nocommit'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w') as fh:
+        json.dump({'environment': meta, 'results': results}, fh, indent=2, sort_keys=True)
+    print(f"results written to {output}")
+
+
+def compare(args):
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    with open(args.candidate) as fh:
+        candidate = json.load(fh)
+    for label, data in (('baseline', baseline), ('candidate', candidate)):
+        meta = data['environment']
+        print(f"{label:<10} {meta.get('commit')} {meta.get('timestamp')} python {meta.get('python')} on {meta.get('machine')}")
+    print()
+
+    regressions = []
+    print(f"{'case':<28} {'baseline ms':>12} {'candidate ms':>13} {'change':>9}")
+    for name in sorted(set(baseline['results']) | set(candidate['results'])):
+        before = baseline['results'].get(name)
+        after = candidate['results'].get(name)
+        if before is None or after is None:
+            print(f"{name:<28} {'-' if before is None else format(before['median'] * 1e3, '12.3f'):>12} "
+                  f"{'-' if after is None else format(after['median'] * 1e3, '13.3f'):>13} {'n/a':>9}")
+            continue
+        change = after['median'] / before['median'] - 1
+        flag = ''
+        if change > args.threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif change < -args.threshold:
+            flag = '  faster'
+        print(f"{name:<28} {before['median'] * 1e3:12.3f} {after['median'] * 1e3:13.3f} {change:+9.1%}{flag}")
+
+    if regressions:
+        print(f"\n{len(regressions)} case(s) slower than the {args.threshold:.0%} threshold: {', '.join(regressions)}")
+        return 1
+    print(f"\nno case slower than the {args.threshold:.0%} threshold")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the suite and write a results file')
+    run_parser.add_argument('--quick', action='store_true', help='smaller sizes and fewer repeats')
+    run_parser.add_argument('--only', nargs='+', choices=sorted(FULL), help='run only these case groups')
+    run_parser.add_argument('--output', help='results file (default: benchmarks/results/<commit>-<time>.json)')
+
+    compare_parser = commands.add_parser('compare', help='compare two results files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help='relative slowdown of the median counted as a regression (default 0.10)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        run(args)
+        return 0
+    return compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
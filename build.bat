@@ -11,6 +11,13 @@ for /d %%i in (*.egg-info) do rmdir /s /q "%%i"
 REM Create necessary directories
 mkdir build
 
+REM Refresh the compact model export used by the lightweight deployment (needs the full requirements)
+python -m models.compact_forest export || echo Could not export compact model - shipping the committed models\ckd_forest.json.gz
+
+REM Fingerprint static assets and generate right-sized WebP images (needs the build requirements)
+pip install -r requirements-build.txt || (echo Could not install the build requirements ^(requirements-build.txt^) & exit /b 1)
+python -m models.assets build || (echo Asset build failed & exit /b 1)
+
 REM Copy only essential files for deployment
 xcopy templates build\templates\ /E /I /H
 xcopy static build\static\ /E /I /H
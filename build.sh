@@ -11,6 +11,13 @@ rm -rf *.egg-info/
 # Create necessary directories
 mkdir -p build/
 
+# Refresh the compact model export used by the lightweight deployment (needs the full requirements)
+python -m models.compact_forest export || echo "Could not export compact model - shipping the committed models/ckd_forest.json.gz"
+
+# Fingerprint static assets and generate right-sized WebP images (needs the build requirements)
+pip install -r requirements-build.txt || { echo "Could not install the build requirements (requirements-build.txt)"; exit 1; }
+python -m models.assets build || { echo "Asset build failed"; exit 1; }
+
 # Copy only essential files for deployment
 cp -r templates/ build/
 cp -r static/ build/
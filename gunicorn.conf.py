@@ -0,0 +1,33 @@
+"""
+Gunicorn settings for self-hosted deployments:
+
+    gunicorn app:app
+
+With preloading (the default, CKD_PRELOAD=0 to disable) the master imports
+the app and loads the model once before forking, so every worker starts with
+the model ready and shares the master's memory pages copy-on-write instead of
+loading its own copy.  `python -m models.memory_report <master pid>` shows
+how much of each worker is shared.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = os.environ.get('CKD_PRELOAD', '1') != '0'
+
+if preload_app:
+    # Load the model while importing the app in the master; a background warm-up thread would not survive fork
+    os.environ.setdefault('CKD_WARM_UP', 'sync')
+
+
+def when_ready(server):
+    if preload_app:
+        # Move everything loaded so far out of the collector's reach: a collection in a worker
+        # would otherwise write to every object's GC header and un-share those pages
+        gc.collect()
+        gc.freeze()
+        server.log.info(f"Froze {gc.get_freeze_count()} preloaded objects before forking workers")
+
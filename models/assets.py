@@ -0,0 +1,320 @@
+"""
+Static asset pipeline: right-sized images, content-hashed names and a manifest.
+
+    python -m models.assets build      (run by build.sh / build.bat)
+
+Building needs the build requirements (requirements-build.txt: Pillow and
+brotli).  Without Pillow the build fails rather than ship full-size images;
+pass --no-images to fingerprint and precompress only.
+
+writes static/dist/ from static/:
+  * every file copied under a name carrying a hash of its content
+    (css/style.css -> css/style.1f2e3d4c5b6a.css), so it can be cached forever
+  * for images, resized copies at the WIDTHS narrower than the original, as
+    PNG/JPEG and WebP (needs Pillow)
+  * for text assets, .gz and (with the brotli package) .br siblings
+  * manifest.json mapping each source path to its files
+
+Templates call asset_url('css/style.css') / asset_srcset('images/CKD.png',
+'webp') instead of url_for('static', ...).  They resolve through the manifest
+to /assets/<hashed name>, which is served with immutable caching and the
+precompressed encoding the client accepts.  Without a manifest (the build
+hasn't run) they fall back to the plain /static URLs.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import sys
+import threading
+from io import BytesIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(ROOT, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_FILE = 'manifest.json'
+
+# Image widths generated for srcset; pages show these images at 120-600 CSS pixels
+WIDTHS = (160, 320, 640, 1024)
+RESIZABLE = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG'}
+WEBP_QUALITY = 80
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.ico'}
+# Compressed copies that aren't at least this much smaller aren't worth serving
+MIN_SAVING = 0.9
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def _hashed_name(path, data, suffix=''):
+    """'images/Kidney stone.png' -> 'images/Kidney-stone.<hash><suffix>.png'"""
+    directory, filename = os.path.split(path)
+    stem, ext = os.path.splitext(filename)
+    return os.path.join(directory, f"{stem.replace(' ', '-')}.{hashlib.sha256(data).hexdigest()[:12]}{suffix}{ext}")
+
+
+def _write(dist, name, data):
+    target = os.path.join(dist, name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as fh:
+        fh.write(data)
+    return name.replace(os.sep, '/')
+
+
+def _encode(image, fmt):
+    buffer = BytesIO()
+    if fmt == 'WEBP':
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6)
+    elif fmt == 'JPEG':
+        image.convert('RGB').save(buffer, 'JPEG', quality=85, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def _has_pillow():
+    # Pillow is only imported by the offline build, never by the web processes that import this module
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _image_variants(path, data, dist):
+    """Resized and WebP copies of one image: [{'width', 'format', 'file'}], narrowest first"""
+    from PIL import Image
+
+    fmt = RESIZABLE[os.path.splitext(path)[1].lower()]
+    with Image.open(BytesIO(data)) as original:
+        original.load()
+        widths = [width for width in WIDTHS if width < original.width] + [original.width]
+        variants = []
+        for width in widths:
+            if width == original.width:
+                image = original
+            else:
+                image = original.resize((width, round(original.height * width / original.width)), Image.LANCZOS)
+            for variant_format in (fmt, 'WEBP'):
+                if width == original.width and variant_format == fmt:
+                    continue  # that's the fingerprinted original
+                encoded = _encode(image, variant_format)
+                ext = '.webp' if variant_format == 'WEBP' else os.path.splitext(path)[1]
+                name = _hashed_name(os.path.splitext(path)[0] + ext, encoded, f".{width}w")
+                variants.append({'width': width, 'format': ext.lstrip('.').lower(),
+                                 'file': _write(dist, name, encoded)})
+    return original.width, variants
+
+
+def _precompress(dist, name, data):
+    """Write .gz/.br siblings worth serving; returns the encodings written"""
+    encodings = []
+    candidates = [('gzip', '.gz', lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        candidates.insert(0, ('br', '.br', lambda: brotli.compress(data, quality=11)))
+    for encoding, suffix, compress in candidates:
+        compressed = compress()
+        if len(compressed) < len(data) * MIN_SAVING:
+            _write(dist, name + suffix, compressed)
+            encodings.append(encoding)
+    return encodings
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR, images=True):
+    """Rebuild dist_dir from static_dir and return the manifest.
+
+    Raises RuntimeError when images is set and Pillow isn't installed; with
+    images=False, images are only fingerprinted.
+    """
+    if images and not _has_pillow():
+        raise RuntimeError("Pillow is not installed - cannot resize images or convert them to WebP "
+                           "(pip install -r requirements-build.txt, or build with --no-images)")
+    if brotli is None:
+        logger.warning("brotli is not installed - text assets get .gz variants only "
+                       "(pip install -r requirements-build.txt)")
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+
+    assets = {}
+    for directory, subdirectories, filenames in os.walk(static_dir):
+        # Never fingerprint a previous build's output
+        subdirectories[:] = sorted(
+            d for d in subdirectories if os.path.abspath(os.path.join(directory, d)) != os.path.abspath(dist_dir)
+        )
+        for filename in sorted(filenames):
+            source = os.path.join(directory, filename)
+            path = os.path.relpath(source, static_dir)
+            with open(source, 'rb') as fh:
+                data = fh.read()
+            name = _write(dist_dir, _hashed_name(path, data), data)
+            entry = {'file': name, 'bytes': len(data)}
+            ext = os.path.splitext(path)[1].lower()
+            if ext in COMPRESSIBLE:
+                entry['encodings'] = _precompress(dist_dir, name, data)
+            elif ext in RESIZABLE and images:
+                entry['width'], entry['variants'] = _image_variants(path, data, dist_dir)
+            assets[path.replace(os.sep, '/')] = entry
+
+    manifest = {'version': 1, 'assets': assets}
+    with open(os.path.join(dist_dir, MANIFEST_FILE), 'w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    return manifest
+
+
+class AssetManifest:
+    """The build's manifest, loaded on first use and again whenever a build rewrites it;
+    empty when the build hasn't run"""
+
+    def __init__(self, dist_dir=DIST_DIR):
+        self.dist_dir = dist_dir
+        self.encodings = {}
+        self._version = None
+        self._assets = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _manifest_mtime(self):
+        try:
+            return os.stat(os.path.join(self.dist_dir, MANIFEST_FILE)).st_mtime_ns
+        except OSError:
+            return None
+
+    @property
+    def assets(self):
+        # One stat per access: a rebuild deletes the old hashed files, so stale names must not linger
+        mtime = self._manifest_mtime()
+        if self._assets is None or mtime != self._mtime:
+            with self._lock:
+                if self._assets is None or mtime != self._mtime:
+                    self._assets = self._load()
+                    self._mtime = mtime
+        return self._assets
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.dist_dir, MANIFEST_FILE), 'rb') as fh:
+                raw = fh.read()
+            assets = json.loads(raw)['assets']
+        except (OSError, ValueError, KeyError):
+            logger.info("No asset manifest - serving unfingerprinted static files")
+            self.encodings, self._version = {}, None
+            return {}
+        # Map served names back to their entries for the encodings lookup
+        self.encodings = {entry['file']: entry.get('encodings', []) for entry in assets.values()}
+        self._version = hashlib.sha256(raw).hexdigest()[:12]
+        return assets
+
+    @property
+    def version(self):
+        """Hash of the current manifest (None without one); pages rendered from it are cached under it"""
+        self.assets
+        return self._version
+
+    def reload(self):
+        with self._lock:
+            self._assets = None
+
+    def entry(self, filename):
+        return self.assets.get(filename)
+
+    def file(self, filename, width=None, format=None):
+        """The served name for a static file, optionally the narrowest variant at least `width` wide"""
+        entry = self.entry(filename)
+        if entry is None:
+            return None
+        if width is None and format is None:
+            return entry['file']
+        wanted = format or os.path.splitext(filename)[1].lstrip('.').lower()
+        candidates = [variant for variant in entry.get('variants', []) if variant['format'] == wanted]
+        if not candidates:
+            return entry['file']
+        for variant in candidates:
+            if width is None or variant['width'] >= width:
+                return variant['file']
+        return candidates[-1]['file']
+
+    def srcset(self, filename, format=None):
+        """[(name, width)] for a srcset attribute, narrowest first; empty without variants"""
+        entry = self.entry(filename)
+        if entry is None or 'variants' not in entry:
+            return []
+        wanted = format or os.path.splitext(filename)[1].lstrip('.').lower()
+        widths = [(variant['file'], variant['width']) for variant in entry['variants'] if variant['format'] == wanted]
+        if wanted == os.path.splitext(filename)[1].lstrip('.').lower():
+            widths.append((entry['file'], entry['width']))
+        return widths
+
+
+manifest = AssetManifest()
+
+
+def init_app(app):
+    """Register asset_url/asset_srcset for templates and the /assets route serving fingerprinted files"""
+    from flask import abort, request, send_from_directory, url_for
+    from werkzeug.security import safe_join
+
+    def asset_url(filename, width=None, format=None):
+        name = manifest.file(filename, width, format)
+        if name is None:
+            return url_for('static', filename=filename)
+        return url_for('asset', filename=name)
+
+    def asset_srcset(filename, format=None):
+        return ', '.join(f"{url_for('asset', filename=name)} {width}w" for name, width in manifest.srcset(filename, format))
+
+    app.jinja_env.globals.update(asset_url=asset_url, asset_srcset=asset_srcset)
+
+    @app.route('/assets/<path:filename>', endpoint='asset')
+    def asset(filename):
+        if not manifest.assets or safe_join(manifest.dist_dir, filename) is None:
+            abort(404)
+        served, encoding = filename, None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if candidate in manifest.encodings.get(filename, ()) and request.accept_encodings.quality(candidate) > 0:
+                served, encoding = filename + suffix, candidate
+                break
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(manifest.dist_dir, served, mimetype=mimetype, max_age=31536000)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        if filename in manifest.encodings:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] != ['build'] or set(argv[1:]) - {'--no-images'}:
+        print("usage: python -m models.assets build [--no-images]")
+        return 1
+    logging.basicConfig(level=logging.INFO)
+    try:
+        assets = build(images='--no-images' not in argv)['assets']
+    except RuntimeError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    before = sum(entry['bytes'] for entry in assets.values())
+    print(f"Built {len(assets)} assets into {os.path.relpath(DIST_DIR, ROOT)}/ ({before / 1024:.0f} KB of sources)")
+    for path, entry in sorted(assets.items()):
+        variants = entry.get('variants', [])
+        if variants:
+            smallest = min(os.path.getsize(os.path.join(DIST_DIR, variant['file'])) for variant in variants)
+            print(f"  {path:<40} {entry['bytes'] / 1024:8.0f} KB -> {len(variants)} variants, smallest {smallest / 1024:.1f} KB")
+        elif entry.get('encodings'):
+            print(f"  {path:<40} {entry['bytes'] / 1024:8.0f} KB, precompressed: {', '.join(entry['encodings'])}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,24 @@
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
-import joblib
+import logging
 import os
 
+from . import clinical, metrics, model_registry
+from .prediction_cache import PredictionCache
+from .tree_engine import ForestEngine
+
+logger = logging.getLogger(__name__)
+
 class CKDModel:
-    def __init__(self):
-        self.model = None
-        self.scaler = StandardScaler()
+    def __init__(self, autoload=True):
+        self._model = None
+        self.engine = None
+        self.scaler = None
+        self.version = None
+        self.egfr_formula = clinical.DEFAULT_FORMULA
+        self.prediction_cache = PredictionCache(
+            maxsize=int(os.environ.get('CKD_PREDICTION_CACHE_SIZE', 10000)),
+            ttl=int(os.environ.get('CKD_PREDICTION_CACHE_TTL', 3600))
+        )
         self.feature_names = [
             'age', 'bp_systolic', 'bp_diastolic', 'specific_gravity',
             'albumin', 'sugar', 'red_blood_cells', 'pus_cell',
@@ -21,10 +31,46 @@ class CKDModel:
         # Only train model if not running on Vercel (to save time during build)
         # Also check for VERCEL_ENV to handle both build and runtime environments
         vercel_env = os.environ.get('VERCEL') or os.environ.get('VERCEL_ENV')
-        if not vercel_env:
-            self.train_model()
+        if autoload and not vercel_env:
+            self.load_or_train()
+    
+    @property
+    def model(self):
+        """The fitted sklearn forest, unpickled from the current artifact on first access"""
+        if self._model is None and self.version is not None:
+            self._model = model_registry.load_estimator(self.version)['model']
+        return self._model
+    
+    @model.setter
+    def model(self, value):
+        self._model = value
+    
+    def load_or_train(self):
+        """Load the newest persisted artifact, training (and persisting) only when none exists"""
+        artifact = model_registry.load_latest(self.feature_names)
+        if artifact is not None:
+            payload, metadata = artifact
+            self.scaler = payload['scaler']
+            self.version = metadata['version']
+            # Serving artifacts leave the sklearn forest on disk; the model property loads it on demand
+            self._model = payload['model']
+            self.engine = payload.get('engine') or ForestEngine.from_sklearn(self.model)
+            self.prediction_cache.clear()
+            return
+        
+        logger.info("No model artifact found - training a new model")
+        self.train_model()
+        try:
+            self.version = model_registry.save_artifact(self)
+        except OSError as e:
+            # A read-only filesystem shouldn't stop the app from serving predictions
+            logger.warning(f"Could not persist model artifact: {e}")
     
     def train_model(self):
+        # scikit-learn is only needed to fit (or to unpickle the estimator), never to serve
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.preprocessing import StandardScaler
+        
         np.random.seed(42)
         n_samples = 1000
         
@@ -47,42 +93,29 @@ class CKDModel:
         X = np.vstack([X_healthy, X_ckd])
         y = np.hstack([np.zeros(n_samples // 2), np.ones(n_samples // 2)])
         
+        self.scaler = StandardScaler()
         self.scaler.fit(X)
         X_scaled = self.scaler.transform(X)
         
         self.model = RandomForestClassifier(n_estimators=100, random_state=42, max_depth=10)
         self.model.fit(X_scaled, y)
+        self.engine = ForestEngine.from_sklearn(self.model)
+        self.prediction_cache.clear()
     
     def predict_risk(self, patient_data):
         # If model hasn't been trained yet (e.g., on Vercel), return default values
-        if self.model is None:
+        if self.engine is None:
             # Return default/fallback values when model is not available
-            stage = self.calculate_ckd_stage(patient_data)
+            egfr = self.calculate_egfr(patient_data.get('age', 50), patient_data.get('serum_creatinine', 1.0), patient_data.get('gender', 'male'))
             return {
                 'risk_percentage': 0,
-                'stage': stage,
+                'stage': clinical.ckd_stage(egfr),
                 'risk_level': 'Unknown',
                 'feature_importance': [],
-                'egfr': self.calculate_egfr(patient_data.get('age'), patient_data.get('serum_creatinine', 1.0), patient_data.get('gender', 'male'))
+                'egfr': egfr
             }
             
-        features = self.prepare_features(patient_data)
-        features_scaled = self.scaler.transform([features])
-        
-        risk_prob = self.model.predict_proba(features_scaled)[0][1]
-        risk_percentage = int(risk_prob * 100)
-        
-        stage = self.calculate_ckd_stage(patient_data)
-        
-        feature_importance = self.get_feature_importance(features)
-        
-        return {
-            'risk_percentage': risk_percentage,
-            'stage': stage,
-            'risk_level': self.get_risk_level(risk_percentage),
-            'feature_importance': feature_importance,
-            'egfr': self.calculate_egfr(patient_data.get('age'), patient_data.get('serum_creatinine', 1.0), patient_data.get('gender', 'male'))
-        }
+        return self.score_records([patient_data])[0]
     
     def prepare_features(self, data):
         features = []
@@ -94,33 +127,14 @@ class CKDModel:
         return features
     
     def calculate_egfr(self, age, creatinine, gender):
-        if creatinine <= 0:
-            creatinine = 1.0
-        
-        if gender.lower() == 'female':
-            egfr = 186 * (creatinine ** -1.154) * (age ** -0.203) * 0.742
-        else:
-            egfr = 186 * (creatinine ** -1.154) * (age ** -0.203)
-        
-        return round(egfr, 2)
+        return clinical.egfr(age, creatinine, gender, self.egfr_formula)
     
     def calculate_ckd_stage(self, data):
-        egfr = self.calculate_egfr(
+        return clinical.ckd_stage(self.calculate_egfr(
             data.get('age', 50),
             data.get('serum_creatinine', 1.0),
             data.get('gender', 'male')
-        )
-        
-        if egfr >= 90:
-            return 1
-        elif egfr >= 60:
-            return 2
-        elif egfr >= 30:
-            return 3
-        elif egfr >= 15:
-            return 4
-        else:
-            return 5
+        ))
     
     def get_risk_level(self, risk_percentage):
         if risk_percentage < 20:
@@ -134,29 +148,134 @@ class CKDModel:
     
     def get_feature_importance(self, features):
         # If model hasn't been trained yet, return empty list
-        if self.model is None:
+        if self.engine is None:
             return []
-            
-        importance = self.model.feature_importances_
-        feature_importance = []
         
-        for i, (name, value, imp) in enumerate(zip(self.feature_names, features, importance)):
-            if imp > 0.01:
-                feature_importance.append({
-                    'name': name.replace('_', ' ').title(),
-                    'value': round(value, 2),
-                    'importance': round(imp * 100, 2)
-                })
+        features = np.asarray([features], dtype=float)
+        _, contributions = self.engine.explain((features - self.scaler.mean_) / self.scaler.scale_)
+        return self.get_feature_attributions_batch(features, contributions)[0]
+    
+    def get_feature_attributions_batch(self, features, contributions, top_k=5):
+        """Top-k per-patient risk factors from tree-path contributions.
+        
+        'importance' is the factor's share (%) of the patient's total absolute
+        contribution; 'contribution' is its signed effect in risk percentage points.
+        """
+        magnitude = np.abs(contributions)
+        top_k = min(top_k, magnitude.shape[1])
+        top = np.argpartition(-magnitude, top_k - 1, axis=1)[:, :top_k]
+        order = np.argsort(-np.take_along_axis(magnitude, top, axis=1), axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
         
-        return sorted(feature_importance, key=lambda x: x['importance'], reverse=True)[:5]
+        top_magnitude = np.take_along_axis(magnitude, top, axis=1)
+        total = magnitude.sum(axis=1, keepdims=True)
+        share = np.round(top_magnitude / np.where(total > 0, total, 1.0) * 100, 2).tolist()
+        signed = np.round(np.take_along_axis(contributions, top, axis=1) * 100, 2).tolist()
+        values = np.round(np.take_along_axis(features, top, axis=1), 2).tolist()
+        present = (top_magnitude > 0).tolist()
+        
+        names = self.display_names
+        return [
+            [
+                {'name': names[index], 'value': value, 'importance': importance, 'contribution': contribution}
+                for index, value, importance, contribution, keep in zip(*row)
+                if keep
+            ]
+            for row in zip(top.tolist(), values, share, signed, present)
+        ]
+    
+    @property
+    def display_names(self):
+        return [name.replace('_', ' ').title() for name in self.feature_names]
     
     def predict_batch(self, patient_list):
-        results = []
-        for patient in patient_list:
-            result = self.predict_risk(patient)
+        patient_list = list(patient_list)
+        if self.engine is None:
+            results = [self.predict_risk(patient) for patient in patient_list]
+        else:
+            results = self.score_records(patient_list)
+        
+        for patient, result in zip(patient_list, results):
             result['patient_id'] = patient.get('patient_id', 'Unknown')
             result['patient_name'] = patient.get('patient_name', 'Unknown')
-            results.append(result)
         return results
+    
+    def score_records(self, patient_list):
+        """Score many patients, answering repeats from the prediction cache.
+        
+        Cache misses are scored together: one scaling step and one pass of
+        the flat forest engine. Returns one dict per patient, shaped like
+        predict_risk's result.
+        """
+        if not patient_list:
+            return []
+        
+        with metrics.timer('feature_preparation'):
+            features = self.prepare_feature_matrix(patient_list)
+            ages = np.array([patient.get('age', 50) for patient in patient_list], dtype=float)
+            creatinine = np.array([patient.get('serum_creatinine', 1.0) for patient in patient_list], dtype=float)
+            genders = ['female' if str(patient.get('gender', 'male')).lower() == 'female' else 'male'
+                       for patient in patient_list]
+        
+        cache = self.prediction_cache
+        if not cache.enabled:
+            return self._score_matrix(features, ages, creatinine, genders)
+        
+        keys = [
+            cache.make_key(row, gender, age, creat, self.version)
+            for row, gender, age, creat in zip(features, genders, ages, creatinine)
+        ]
+        results = [cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            scored = self._score_matrix(
+                features[missing], ages[missing], creatinine[missing], [genders[i] for i in missing]
+            )
+            for i, result in zip(missing, scored):
+                cache.put(keys[i], result)
+                results[i] = result
+        return results
+    
+    def _score_matrix(self, features, ages, creatinine, genders):
+        # Same arithmetic as StandardScaler.transform, without sklearn's per-call validation
+        with metrics.timer('scaler_transform'):
+            scaled = (features - self.scaler.mean_) / self.scaler.scale_
+        with metrics.timer('forest_inference'):
+            risk_prob, contributions = self.engine.explain(scaled)
+        risk_percentage = (risk_prob * 100).astype(int)
+        
+        with metrics.timer('egfr'):
+            egfr, stages = clinical.egfr_and_stage_array(ages, creatinine, genders, self.egfr_formula)
+        risk_levels = self.get_risk_level_batch(risk_percentage)
+        
+        with metrics.timer('attributions'):
+            attributions = self.get_feature_attributions_batch(features, contributions)
+        
+        return [
+            {
+                'risk_percentage': risk,
+                'stage': stage,
+                'risk_level': level,
+                'feature_importance': factors,
+                'egfr': rate
+            }
+            for risk, stage, level, factors, rate in zip(
+                risk_percentage.tolist(), stages.tolist(), risk_levels.tolist(), attributions, egfr.tolist()
+            )
+        ]
+    
+    def prepare_feature_matrix(self, patient_list):
+        """Build the (n_patients, n_features) matrix column by column; missing features become 0"""
+        features = np.empty((len(patient_list), len(self.feature_names)), dtype=float)
+        for column, feature_name in enumerate(self.feature_names):
+            features[:, column] = [patient.get(feature_name, 0.0) for patient in patient_list]
+        return features
+    
+    def get_risk_level_batch(self, risk_percentage):
+        return np.select(
+            [risk_percentage < 20, risk_percentage < 50, risk_percentage < 75],
+            ['Low', 'Moderate', 'High'],
+            default='Critical'
+        )
 
 ckd_model = CKDModel()
\ No newline at end of file
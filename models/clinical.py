@@ -0,0 +1,134 @@
+"""
+Clinical calculations shared by the CKD models and the trends API.
+
+eGFR can be estimated with either formula, selected per deployment with the
+CKD_EGFR_FORMULA environment variable:
+
+    mdrd          4-variable MDRD study equation (default, historical behaviour)
+    ckd-epi-2021  race-free CKD-EPI creatinine equation (2021 refit)
+
+Scalar helpers use only the standard library so the lightweight deployment
+can use them; the *_array helpers take whole columns (ages, creatinine, sex)
+and compute eGFR and stage for every patient in one NumPy pass.
+"""
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MDRD = 'mdrd'
+CKD_EPI_2021 = 'ckd-epi-2021'
+FORMULAS = (MDRD, CKD_EPI_2021)
+
+DEFAULT_FORMULA = os.environ.get('CKD_EGFR_FORMULA', MDRD).lower()
+# Fail at startup on a typo rather than on the first prediction
+if DEFAULT_FORMULA not in FORMULAS:
+    raise ValueError(f"CKD_EGFR_FORMULA must be one of {', '.join(FORMULAS)}, got '{DEFAULT_FORMULA}'")
+
+# Lower eGFR bound (mL/min/1.73m²) of stages 1-4; anything lower is stage 5
+STAGE_THRESHOLDS = (90, 60, 30, 15)
+
+
+def resolve_formula(formula=None):
+    """Validated formula name; None means the deployment default"""
+    formula = (formula or DEFAULT_FORMULA).lower()
+    if formula not in FORMULAS:
+        raise ValueError(f"Unknown eGFR formula '{formula}', expected one of {', '.join(FORMULAS)}")
+    return formula
+
+
+def is_female(gender):
+    return str(gender).lower() == 'female'
+
+
+def egfr(age, creatinine, gender, formula=None):
+    """eGFR for one patient, rounded to 2 decimals"""
+    formula = resolve_formula(formula)
+    if creatinine <= 0:
+        creatinine = 1.0
+    female = is_female(gender)
+
+    if formula == MDRD:
+        value = 186 * (creatinine ** -1.154) * (age ** -0.203)
+        if female:
+            value = value * 0.742
+    else:
+        kappa, alpha = (0.7, -0.241) if female else (0.9, -0.302)
+        ratio = creatinine / kappa
+        value = 142 * (min(ratio, 1.0) ** alpha) * (max(ratio, 1.0) ** -1.200) * (0.9938 ** age)
+        if female:
+            value = value * 1.012
+    return round(value, 2)
+
+
+def ckd_stage(egfr_value):
+    """KDIGO GFR category (1-5) for one eGFR value"""
+    for stage, threshold in enumerate(STAGE_THRESHOLDS, start=1):
+        if egfr_value >= threshold:
+            return stage
+    return 5
+
+
+def female_mask(genders):
+    return np.array([is_female(gender) for gender in genders], dtype=bool)
+
+
+def egfr_array(ages, creatinine, genders, formula=None):
+    """eGFR for every patient at once; genders may be strings or a boolean female mask"""
+    formula = resolve_formula(formula)
+    ages = np.asarray(ages, dtype=float)
+    creatinine = np.asarray(creatinine, dtype=float)
+    creatinine = np.where(creatinine <= 0, 1.0, creatinine)
+    female = genders if getattr(genders, 'dtype', None) == bool else female_mask(genders)
+
+    if formula == MDRD:
+        value = 186 * np.power(creatinine, -1.154) * np.power(ages, -0.203)
+        value = np.where(female, value * 0.742, value)
+    else:
+        kappa = np.where(female, 0.7, 0.9)
+        alpha = np.where(female, -0.241, -0.302)
+        ratio = creatinine / kappa
+        value = (142 * np.power(np.minimum(ratio, 1.0), alpha) * np.power(np.maximum(ratio, 1.0), -1.200)
+                 * np.power(0.9938, ages))
+        value = np.where(female, value * 1.012, value)
+    return np.round(value, 2)
+
+
+def ckd_stage_array(egfr_values):
+    egfr_values = np.asarray(egfr_values, dtype=float)
+    return np.select([egfr_values >= threshold for threshold in STAGE_THRESHOLDS], [1, 2, 3, 4], default=5)
+
+
+def egfr_and_stage_array(ages, creatinine, genders, formula=None):
+    values = egfr_array(ages, creatinine, genders, formula)
+    return values, ckd_stage_array(values)
+
+
+def egfr_values(ages, creatinine, genders, formula=None):
+    """eGFR as a plain list, vectorized when NumPy is installed"""
+    if np is not None:
+        return egfr_array(ages, creatinine, genders, formula).tolist()
+    return [egfr(age, creat, gender, formula) for age, creat, gender in zip(ages, creatinine, genders)]
+
+
+def restage(records, formula=None):
+    """Recompute 'egfr' and 'stage' in place for every record dict with one vectorized call.
+
+    Missing values get the models' defaults.  Returns the number of records updated.
+    """
+    records = list(records)
+    if not records:
+        return 0
+    values = egfr_values(
+        [record.get('age', 50) for record in records],
+        [record.get('serum_creatinine', 1.0) for record in records],
+        [record.get('gender', 'male') for record in records],
+        formula
+    )
+    stages = ckd_stage_array(values).tolist() if np is not None else [ckd_stage(value) for value in values]
+    for record, value, stage in zip(records, values, stages):
+        record['egfr'] = value
+        record['stage'] = stage
+    return len(records)
@@ -0,0 +1,319 @@
+"""
+Registry-wide eGFR decline analytics.
+
+For every patient with lab history, egfr_trends keeps the least-squares
+eGFR slope (mL/min/1.73m² per year) together with the sufficient statistics
+it is computed from (n, Σt, Σy, Σt², Σty) and the CKD stage transitions
+seen along the way.  Each lab result gets the same eGFR the trends chart
+shows: the stored eGFR (measured, or recorded when the result was scored),
+or one computed from creatinine with the deployment's formula and the
+profile's age and sex when none is stored.
+
+* New lab results dated after the patient's latest one update the sums in
+  O(new results), inside the transaction that stores them.
+* refresh() recomputes every patient from the columnar lab series in one
+  grouped NumPy pass (bincount over a patient index).  It runs when the table
+  is created and whenever CKD_EGFR_FORMULA changes.  Back-dated results and
+  profile edits recompute just that patient.
+* fastest_declining() reads the most negative slopes through an index.
+
+    python -m models.cohort refresh     # recompute everything and report timing
+"""
+import json
+import logging
+import math
+from datetime import date
+
+from . import clinical
+from .lab_series import DATE_COLUMN, load_columns
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS egfr_trends (
+    username TEXT PRIMARY KEY,
+    formula TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    sum_t REAL NOT NULL,
+    sum_y REAL NOT NULL,
+    sum_tt REAL NOT NULL,
+    sum_ty REAL NOT NULL,
+    first_day INTEGER NOT NULL,
+    last_day INTEGER NOT NULL,
+    first_egfr REAL NOT NULL,
+    last_egfr REAL NOT NULL,
+    first_stage INTEGER NOT NULL,
+    last_stage INTEGER NOT NULL,
+    stage_changes INTEGER NOT NULL,
+    stage_worsened INTEGER NOT NULL,
+    slope REAL
+);
+CREATE INDEX IF NOT EXISTS idx_egfr_trends_slope ON egfr_trends (slope)
+"""
+
+COLUMNS = ('username', 'formula', 'n', 'sum_t', 'sum_y', 'sum_tt', 'sum_ty', 'first_day', 'last_day',
+           'first_egfr', 'last_egfr', 'first_stage', 'last_stage', 'stage_changes', 'stage_worsened', 'slope')
+UPSERT = f"INSERT OR REPLACE INTO egfr_trends ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+# Time is measured in years from this day, which keeps Σt² well conditioned
+EPOCH_DAY = date(2000, 1, 1).toordinal()
+DAYS_PER_YEAR = 365.25
+
+
+def _years(day):
+    return (day - EPOCH_DAY) / DAYS_PER_YEAR
+
+
+def _slope(n, sum_t, sum_y, sum_tt, sum_ty):
+    denominator = n * sum_tt - sum_t * sum_t
+    # Fewer than two distinct dates: no trend yet
+    if n < 2 or abs(denominator) < 1e-12:
+        return None
+    return (n * sum_ty - sum_t * sum_y) / denominator
+
+
+def entry_egfr(entry, age, gender, formula=None):
+    """The eGFR charted for one lab result, or None if it has neither eGFR nor creatinine"""
+    try:
+        value = float(entry['egfr'])
+    except (KeyError, TypeError, ValueError):
+        value = math.nan
+    if not math.isnan(value):
+        return value
+    try:
+        creatinine = float(entry.get('serum_creatinine') or 0)
+    except (TypeError, ValueError):
+        creatinine = 0
+    if creatinine > 0:
+        return clinical.egfr(age, creatinine, gender, formula)
+    return None
+
+
+def accumulate(stats, points):
+    """Fold date-ordered (day, egfr) points into a stats dict (None starts a new one); returns it"""
+    for day, egfr in points:
+        t = _years(day)
+        stage = clinical.ckd_stage(egfr)
+        if stats is None:
+            stats = {'n': 0, 'sum_t': 0.0, 'sum_y': 0.0, 'sum_tt': 0.0, 'sum_ty': 0.0,
+                     'first_day': day, 'first_egfr': egfr, 'first_stage': stage,
+                     'stage_changes': 0, 'stage_worsened': 0}
+        else:
+            stats['stage_changes'] += stage != stats['last_stage']
+            stats['stage_worsened'] += stage > stats['last_stage']
+        stats['n'] += 1
+        stats['sum_t'] += t
+        stats['sum_y'] += egfr
+        stats['sum_tt'] += t * t
+        stats['sum_ty'] += t * egfr
+        stats['last_day'], stats['last_egfr'], stats['last_stage'] = day, egfr, stage
+    if stats is not None:
+        stats['slope'] = _slope(stats['n'], stats['sum_t'], stats['sum_y'], stats['sum_tt'], stats['sum_ty'])
+    return stats
+
+
+def _row(username, formula, stats):
+    return tuple(username if name == 'username' else formula if name == 'formula' else stats[name]
+                 for name in COLUMNS)
+
+
+def _profiles(conn):
+    return {row[0]: json.loads(row[1]) for row in conn.execute('SELECT username, data FROM patient_profiles')}
+
+
+def _load_series(conn):
+    """{username: (days, creatinine, egfr)} as float64 arrays straight from lab_series"""
+    return {
+        username: (columns[DATE_COLUMN], columns.get('serum_creatinine'), columns.get('egfr'))
+        for username, columns in load_columns(conn, (DATE_COLUMN, 'serum_creatinine', 'egfr')).items()
+        if DATE_COLUMN in columns
+    }
+
+
+def _compute_grouped(series, profiles, formula):
+    """Stats rows for every patient at once with NumPy"""
+    usernames = list(series)
+    if not usernames:
+        return []
+    lengths = np.array([len(series[username][0]) for username in usernames], dtype=np.intp)
+
+    def column(index):
+        parts = [np.frombuffer(series[username][index], dtype=np.float64) if series[username][index] is not None
+                 else np.full(length, np.nan) for username, length in zip(usernames, lengths)]
+        return np.concatenate(parts) if parts else np.empty(0)
+
+    days, creatinine, stored = column(0), column(1), column(2)
+    group = np.repeat(np.arange(len(usernames)), lengths)
+    ages = np.array([float(profiles.get(username, {}).get('age', 50)) for username in usernames])[group]
+    female = np.array([clinical.is_female(profiles.get(username, {}).get('gender', 'male'))
+                       for username in usernames], dtype=bool)[group]
+
+    derive = np.isnan(stored) & (np.nan_to_num(creatinine) > 0)
+    egfr = stored.copy()
+    if derive.any():
+        egfr[derive] = clinical.egfr_array(ages[derive], creatinine[derive], female[derive], formula)
+    valid = ~np.isnan(egfr)
+    days, egfr, group = days[valid], egfr[valid], group[valid]
+    if len(group) == 0:
+        return []
+
+    t = (days - EPOCH_DAY) / DAYS_PER_YEAR
+    size = len(usernames)
+    n = np.bincount(group, minlength=size)
+    sums = {
+        'sum_t': np.bincount(group, weights=t, minlength=size),
+        'sum_y': np.bincount(group, weights=egfr, minlength=size),
+        'sum_tt': np.bincount(group, weights=t * t, minlength=size),
+        'sum_ty': np.bincount(group, weights=t * egfr, minlength=size),
+    }
+    stage = clinical.ckd_stage_array(egfr)
+    same_patient = group[1:] == group[:-1]
+    changes = np.bincount(group[1:][same_patient & (stage[1:] != stage[:-1])], minlength=size)
+    worsened = np.bincount(group[1:][same_patient & (stage[1:] > stage[:-1])], minlength=size)
+    # Points are date-ordered within each patient, so a patient's first and last points bound its run
+    starts = np.flatnonzero(np.r_[True, ~same_patient])
+    ends = np.r_[starts[1:], len(group)] - 1
+    present = group[starts]
+
+    rows = []
+    for index, first, last in zip(present.tolist(), starts.tolist(), ends.tolist()):
+        stats = {name: float(values[index]) for name, values in sums.items()}
+        stats.update(
+            n=int(n[index]), first_day=int(days[first]), last_day=int(days[last]),
+            first_egfr=float(egfr[first]), last_egfr=float(egfr[last]),
+            first_stage=int(stage[first]), last_stage=int(stage[last]),
+            stage_changes=int(changes[index]), stage_worsened=int(worsened[index]),
+        )
+        stats['slope'] = _slope(stats['n'], stats['sum_t'], stats['sum_y'], stats['sum_tt'], stats['sum_ty'])
+        rows.append(_row(usernames[index], formula, stats))
+    return rows
+
+
+def _compute_each(series, profiles, formula):
+    """Pure-Python fallback for deployments without NumPy"""
+    rows = []
+    for username, (days, creatinine, stored) in series.items():
+        profile = profiles.get(username, {})
+        points = []
+        for i, day in enumerate(days):
+            entry = {'serum_creatinine': creatinine[i] if creatinine is not None else None,
+                     'egfr': stored[i] if stored is not None else None}
+            value = entry_egfr(entry, profile.get('age', 50), profile.get('gender', 'male'), formula)
+            if value is not None:
+                points.append((int(day), value))
+        stats = accumulate(None, points)
+        if stats is not None:
+            rows.append(_row(username, formula, stats))
+    return rows
+
+
+def refresh(conn, formula=None):
+    """Recompute egfr_trends for every patient; returns the number of patients with a trend row"""
+    formula = clinical.resolve_formula(formula)
+    series = _load_series(conn)
+    compute = _compute_grouped if np is not None else _compute_each
+    rows = compute(series, _profiles(conn), formula)
+    conn.execute('DELETE FROM egfr_trends')
+    conn.executemany(UPSERT, rows)
+    return len(rows)
+
+
+def update(conn, username, entries, profile, in_order, formula=None):
+    """Fold newly stored lab results into one patient's trend, inside the caller's transaction.
+
+    in_order says whether every new result is dated on or after the patient's
+    previous latest result; otherwise the patient is recomputed from scratch.
+    """
+    formula = clinical.resolve_formula(formula)
+    row = conn.execute('SELECT * FROM egfr_trends WHERE username = ?', (username,)).fetchone()
+    if not in_order or (row is not None and row['formula'] != formula):
+        rows = _compute_each({username: _load_patient_series(conn, username)}, {username: profile}, formula)
+        conn.executemany(UPSERT, rows)
+        return
+
+    age, gender = profile.get('age', 50), profile.get('gender', 'male')
+    points = []
+    for entry in sorted(entries, key=lambda entry: str(entry['date'])[:10]):
+        value = entry_egfr(entry, age, gender, formula)
+        if value is not None:
+            points.append((date.fromisoformat(str(entry['date'])[:10]).toordinal(), value))
+    stats = accumulate(dict(row) if row is not None else None, points)
+    if stats is not None:
+        conn.execute(UPSERT, _row(username, formula, stats))
+
+
+def _load_patient_series(conn, username):
+    columns = load_columns(conn, (DATE_COLUMN, 'serum_creatinine', 'egfr'), username).get(username, {})
+    return columns.get(DATE_COLUMN, []), columns.get('serum_creatinine'), columns.get('egfr')
+
+
+class CohortRepository:
+    def __init__(self, db):
+        self.db = db
+
+    def refresh(self):
+        conn = self.db.connection()
+        with conn:
+            return refresh(conn)
+
+    def _ensure_current(self):
+        """Recompute when trends were computed with another eGFR formula"""
+        stale = self.db.connection().execute(
+            'SELECT 1 FROM egfr_trends WHERE formula != ? LIMIT 1', (clinical.resolve_formula(None),)
+        ).fetchone()
+        if stale is not None:
+            logger.info("eGFR formula changed - recomputing cohort trends")
+            self.refresh()
+
+    def fastest_declining(self, limit=20, min_points=3):
+        """Patients with the steepest eGFR decline (most negative slope first)"""
+        self._ensure_current()
+        rows = self.db.connection().execute(
+            'SELECT t.*, p.data AS profile FROM egfr_trends t LEFT JOIN patient_profiles p USING (username) '
+            'WHERE t.slope IS NOT NULL AND t.slope < 0 AND t.n >= ? ORDER BY t.slope LIMIT ?',
+            (min_points, limit)
+        ).fetchall()
+        results = []
+        for row in rows:
+            profile = json.loads(row['profile']) if row['profile'] else {}
+            results.append({
+                'username': row['username'],
+                'name': profile.get('name', row['username']),
+                'patient_id': profile.get('patient_id'),
+                'slope_per_year': round(row['slope'], 2),
+                'measurements': row['n'],
+                'first_date': date.fromordinal(row['first_day']).isoformat(),
+                'last_date': date.fromordinal(row['last_day']).isoformat(),
+                'first_egfr': round(row['first_egfr'], 2),
+                'last_egfr': round(row['last_egfr'], 2),
+                'first_stage': row['first_stage'],
+                'last_stage': row['last_stage'],
+                'stage_changes': row['stage_changes'],
+                'stage_worsened': row['stage_worsened'],
+            })
+        return results
+
+
+def main(argv=None):
+    import argparse
+    import time
+
+    from .storage import get_database
+
+    parser = argparse.ArgumentParser(description='Recompute registry-wide eGFR trends')
+    parser.add_argument('command', choices=['refresh'])
+    parser.parse_args(argv)
+
+    repository = CohortRepository(get_database())
+    start = time.perf_counter()
+    count = repository.refresh()
+    print(f"recomputed eGFR trends for {count} patients in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Dependency-free scorer for the CKD random forest.
+
+The trained scaler and forest are exported to a small gzip-compressed JSON
+file (flat node arrays, see models/tree_engine.py) that can be evaluated with
+the standard library alone.  The lightweight deployment ships this file
+instead of numpy/pandas/scikit-learn.
+
+Regenerate the shipped export after retraining with:
+
+    python -m models.compact_forest export
+"""
+import gzip
+import json
+import os
+import struct
+
+FORMAT_VERSION = 1
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ckd_forest.json.gz')
+
+_float32 = struct.Struct('f')
+
+
+def _to_float32(value):
+    # sklearn compares float32 inputs against the split thresholds
+    return _float32.unpack(_float32.pack(value))[0]
+
+
+class CompactForest:
+    def __init__(self, data):
+        self.version = data.get('model_version')
+        self.feature_names = data['feature_names']
+        self.mean = data['mean']
+        self.scale = data['scale']
+        self.feature = data['feature']
+        self.threshold = data['threshold']
+        self.left = data['left']
+        self.right = data['right']
+        self.value = data['value']
+        self.roots = data['roots']
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        with gzip.open(path, 'rt', encoding='utf-8') as fh:
+            data = json.load(fh)
+        if data.get('format') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compact forest format: {data.get('format')}")
+        return cls(data)
+
+    def _scale(self, features):
+        return [
+            _to_float32((value - mean) / scale)
+            for value, mean, scale in zip(features, self.mean, self.scale)
+        ]
+
+    def predict_positive(self, features):
+        """Positive-class probability for one prepared feature vector"""
+        row = self._scale(features)
+        feature, threshold, left, right = self.feature, self.threshold, self.left, self.right
+        total = 0.0
+        for node in self.roots:
+            # Leaves point at themselves
+            while left[node] != node:
+                node = left[node] if row[feature[node]] <= threshold[node] else right[node]
+            total += self.value[node]
+        return total / len(self.roots)
+
+    def explain(self, features):
+        """Return (probability, per-feature contributions) using tree-path decomposition"""
+        row = self._scale(features)
+        feature, threshold, left, right, value = self.feature, self.threshold, self.left, self.right, self.value
+        contributions = [0.0] * len(row)
+        total = 0.0
+        for node in self.roots:
+            while left[node] != node:
+                child = left[node] if row[feature[node]] <= threshold[node] else right[node]
+                contributions[feature[node]] += value[child] - value[node]
+                node = child
+            total += value[node]
+        n_trees = len(self.roots)
+        return total / n_trees, [contribution / n_trees for contribution in contributions]
+
+
+def export(model, path=DEFAULT_PATH):
+    """Write a fitted CKDModel (scaler + forest engine) to the compact format"""
+    engine = model.engine
+    # Leaf thresholds are +inf in the engine, which JSON can't represent; they are never read
+    threshold = [0.0 if left == node else value
+                 for node, (left, value) in enumerate(zip(engine.left.tolist(), engine.threshold.tolist()))]
+    data = {
+        'format': FORMAT_VERSION,
+        'model_version': model.version,
+        'feature_names': list(model.feature_names),
+        'mean': model.scaler.mean_.tolist(),
+        'scale': model.scaler.scale_.tolist(),
+        'feature': engine.feature.tolist(),
+        'threshold': threshold,
+        'left': engine.left.tolist(),
+        'right': engine.right.tolist(),
+        'value': engine.node_values().tolist(),
+        'roots': engine.roots.tolist(),
+    }
+    with gzip.open(path, 'wt', encoding='utf-8') as fh:
+        json.dump(data, fh, separators=(',', ':'))
+    return path
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export the CKD model for the lightweight deployment')
+    parser.add_argument('command', choices=['export'])
+    parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+    args = parser.parse_args(argv)
+
+    from .ckd_model import ckd_model
+    print(export(ckd_model, args.path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""
+Chunked CSV ingestion for bulk patient uploads and patient lab reports,
+streamed JSON scoring, and scoring of records extracted from PDF reports.
+
+Rows are decoded and parsed incrementally with the standard library csv
+module, scored a fixed-size chunk at a time and committed to the patient
+store as they go, so peak memory depends on the chunk size rather than on the
+size of the upload.  Pandas is not required, which keeps CSV uploads working
+on the lightweight (Vercel) deployment.
+"""
+import codecs
+import csv
+import json
+import logging
+import math
+import os
+from datetime import date
+
+from . import clinical, lab_series, metrics
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.environ.get('CKD_INGEST_CHUNK_SIZE', 1000))
+# Smaller chunks for /api/predict, so the first results stream back sooner
+PREDICT_CHUNK_SIZE = int(os.environ.get('CKD_PREDICT_CHUNK_SIZE', 256))
+# Only the first few row errors are reported back to the uploader
+MAX_REPORTED_ERRORS = 20
+
+
+def _number(value):
+    # JSON numbers arrive typed; int() would truncate a float
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return float(value)
+
+
+def coerce_record(row, feature_names):
+    """Turn a raw CSV row into a patient record, converting model features to numbers.
+
+    Blank cells are dropped so the model falls back to its defaults.
+    Raises ValueError when a feature column holds a non-numeric value.
+    """
+    record = {}
+    for key, value in row.items():
+        # csv.DictReader stores surplus cells under a None key
+        if key is None:
+            continue
+        key = key.strip()
+        value = value.strip() if isinstance(value, str) else value
+        if not key or value in ('', None):
+            continue
+        if key in feature_names:
+            try:
+                record[key] = _number(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"column '{key}' must be numeric, got '{value}'")
+            if not math.isfinite(record[key]):
+                raise ValueError(f"column '{key}' must be a finite number, got '{value}'")
+        else:
+            record[key] = value
+    return record
+
+
+def iter_csv_rows(stream, encoding='utf-8-sig'):
+    """Yield (line_number, row) pairs from a binary stream without reading it all into memory"""
+    reader = csv.DictReader(codecs.iterdecode(stream, encoding))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _iter_lines(stream, block_size=64 * 1024):
+    # Block reads: iterating a raw WSGI input stream directly reads it a byte at a time
+    pending = b''
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+def iter_ndjson_rows(stream, encoding='utf-8'):
+    """Yield (line_number, row) from a binary NDJSON stream; a malformed line yields its ValueError as the row"""
+    for line_number, line in enumerate(_iter_lines(stream), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line.decode(encoding))
+        except ValueError as e:
+            yield line_number, ValueError(f"invalid JSON: {e}")
+
+
+def iter_json_rows(items):
+    """Yield (position, row) for a decoded JSON array, numbering from 1 like the NDJSON lines"""
+    return enumerate(items, 1)
+
+
+def score_stream(rows, model, chunk_size=PREDICT_CHUNK_SIZE):
+    """Validate and score (line_number, row) pairs chunk by chunk, yielding one result dict per row in input order.
+
+    Scored rows give the prediction plus 'line' and 'patient_id'; rows that fail
+    validation give {'line', 'error'} instead of stopping the stream.
+    """
+    feature_names = set(model.feature_names)
+
+    def flush(chunk):
+        valid = [record for _, record, error in chunk if error is None]
+        results = iter(model.predict_batch(valid) if valid else ())
+        for line_number, record, error in chunk:
+            if error is not None:
+                yield {'line': line_number, 'error': error}
+                continue
+            # A copy: predict_batch may hand back the prediction cache's own dicts
+            result = dict(next(results))
+            result.pop('patient_name', None)
+            result['line'] = line_number
+            if record.get('patient_id') is None:
+                result.pop('patient_id', None)
+            yield result
+
+    chunk = []
+    for line_number, row in rows:
+        record, error = None, None
+        if isinstance(row, ValueError):
+            error = str(row)
+        elif not isinstance(row, dict):
+            error = f"expected a JSON object, got {type(row).__name__}"
+        else:
+            try:
+                record = coerce_record(row, feature_names)
+            except ValueError as e:
+                error = str(e)
+            else:
+                if not feature_names.intersection(record):
+                    error = 'record has none of the model features'
+        chunk.append((line_number, record, error))
+        if len(chunk) >= chunk_size:
+            yield from flush(chunk)
+            chunk = []
+    if chunk:
+        yield from flush(chunk)
+
+
+def iter_record_chunks(rows, feature_names, errors, chunk_size=CHUNK_SIZE):
+    """Group valid records into lists of at most chunk_size; invalid rows are appended to errors"""
+    chunk = []
+    for line_number, row in rows:
+        try:
+            record = coerce_record(row, feature_names)
+        except ValueError as e:
+            errors.append(f"line {line_number}: {e}")
+            continue
+        if not record:
+            continue
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _score_and_save(chunk, model, store):
+    """Score a chunk of records and bulk-save them; the store gives unidentified ones AUTO_<n> ids"""
+    for record, result in zip(chunk, model.predict_batch(chunk)):
+        # The model echoes the id back ('Unknown' when missing); the record's own one is kept
+        result.pop('patient_id', None)
+        record.update(result)
+    store.save_many(chunk)
+    return len(chunk)
+
+
+def ingest_csv(stream, model, store, chunk_size=CHUNK_SIZE, progress=None):
+    """Parse, score and commit a CSV upload chunk by chunk.
+
+    `store` is the patient repository (e.g. patients_data); each chunk is
+    written with one bulk insert.  `progress`, if given, is called with
+    (rows_committed, error_count) after each chunk.
+    Returns a summary dict with the committed count and any row errors.
+    """
+    errors = []
+    count = 0
+    chunks = iter_record_chunks(iter_csv_rows(stream), model.feature_names, errors, chunk_size)
+    while True:
+        # Decoding and coercing the rows happens lazily, as each chunk is pulled
+        with metrics.timer('csv_parse'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        count += _score_and_save(chunk, model, store)
+        if progress is not None:
+            progress(count, len(errors))
+
+    if errors:
+        logger.info(f"CSV ingestion skipped {len(errors)} invalid rows")
+    return {
+        'count': count,
+        'error_count': len(errors),
+        'errors': errors[:MAX_REPORTED_ERRORS],
+    }
+
+
+# Prediction fields kept on each lab history entry (the attributions are left out)
+LAB_RESULT_FIELDS = ('risk_percentage', 'risk_level', 'stage', 'egfr')
+
+
+def _where(location):
+    # CSV rows are located by line number, extracted PDF records by file name
+    return f"line {location}" if isinstance(location, int) else location
+
+
+def ingest_lab_report(stream, model, records, username, progress=None):
+    """Score a patient's lab report CSV and append each row to their lab history.
+
+    Each row is one set of results, optionally with a 'date' (YYYY-MM-DD,
+    default today).  The patient's age and gender come from their profile, so
+    the rows only need lab values.  `records` is the PatientRecordRepository;
+    all rows are appended in one transaction.  `progress`, if given, is called
+    with (rows_parsed, error_count) as rows are read.
+    Returns a summary like ingest_csv's, plus the 'latest' scored entry.
+    """
+    return ingest_lab_rows(iter_csv_rows(stream), model, records, username, progress)
+
+
+def ingest_lab_rows(rows, model, records, username, progress=None):
+    """ingest_lab_report for (location, row) pairs from any source, e.g. pdf_report_rows()"""
+    profile = records.profile(username) or {}
+    demographics = {key: profile[key] for key in ('age', 'gender') if profile.get(key) is not None}
+    numeric = set(model.feature_names) | set(lab_series.ANALYTES)
+    errors = []
+    parsed = []
+    for location, row in rows:
+        try:
+            record = coerce_record(row, numeric)
+            if not numeric.intersection(record):
+                continue
+            record['date'] = date.fromisoformat(str(record.get('date') or date.today().isoformat())[:10]).isoformat()
+        except ValueError as e:
+            errors.append(f"{_where(location)}: {e}")
+            continue
+        parsed.append(record)
+        if progress is not None:
+            progress(len(parsed), len(errors))
+
+    entries = []
+    for record, result in zip(parsed, model.predict_batch([dict(demographics, **record) for record in parsed])):
+        entry = dict(record)
+        entry.update((field, result[field]) for field in LAB_RESULT_FIELDS)
+        if record.get('egfr') is not None:
+            # A measured eGFR on the report is kept over the estimate, and the stage follows it
+            entry['egfr'] = record['egfr']
+            entry['stage'] = clinical.ckd_stage(record['egfr'])
+        entries.append(entry)
+    if entries:
+        records.add_labs(username, entries)
+
+    return {
+        'count': len(entries),
+        'error_count': len(errors),
+        'errors': errors[:MAX_REPORTED_ERRORS],
+        'latest': max(entries, key=lambda entry: entry['date']) if entries else None,
+    }
+
+
+# Fields of an extracted PDF record that describe the patient rather than lab values
+PDF_PATIENT_FIELDS = ('patient_id', 'patient_name', 'age', 'gender')
+
+
+def pdf_report_rows(reports, errors, include_patient=True):
+    """(file name, record) pairs for the reports pdf_extract.extract_reports() read.
+
+    Files that couldn't be read, or where no lab value was recognised, are
+    appended to `errors` instead.  Without include_patient, the patient
+    details printed on the report are dropped (a patient's own upload uses
+    their profile).
+    """
+    for report in reports:
+        record = report['record']
+        if report['error'] or record is None:
+            errors.append(f"{report['name']}: {report['error'] or 'could not extract text'}")
+            continue
+        row = {key: value for key, value in record.items()
+               if key != 'pages' and (include_patient or key not in PDF_PATIENT_FIELDS)}
+        if set(row) <= set(PDF_PATIENT_FIELDS) | {'date'}:
+            errors.append(f"{report['name']}: no lab values recognised in the report")
+            continue
+        yield report['name'], row
+
+
+def ingest_pdf_reports(reports, model, store, progress=None):
+    """Score the patients extracted from PDF reports and bulk-save them, like ingest_csv.
+
+    One patient per report; reports without a patient ID get AUTO_<n> ids.
+    """
+    errors = []
+    chunk = []
+    for name, row in pdf_report_rows(reports, errors):
+        try:
+            chunk.append(coerce_record(row, model.feature_names))
+        except ValueError as e:
+            errors.append(f"{name}: {e}")
+    count = _score_and_save(chunk, model, store) if chunk else 0
+    if progress is not None:
+        progress(count, len(errors))
+    return {
+        'count': count,
+        'error_count': len(errors),
+        'errors': errors[:MAX_REPORTED_ERRORS],
+    }
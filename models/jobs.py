@@ -0,0 +1,192 @@
+"""
+Background jobs for long-running work such as large uploads.
+
+A request submits a job and gets its id back immediately; the work runs on a
+backend executor and reports progress on the Job object.  Job state is
+written to the shared SQLite database (JobRepository) when the job is queued,
+starts and finishes, and at most every PROGRESS_INTERVAL seconds in between,
+so the /api/jobs/<id> poll can be answered by any gunicorn worker, not just
+the one running the job.  A queued or running job whose state hasn't been
+saved for JOB_TIMEOUT seconds was left by a worker that was killed or
+restarted; it is marked failed at startup, on submit and when polled, so
+clients stop waiting for it.  The default backend is a thread pool in the web
+process; another executor (e.g. a client for a local broker) can be plugged
+in with register_backend() and selected with CKD_JOB_BACKEND.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs are kept this long (seconds) so clients can collect the result
+JOB_RETENTION = int(os.environ.get('CKD_JOB_RETENTION', 3600))
+# Progress updates are written to the database at most this often (seconds)
+PROGRESS_INTERVAL = float(os.environ.get('CKD_JOB_PROGRESS_INTERVAL', 0.5))
+# Queued or running jobs not saved for this long (seconds) are treated as orphaned
+JOB_TIMEOUT = float(os.environ.get('CKD_JOB_TIMEOUT', 900))
+ORPHANED_MESSAGE = 'The worker running this job stopped before it finished. Please try again.'
+MAX_REPORTED_ERRORS = 20
+
+
+class ThreadPoolBackend:
+    """Runs jobs on a bounded thread pool inside the current process"""
+
+    def __init__(self, max_workers):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ckd-job')
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+
+BACKENDS = {
+    'thread': ThreadPoolBackend,
+}
+
+
+def register_backend(name, factory):
+    """Register a backend factory; factory(max_workers) must return an object with submit(fn, *args)"""
+    BACKENDS[name] = factory
+
+
+class Job:
+    # Attributes persisted to the jobs table
+    FIELDS = ('id', 'kind', 'owner', 'status', 'created_at', 'started_at', 'finished_at',
+              'progress', 'rows', 'error_count', 'errors', 'result', 'message')
+
+    def __init__(self, kind, owner, store=None):
+        self.store = store
+        self._saved_at = 0.0
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = 0.0
+        self.rows = 0
+        self.error_count = 0
+        self.errors = []
+        self.result = None
+        self.message = None
+
+    def update(self, rows=None, error_count=None, progress=None):
+        if rows is not None:
+            self.rows = rows
+        if error_count is not None:
+            self.error_count = error_count
+        if progress is not None:
+            self.progress = min(max(progress, 0.0), 1.0)
+        if time.monotonic() - self._saved_at >= PROGRESS_INTERVAL:
+            self.save()
+
+    def save(self):
+        if self.store is not None:
+            self.store.save(self.state())
+            self._saved_at = time.monotonic()
+
+    def state(self):
+        state = {field: getattr(self, field) for field in self.FIELDS}
+        state['errors'] = self.errors[:MAX_REPORTED_ERRORS]
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        job = cls(state['kind'], state['owner'])
+        for field in cls.FIELDS:
+            setattr(job, field, state[field])
+        return job
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self):
+        elapsed = self.elapsed()
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': round(self.progress, 4),
+            'rows': self.rows,
+            'error_count': self.error_count,
+            'errors': self.errors[:MAX_REPORTED_ERRORS],
+            'elapsed_seconds': round(elapsed, 3),
+            'throughput_rows_per_sec': round(self.rows / elapsed, 1) if elapsed > 0 else 0.0,
+            'result': self.result,
+            'message': self.message,
+        }
+
+
+class JobManager:
+    """Submits jobs to the backend and looks them up in `store` (a storage.JobRepository)"""
+
+    def __init__(self, store, backend=None, max_workers=None):
+        backend = backend or os.environ.get('CKD_JOB_BACKEND', 'thread')
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown job backend '{backend}'")
+        self.store = store
+        self.backend_name = backend
+        self.max_workers = int(os.environ.get('CKD_JOB_WORKERS', 2)) if max_workers is None else max_workers
+        self._backend = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        # Created on first use so importing the app doesn't start worker threads
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = BACKENDS[self.backend_name](self.max_workers)
+        return self._backend
+
+    def submit(self, kind, owner, fn, *args):
+        """Queue fn(job, *args); its return value becomes job.result"""
+        job = Job(kind, owner, self.store)
+        self.store.prune(time.time() - JOB_RETENTION)
+        self.reclaim()
+        job.save()
+        self.backend.submit(self._run, job, fn, *args)
+        return job
+
+    def get(self, job_id):
+        """The job's last saved state as a Job, from whichever worker ran it; None if unknown"""
+        state = self.store.get(job_id)
+        if state is None:
+            return None
+        if state['status'] in ('queued', 'running') and state['updated_at'] < time.time() - JOB_TIMEOUT:
+            self.reclaim()
+            state = self.store.get(job_id)
+        return Job.from_state(state)
+
+    def reclaim(self):
+        """Mark jobs orphaned by a killed or restarted worker failed; returns how many"""
+        count = self.store.fail_stale(time.time() - JOB_TIMEOUT, ORPHANED_MESSAGE)
+        if count:
+            logger.warning(f"Marked {count} orphaned jobs failed")
+        return count
+
+    def _run(self, job, fn, *args):
+        job.status = 'running'
+        job.started_at = time.time()
+        job.save()
+        try:
+            job.result = fn(job, *args)
+            job.progress = 1.0
+            job.status = 'done'
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.kind}) failed")
+            job.message = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            job.save()
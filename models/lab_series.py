@@ -0,0 +1,232 @@
+"""
+Columnar per-patient lab history for trend charts.
+
+lab_history keeps each lab result as a JSON document.  Alongside it, every
+patient's results are kept as columns: one packed float64 array of dates
+(proleptic Gregorian ordinals) and one per analyte, sorted by date, with NaN
+marking a value the lab didn't report.  Each column is stored in BLOB
+chunks of CHUNK_SIZE values.  A trend query reads a handful of columns,
+finds a date range by bisection and slices, so its cost barely depends on
+how long the history is.  New results fill the last chunk of each column
+and start new ones, so storing them costs O(new results); a result dated
+earlier than the newest one is merged into place by rewriting the
+patient's chunks.
+
+Only the standard library is used (array + bisect), so the lightweight
+deployment serves trends the same way.
+"""
+import bisect
+import json
+import math
+import sys
+from array import array
+from datetime import date
+
+# Analytes kept as columns; other lab fields stay in the JSON documents only
+ANALYTES = ('serum_creatinine', 'blood_urea', 'hemoglobin', 'egfr', 'bp_systolic', 'bp_diastolic')
+DATE_COLUMN = 'date'
+# Values per stored BLOB chunk (4 KB of float64)
+CHUNK_SIZE = 512
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lab_series (
+    username TEXT NOT NULL,
+    analyte TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (username, analyte, chunk)
+) WITHOUT ROWID
+"""
+
+
+def pack(values):
+    packed = array('d', values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack(blob):
+    values = array('d')
+    values.frombytes(blob)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _day(value):
+    """Date ordinal for a 'YYYY-MM-DD...' string or a date"""
+    if isinstance(value, date):
+        return value.toordinal()
+    return date.fromisoformat(str(value)[:10]).toordinal()
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class LabSeries:
+    """Date-sorted columns for one patient; columns maps analyte -> array('d')"""
+
+    def __init__(self, days=None, columns=None):
+        self.days = days if days is not None else array('d')
+        self.columns = columns if columns is not None else {name: array('d') for name in ANALYTES}
+
+    def __len__(self):
+        return len(self.days)
+
+    def append(self, entries):
+        """Add lab results (dicts with a 'date'); stays sorted, equal dates keep arrival order"""
+        for entry in sorted(entries, key=lambda entry: _day(entry['date'])):
+            day = _day(entry['date'])
+            if not self.days or day >= self.days[-1]:
+                self.days.append(day)
+                for name, column in self.columns.items():
+                    column.append(_number(entry.get(name)))
+            else:
+                position = bisect.bisect_right(self.days, day)
+                self.days.insert(position, day)
+                for name, column in self.columns.items():
+                    column.insert(position, _number(entry.get(name)))
+
+    def between(self, start=None, end=None):
+        """The results dated within [start, end] (either bound optional), as a new LabSeries"""
+        low = 0 if start is None else bisect.bisect_left(self.days, _day(start))
+        high = len(self.days) if end is None else bisect.bisect_right(self.days, _day(end))
+        return LabSeries(self.days[low:high], {name: column[low:high] for name, column in self.columns.items()})
+
+    def downsample(self, max_points):
+        """At most max_points evenly spaced results, always keeping the first and the latest"""
+        n = len(self.days)
+        if not max_points or n <= max_points:
+            return self
+        if max_points == 1:
+            keep = [n - 1]
+        else:
+            keep = [round(i * (n - 1) / (max_points - 1)) for i in range(max_points)]
+        return LabSeries(
+            array('d', (self.days[i] for i in keep)),
+            {name: array('d', (column[i] for i in keep)) for name, column in self.columns.items()}
+        )
+
+    def dates(self):
+        return [date.fromordinal(int(day)).isoformat() for day in self.days]
+
+    def values(self, analyte, missing=None):
+        """One analyte as a list, with `missing` where the lab didn't report it"""
+        return [missing if math.isnan(value) else value for value in self.columns[analyte]]
+
+
+def load_columns(conn, analytes, username=None):
+    """{username: {analyte: array('d')}} for the given columns, with their chunks joined"""
+    analytes = tuple(analytes)
+    sql = f"SELECT username, analyte, data FROM lab_series WHERE analyte IN ({', '.join('?' * len(analytes))})"
+    if username is not None:
+        sql += ' AND username = ?'
+        analytes += (username,)
+    chunks = {}
+    for name, analyte, data in conn.execute(sql + ' ORDER BY username, analyte, chunk', analytes):
+        chunks.setdefault(name, {}).setdefault(analyte, []).append(data)
+    return {name: {analyte: unpack(b''.join(parts)) for analyte, parts in columns.items()}
+            for name, columns in chunks.items()}
+
+
+def _insert_chunks(conn, username, analyte, values, first_chunk):
+    conn.executemany(
+        'INSERT OR REPLACE INTO lab_series (username, analyte, chunk, data) VALUES (?, ?, ?, ?)',
+        [(username, analyte, first_chunk + i // CHUNK_SIZE, pack(values[i:i + CHUNK_SIZE]))
+         for i in range(0, len(values), CHUNK_SIZE)]
+    )
+
+
+class LabSeriesRepository:
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, username, start=None, end=None, max_points=None, analytes=ANALYTES):
+        """The patient's series restricted to [start, end] and downsampled, or None if they have no labs"""
+        columns = load_columns(self.db.connection(), (DATE_COLUMN,) + tuple(analytes), username).get(username, {})
+        if DATE_COLUMN not in columns:
+            return None
+        days = columns[DATE_COLUMN]
+        return LabSeries(days, {
+            name: columns[name] if name in columns else array('d', [math.nan]) * len(days)
+            for name in analytes
+        }).between(start, end).downsample(max_points)
+
+    def append(self, conn, username, entries):
+        """Append lab results using the caller's connection, inside the caller's transaction.
+
+        Results dated on or after the patient's latest one only touch the last
+        chunk of each column and new chunks after it.  A back-dated result
+        rewrites the patient's chunks to merge it into place.  Returns True
+        when none of the results is back-dated.
+        """
+        entries = sorted(entries, key=lambda entry: _day(entry['date']))
+        if not entries:
+            return True
+        last = conn.execute(
+            'SELECT chunk, data FROM lab_series WHERE username = ? AND analyte = ? ORDER BY chunk DESC LIMIT 1',
+            (username, DATE_COLUMN)
+        ).fetchone()
+        count, stored = 0, set()
+        if last is not None:
+            tail = unpack(last['data'])
+            if tail and _day(entries[0]['date']) < tail[-1]:
+                self._merge(conn, username, entries)
+                return False
+            count = last['chunk'] * CHUNK_SIZE + len(tail)
+            stored = {row[0] for row in conn.execute(
+                f"SELECT analyte FROM lab_series WHERE username = ? AND chunk = ? "
+                f"AND analyte IN ({', '.join('?' * len(ANALYTES))})",
+                (username, last['chunk']) + ANALYTES
+            )}
+            stored.add(DATE_COLUMN)
+
+        added = LabSeries()
+        added.append(entries)
+        room = -count % CHUNK_SIZE
+        for name, column in [(DATE_COLUMN, added.days)] + list(added.columns.items()):
+            if name not in stored:
+                # An analyte added to ANALYTES after this patient's first labs starts out all-missing
+                _insert_chunks(conn, username, name, array('d', [math.nan]) * count + column, 0)
+                continue
+            if room:
+                # || joins the raw bytes; the CAST keeps the result a BLOB
+                conn.execute(
+                    'UPDATE lab_series SET data = CAST(data || ? AS BLOB) WHERE username = ? AND analyte = ? AND chunk = ?',
+                    (pack(column[:room]), username, name, count // CHUNK_SIZE)
+                )
+            _insert_chunks(conn, username, name, column[room:], -(-count // CHUNK_SIZE))
+        return True
+
+    def _merge(self, conn, username, entries):
+        """Rewrite the patient's chunks with back-dated results merged into place"""
+        columns = load_columns(conn, (DATE_COLUMN,) + ANALYTES, username)[username]
+        days = columns[DATE_COLUMN]
+        series = LabSeries(days, {
+            name: columns[name] if name in columns else array('d', [math.nan]) * len(days)
+            for name in ANALYTES
+        })
+        series.append(entries)
+        conn.execute('DELETE FROM lab_series WHERE username = ?', (username,))
+        _insert_chunks(conn, username, DATE_COLUMN, series.days, 0)
+        for name, column in series.columns.items():
+            _insert_chunks(conn, username, name, column, 0)
+
+def rebuild(conn):
+    """Recreate every patient's series from lab_history (used by the schema migration)"""
+    conn.execute('DELETE FROM lab_series')
+    repository = LabSeriesRepository(None)
+    batch, current = [], None
+    for row in conn.execute('SELECT username, data FROM lab_history ORDER BY username, id').fetchall():
+        if row[0] != current and batch:
+            repository.append(conn, current, batch)
+            batch = []
+        current = row[0]
+        batch.append(json.loads(row[1]))
+    if batch:
+        repository.append(conn, current, batch)
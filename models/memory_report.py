@@ -0,0 +1,75 @@
+"""
+Per-process memory accounting, to see how much of each worker is shared.
+
+RSS counts every resident page, including pages shared with the master and
+sibling workers.  PSS divides each shared page among the processes mapping
+it, so summing PSS over all workers gives the real footprint.  The private
+figure is what a worker costs on its own.  Figures come from
+/proc/<pid>/smaps_rollup (Linux 4.14+) and are reported in KiB; on other
+platforms process_memory() returns None.
+
+    python -m models.memory_report [MASTER_PID]
+
+lists the master (default: this process's parent) and each of its children.
+"""
+import os
+import sys
+
+FIELDS = {
+    'Rss': 'rss_kb',
+    'Pss': 'pss_kb',
+    'Shared_Clean': 'shared_clean_kb',
+    'Shared_Dirty': 'shared_dirty_kb',
+    'Private_Clean': 'private_clean_kb',
+    'Private_Dirty': 'private_dirty_kb',
+}
+
+
+def process_memory(pid='self'):
+    """Memory summary for one process, or None when /proc isn't available"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as fh:
+            lines = fh.readlines()
+    except OSError:
+        return None
+    report = {'pid': os.getpid() if pid == 'self' else int(pid)}
+    for line in lines:
+        parts = line.split()
+        if parts and parts[0].rstrip(':') in FIELDS:
+            report[FIELDS[parts[0].rstrip(':')]] = int(parts[1])
+    report['shared_kb'] = report.get('shared_clean_kb', 0) + report.get('shared_dirty_kb', 0)
+    report['private_kb'] = report.get('private_clean_kb', 0) + report.get('private_dirty_kb', 0)
+    return report
+
+
+def child_pids(pid):
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as fh:
+                children.extend(int(child) for child in fh.read().split())
+    except OSError:
+        pass
+    return sorted(children)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    master = int(argv[0]) if argv else os.getppid()
+    reports = [('master', process_memory(master))]
+    reports += [('worker', process_memory(child)) for child in child_pids(master)]
+    reports = [(role, report) for role, report in reports if report is not None]
+    if not reports:
+        print(f"No memory information for process {master}")
+        return
+
+    print(f"{'role':<8} {'pid':>8} {'rss MiB':>9} {'pss MiB':>9} {'shared MiB':>11} {'private MiB':>12}")
+    for role, report in reports:
+        print(f"{role:<8} {report['pid']:>8} {report.get('rss_kb', 0) / 1024:9.1f} {report.get('pss_kb', 0) / 1024:9.1f} "
+              f"{report['shared_kb'] / 1024:11.1f} {report['private_kb'] / 1024:12.1f}")
+    total_pss = sum(report.get('pss_kb', 0) for _, report in reports)
+    print(f"total PSS: {total_pss / 1024:.1f} MiB across {len(reports)} processes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+In-process latency metrics, exported in the Prometheus text format.
+
+Two histograms are recorded:
+  * ckd_request_duration_seconds{endpoint, method} - every Flask request
+  * ckd_stage_duration_seconds{stage} - the hot paths inside a request: feature
+    preparation, scaler transform, forest inference, eGFR, attributions,
+    template rendering and CSV parsing
+
+plus ckd_requests_total{endpoint, method, status}.  /metrics serves them; no
+external service is involved, and CKD_METRICS=0 turns recording off.
+
+Recording takes no lock: each thread updates its own counters, and an export
+sums the per-thread stores.  Stores of threads that have exited are folded
+into one retired store at export time, so short-lived request threads don't
+accumulate.  Each process keeps its own figures, so under gunicorn a scrape
+sees the worker that answered it.
+"""
+import bisect
+import os
+import threading
+import time
+
+ENABLED = os.environ.get('CKD_METRICS', '1') != '0'
+
+# Upper bounds in seconds, from sub-millisecond stages up to slow uploads
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_DURATION = 'ckd_request_duration_seconds'
+STAGE_DURATION = 'ckd_stage_duration_seconds'
+REQUESTS_TOTAL = 'ckd_requests_total'
+
+# name -> (type, label names, help)
+METRICS = {
+    REQUEST_DURATION: ('histogram', ('endpoint', 'method'), 'Request latency by Flask endpoint'),
+    STAGE_DURATION: ('histogram', ('stage',), 'Time spent in instrumented stages of the request hot paths'),
+    REQUESTS_TOTAL: ('counter', ('endpoint', 'method', 'status'), 'Requests by endpoint, method and status code'),
+}
+
+
+class _Store:
+    """One thread's observations: (name, labels) -> bucket counts + [sum] for histograms, a number for counters"""
+
+    def __init__(self, thread=None):
+        self.thread = thread
+        self.histograms = {}
+        self.counters = {}
+
+    def merge(self, other):
+        for key, values in list(other.histograms.items()):
+            mine = self.histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                mine[i] += value
+        for key, value in list(other.counters.items()):
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+class Registry:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stores = []
+        self._retired = _Store()
+        self.started = time.time()
+        if hasattr(os, 'register_at_fork'):
+            # A lock held by another thread at fork() time would never be released in the child
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def _store(self):
+        store = getattr(self._local, 'store', None)
+        if store is None:
+            store = _Store(threading.current_thread())
+            with self._lock:
+                self._stores.append(store)
+            self._local.store = store
+        return store
+
+    def observe(self, name, labels, seconds):
+        """Add one observation to histogram `name`; labels is a tuple ordered as in METRICS"""
+        histograms = self._store().histograms
+        values = histograms.get((name, labels))
+        if values is None:
+            values = histograms[(name, labels)] = [0] * (len(self.buckets) + 2)
+        # One count per bucket (non-cumulative; the last slot is +Inf), then the running sum
+        values[bisect.bisect_left(self.buckets, seconds)] += 1
+        values[-1] += seconds
+
+    def increment(self, name, labels, amount=1):
+        counters = self._store().counters
+        counters[(name, labels)] = counters.get((name, labels), 0) + amount
+
+    def snapshot(self):
+        """All observations so far, summed over threads, as one _Store"""
+        with self._lock:
+            live = []
+            for store in self._stores:
+                if store.thread.is_alive():
+                    live.append(store)
+                else:
+                    self._retired.merge(store)
+            self._stores = live
+            total = _Store()
+            total.merge(self._retired)
+            for store in live:
+                total.merge(store)
+        return total
+
+    def clear(self):
+        with self._lock:
+            for store in self._stores:
+                store.histograms.clear()
+                store.counters.clear()
+            self._retired = _Store()
+
+    def render(self):
+        """The Prometheus text exposition (format version 0.0.4)"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, (kind, label_names, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'histogram':
+                for (metric, labels), values in sorted(snapshot.histograms.items()):
+                    if metric != name:
+                        continue
+                    label_text = _labels(label_names, labels)
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + ('+Inf',), values[:-1]):
+                        cumulative += count
+                        le = bound if bound == '+Inf' else repr(bound)
+                        lines.append(f"{name}_bucket{{{label_text},le=\"{le}\"}} {cumulative}")
+                    lines.append(f"{name}_sum{{{label_text}}} {values[-1]!r}")
+                    lines.append(f"{name}_count{{{label_text}}} {cumulative}")
+            else:
+                for (metric, labels), value in sorted(snapshot.counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{{{_labels(label_names, labels)}}} {value}")
+        lines.append('# HELP ckd_process_start_time_seconds Start time of the process since the Unix epoch')
+        lines.append('# TYPE ckd_process_start_time_seconds gauge')
+        lines.append(f"ckd_process_start_time_seconds {self.started!r}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+registry = Registry()
+
+
+class timer:
+    """Context manager timing the enclosed block as ckd_stage_duration_seconds{stage=...}"""
+    # A plain class rather than @contextmanager: it costs about a microsecond instead of several
+
+    __slots__ = ('labels', 'start')
+
+    def __init__(self, stage):
+        self.labels = (stage,)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if ENABLED:
+            registry.observe(STAGE_DURATION, self.labels, time.perf_counter() - self.start)
+
+
+def observe_stage(stage, seconds):
+    if ENABLED:
+        registry.observe(STAGE_DURATION, (stage,), seconds)
+
+
+def observe_request(endpoint, method, status, seconds):
+    if ENABLED:
+        registry.observe(REQUEST_DURATION, (endpoint, method), seconds)
+        registry.increment(REQUESTS_TOTAL, (endpoint, method, str(status)))
+
+
+def init_app(app):
+    """Time every request of a Flask app and its template rendering"""
+    from flask import before_render_template, g, request, template_rendered
+
+    if not ENABLED:
+        return
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _record_request(exc):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            # Teardown runs after unhandled exceptions too, where no response was produced
+            status = g.pop('metrics_status', 500)
+            observe_request(request.endpoint or 'unmatched', request.method, status, time.perf_counter() - started)
+
+    def _template_started(sender, template, context, **extra):
+        g.metrics_render_started = time.perf_counter()
+
+    def _template_finished(sender, template, context, **extra):
+        started = g.pop('metrics_render_started', None)
+        if started is not None:
+            observe_stage('template_render', time.perf_counter() - started)
+
+    before_render_template.connect(_template_started, app, weak=False)
+    template_rendered.connect(_template_finished, app, weak=False)
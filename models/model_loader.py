@@ -1,5 +1,6 @@
 import os
 import logging
+import threading
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -9,8 +10,24 @@ def is_vercel_environment():
     """Check if we're running in a Vercel environment"""
     return bool(os.environ.get('VERCEL') or os.environ.get('VERCEL_ENV'))
 
+_model = None
+_model_lock = threading.Lock()
+
 def load_model_conditionally():
-    """Load the CKD model conditionally based on environment"""
+    """Return the CKD model for this environment, importing and loading it on first call.
+
+    Nothing model-related is imported until then, so processes that never
+    score a patient (e.g. a cold start serving the landing page) skip
+    NumPy/scikit-learn imports and the model load entirely.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = _load_model()
+    return _model
+
+def _load_model():
     try:
         if is_vercel_environment():
             logger.info("Running in Vercel environment - using lightweight model")
@@ -19,12 +36,9 @@ def load_model_conditionally():
             return lightweight_model
         else:
             logger.info("Running in local environment - loading full model")
-            from .ckd_model import CKDModel
-            model = CKDModel()
-            # Train the model in local environment
-            if model.model is None:
-                model.train_model()
-            return model
+            # Reuse the module-level instance so the model is only loaded once per process
+            from .ckd_model import ckd_model
+            return ckd_model
     except Exception as e:
         logger.error(f"Error loading model: {e}")
         # Return a fallback model instance
@@ -32,5 +46,5 @@ def load_model_conditionally():
             from .vercel_model import lightweight_model
             return lightweight_model
         except:
-            from .ckd_model import CKDModel
-            return CKDModel()
\ No newline at end of file
+            from .ckd_model import ckd_model
+            return ckd_model
\ No newline at end of file
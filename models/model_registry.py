@@ -0,0 +1,245 @@
+"""
+Versioned on-disk registry for trained CKD model artifacts.
+
+Each trained model is written to its own directory under the artifact root:
+
+    model_artifacts/
+        20251030120000-3f2a9c1b7d4e/
+            model.joblib      # fitted scaler + forest + feature schema
+            engine/           # the forest exported as flat .npy arrays (models/tree_engine.py)
+            scaler.npz        # the scaler's mean and scale
+            metadata.json     # version, sha256 of every file, training info
+
+Directories are staged under a temporary name and renamed into place, so
+concurrently booting workers never observe a half-written artifact.
+
+Serving only needs engine/ and scaler.npz.  The engine arrays are
+memory-mapped, so all worker processes on a host share one physical copy of
+the forest through the page cache, and neither joblib nor scikit-learn is
+imported.  The sklearn estimator in model.joblib is unpickled only when
+something asks for it (see load_estimator).
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ARTIFACT_ROOT = os.environ.get(
+    'CKD_MODEL_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'model_artifacts')
+)
+MODEL_FILE = 'model.joblib'
+# How engine/ stores the forest (see ForestEngine.compact): 'float64' is the plain export,
+# 'compact' packs it losslessly into small dtypes, 'compact-q16' / 'compact-q8' also quantize leaves
+ENGINE_FORMATS = {'float64': None, 'compact': {}, 'compact-q16': {'value_bits': 16}, 'compact-q8': {'value_bits': 8}}
+ENGINE_FORMAT = os.environ.get('CKD_ENGINE_FORMAT', 'float64')
+ENGINE_DIR = 'engine'
+SCALER_FILE = 'scaler.npz'
+METADATA_FILE = 'metadata.json'
+
+
+class ScalerParams:
+    """A fitted StandardScaler's statistics: enough to scale features without scikit-learn"""
+
+    def __init__(self, mean_, scale_):
+        self.mean_ = mean_
+        self.scale_ = scale_
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=float) - self.mean_) / self.scale_
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _tree_sha256(directory):
+    """sha256 over every file in a directory, in name order"""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(directory)):
+        digest.update(name.encode())
+        digest.update(_sha256(os.path.join(directory, name)).encode())
+    return digest.hexdigest()
+
+
+def list_versions(root=None):
+    """Return artifact versions under root, newest first"""
+    root = root or ARTIFACT_ROOT
+    if not os.path.isdir(root):
+        return []
+    versions = [
+        name for name in os.listdir(root)
+        if not name.startswith('.') and os.path.isfile(os.path.join(root, name, METADATA_FILE))
+    ]
+    return sorted(versions, reverse=True)
+
+
+def save_artifact(model, root=None):
+    """Persist the fitted scaler, forest and feature schema of a CKDModel; returns the version"""
+    root = root or ARTIFACT_ROOT
+    os.makedirs(root, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=root)
+    try:
+        import joblib
+
+        model_path = os.path.join(staging, MODEL_FILE)
+        joblib.dump({
+            'scaler': model.scaler,
+            'model': model.model,
+            'feature_names': list(model.feature_names),
+        }, model_path)
+
+        sha256 = _sha256(model_path)
+        engine_path = os.path.join(staging, ENGINE_DIR)
+        if ENGINE_FORMAT not in ENGINE_FORMATS:
+            raise ValueError(f"Unknown engine format '{ENGINE_FORMAT}', expected one of {', '.join(ENGINE_FORMATS)}")
+        options = ENGINE_FORMATS[ENGINE_FORMAT]
+        engine = model.engine if options is None else model.engine.compact(**options)
+        engine.save(engine_path)
+        scaler_path = os.path.join(staging, SCALER_FILE)
+        np.savez(scaler_path, mean=model.scaler.mean_, scale=model.scaler.scale_)
+        version = f"{time.strftime('%Y%m%d%H%M%S', time.gmtime())}-{sha256[:12]}"
+        metadata = {
+            'version': version,
+            'sha256': sha256,
+            'engine_sha256': _tree_sha256(engine_path),
+            'engine_format': ENGINE_FORMAT,
+            'scaler_sha256': _sha256(scaler_path),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'feature_names': list(model.feature_names),
+            'estimator': type(model.model).__name__,
+            'n_estimators': getattr(model.model, 'n_estimators', None),
+            'max_depth': getattr(model.model, 'max_depth', None),
+            'python': sys.version.split()[0],
+        }
+        try:
+            import sklearn
+            metadata['sklearn_version'] = sklearn.__version__
+        except ImportError:
+            pass
+        with open(os.path.join(staging, METADATA_FILE), 'w') as fh:
+            json.dump(metadata, fh, indent=2)
+
+        final = os.path.join(root, version)
+        try:
+            os.rename(staging, final)
+        except OSError:
+            # Another worker published the identical artifact in the same second
+            if not os.path.isfile(os.path.join(final, METADATA_FILE)):
+                raise
+            shutil.rmtree(staging, ignore_errors=True)
+        logger.info(f"Saved model artifact {version}")
+        return version
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def _load_metadata(directory):
+    with open(os.path.join(directory, METADATA_FILE)) as fh:
+        return json.load(fh)
+
+
+def load_estimator(version, root=None, verify=True):
+    """Unpickle the sklearn payload ('scaler', 'model', 'feature_names') of one artifact version.
+
+    Raises ValueError if the file doesn't match its recorded hash.
+    """
+    import joblib
+
+    directory = os.path.join(root or ARTIFACT_ROOT, version)
+    model_path = os.path.join(directory, MODEL_FILE)
+    if verify and _sha256(model_path) != _load_metadata(directory).get('sha256'):
+        raise ValueError(f"model artifact {version}: content hash mismatch")
+    return joblib.load(model_path, mmap_mode='r')
+
+
+def _load_serving(directory, metadata, verify):
+    """Scaler statistics and the memory-mapped engine, or None if the artifact predates them"""
+    from .tree_engine import ForestEngine
+
+    engine_path = os.path.join(directory, ENGINE_DIR)
+    scaler_path = os.path.join(directory, SCALER_FILE)
+    if not (os.path.isdir(engine_path) and os.path.isfile(scaler_path)):
+        return None
+    if verify and (_tree_sha256(engine_path) != metadata.get('engine_sha256')
+                   or _sha256(scaler_path) != metadata.get('scaler_sha256')):
+        logger.warning(f"Model artifact {metadata['version']}: engine hash mismatch, loading the estimator instead")
+        return None
+    with np.load(scaler_path) as arrays:
+        scaler = ScalerParams(arrays['mean'], arrays['scale'])
+    return {'scaler': scaler, 'model': None, 'engine': ForestEngine.load(engine_path, mmap_mode='r')}
+
+
+def load_latest(feature_names, root=None, verify=True, with_estimator=False):
+    """Load the newest artifact whose feature schema matches feature_names.
+
+    Returns a (payload, metadata) tuple, or None when no usable artifact exists.
+    payload holds 'scaler' and 'engine', plus the sklearn forest as 'model'.
+    Unless with_estimator is set, the forest is left unloaded ('model' is
+    None) whenever the artifact has serving arrays; fetch it later with
+    load_estimator(metadata['version']).
+    """
+    root = root or ARTIFACT_ROOT
+    for version in list_versions(root):
+        directory = os.path.join(root, version)
+        try:
+            metadata = _load_metadata(directory)
+            if metadata.get('feature_names') != list(feature_names):
+                logger.info(f"Skipping model artifact {version}: feature schema differs")
+                continue
+            payload = None if with_estimator else _load_serving(directory, metadata, verify)
+            if payload is None:
+                payload = load_estimator(version, root, verify)
+            logger.info(f"Loaded model artifact {version}")
+            return payload, metadata
+        except Exception as e:
+            logger.warning(f"Skipping model artifact {version}: {e}")
+    return None
+
+
+def prune(keep=3, root=None):
+    """Delete all but the newest `keep` artifact versions"""
+    root = root or ARTIFACT_ROOT
+    removed = list_versions(root)[keep:]
+    for version in removed:
+        shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+    return removed
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Manage persisted CKD model artifacts')
+    parser.add_argument('command', choices=['train', 'list', 'prune'])
+    parser.add_argument('--keep', type=int, default=3, help='versions to keep when pruning')
+    args = parser.parse_args(argv)
+
+    if args.command == 'train':
+        from .ckd_model import CKDModel
+        model = CKDModel(autoload=False)
+        model.train_model()
+        print(save_artifact(model))
+    elif args.command == 'list':
+        for version in list_versions():
+            print(version)
+    else:
+        for version in prune(args.keep):
+            print(f"removed {version}")
+
+
+if __name__ == '__main__':
+    main()
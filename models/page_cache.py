@@ -0,0 +1,126 @@
+"""
+Rendered-page cache for the public, context-free pages (landing, modern dashboard).
+
+Those templates take no context, so their output only changes when the
+template files or the asset manifest do.  The first request renders the
+page once and also keeps gzip and, when the optional brotli package is
+installed, brotli variants.  Later requests get the variant their
+Accept-Encoding prefers, with an ETag and Last-Modified, and a 304 when the
+client already has it.  Before each hit the mtimes of the template and of
+every template it extends, imports or includes (e.g. _assets.html) are
+checked, and a change renders the page again; pages are also keyed by the
+asset manifest version, so an asset rebuild re-renders them with the new
+URLs.  CKD_PAGE_CACHE=0 turns the cache off.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+from flask import current_app, render_template, request
+from jinja2 import meta
+
+from .assets import manifest
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('CKD_PAGE_CACHE', '1') != '0'
+
+
+def _dependencies(env, template_name):
+    """The template and every template it extends, imports or includes, recursively"""
+    templates = {}
+    pending = [template_name]
+    while pending:
+        name = pending.pop()
+        if name in templates:
+            continue
+        templates[name] = env.get_template(name)
+        source = env.loader.get_source(env, name)[0]
+        # Names computed at render time are reported as None and can't be tracked
+        pending.extend(ref for ref in meta.find_referenced_templates(env.parse(source)) if ref is not None)
+    return list(templates.values())
+
+
+class _Page:
+    __slots__ = ('template', 'dependencies', 'bodies', 'etag', 'last_modified')
+
+    def __init__(self, template, dependencies, body):
+        self.template = template
+        self.dependencies = dependencies
+        self.bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=11)
+        self.etag = hashlib.sha256(body).hexdigest()[:20]
+        modified = max((os.path.getmtime(t.filename) for t in dependencies if t.filename), default=None)
+        self.last_modified = datetime.fromtimestamp(modified, timezone.utc) if modified else None
+
+    @property
+    def is_up_to_date(self):
+        return all(t.is_up_to_date for t in self.dependencies)
+
+
+class PageCache:
+    def __init__(self):
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def _page(self, template_name):
+        # url_for() output depends on the mount point and asset_url() output on the
+        # manifest, so both are part of the key
+        key = (template_name, request.script_root, manifest.version)
+        page = self._pages.get(key)
+        if page is not None and page.is_up_to_date:
+            return page
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None or not page.is_up_to_date:
+                if page is not None:
+                    # Jinja may still hold the old compiled templates when auto-reload is off
+                    current_app.jinja_env.cache.clear()
+                    logger.info(f"Template {template_name} or one it uses changed; rendering it again")
+                # Pages for an older manifest would never be served again
+                for stale in [k for k in self._pages if k[:2] == key[:2] and k != key]:
+                    del self._pages[stale]
+                env = current_app.jinja_env
+                dependencies = _dependencies(env, template_name)
+                page = self._pages[key] = _Page(dependencies[0], dependencies,
+                                                render_template(dependencies[0]).encode('utf-8'))
+        return page
+
+    def response(self, template_name):
+        """The rendered template as a conditional, content-negotiated response"""
+        if not ENABLED:
+            return render_template(template_name)
+        page = self._page(template_name)
+        accepted = request.accept_encodings
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in page.bodies and accepted.quality(candidate) > 0:
+                encoding = candidate
+                break
+
+        response = current_app.response_class(page.bodies[encoding], mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        # One strong ETag per representation, since the bytes differ per encoding
+        response.set_etag(page.etag if encoding == 'identity' else f"{page.etag}-{encoding}")
+        if page.last_modified is not None:
+            response.last_modified = page.last_modified
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response.make_conditional(request)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+
+page_cache = PageCache()
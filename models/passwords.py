@@ -0,0 +1,40 @@
+"""
+Password hashing and verification, at most CKD_PASSWORD_WORKERS at a time per process.
+
+Werkzeug's password hashes are deliberately slow (scrypt / PBKDF2).  This is
+a concurrency cap, not an offload: the request thread still waits for its
+own hash, first for a free slot and then while it computes.  The cap means
+a burst of logins occupies at most CKD_PASSWORD_WORKERS CPU cores (hashlib
+releases the GIL) while requests that don't hash keep running.
+"""
+import os
+import threading
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+PASSWORD_WORKERS = int(os.environ.get('CKD_PASSWORD_WORKERS', 2))
+
+_slots = threading.BoundedSemaphore(PASSWORD_WORKERS)
+
+
+def _after_fork():
+    # A slot held by another thread at fork() time would never be released in the child
+    global _slots
+    _slots = threading.BoundedSemaphore(PASSWORD_WORKERS)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def hash_password(password):
+    with _slots:
+        return generate_password_hash(password)
+
+
+def verify_password(password_hash, password):
+    """True if password matches; empty passwords never match"""
+    if not password:
+        return False
+    with _slots:
+        return check_password_hash(password_hash, password)
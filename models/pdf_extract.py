@@ -0,0 +1,382 @@
+"""
+Lab values from PDF lab reports: text extraction plus pattern rules.
+
+PyPDF2 extracts each page's text; rules then match report lines such as
+
+    Serum Creatinine      1.4    mg/dL    0.7 - 1.3
+    Haemoglobin (Hb)      11.2   g/dL
+    Age / Sex : 62 Y / M
+
+and map them to CKDModel features (converting common SI units and dropping
+implausible values).  The first match on the earliest page wins.
+
+Text extraction dominates the cost, so page ranges of every uploaded file
+are fanned out over a process pool (CKD_PDF_WORKERS processes, 0 to extract
+in-process).  The pool uses the forkserver start method: its workers are
+forked from a clean helper process, never from a threaded web worker.
+Extracted records are cached in SQLite by the file's SHA-256 and
+EXTRACTOR_VERSION, so re-uploading a report costs one hash.
+
+    python -m models.pdf_extract report.pdf [...]    # print what is extracted
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+# Bump when the rules change so cached extractions are redone
+EXTRACTOR_VERSION = 1
+
+_on_vercel = bool(os.environ.get('VERCEL') or os.environ.get('VERCEL_ENV'))
+PDF_WORKERS = int(os.environ.get('CKD_PDF_WORKERS', 0 if _on_vercel else min(4, os.cpu_count() or 1)))
+PAGES_PER_TASK = int(os.environ.get('CKD_PDF_PAGES_PER_TASK', 4))
+# Lab reports usually write dates day first (15/12/2024); set to 0 for month first
+DAY_FIRST = os.environ.get('CKD_PDF_DAY_FIRST', '1') != '0'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pdf_extractions (
+    sha256 TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (sha256, version)
+) WITHOUT ROWID
+"""
+
+NUMBER = r'(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)'
+# Exponents in units ("x10^3/uL", "10^9/L") would otherwise be read as the value
+EXPONENT = re.compile(r'(?:x\s*)?10\s*(?:\^|\*\*)\s*\d+|10[³⁶⁹]|\d+(?:\.\d+)?\s*-\s*\d+(?:\.\d+)?')
+
+
+def _per_line(multiplier_units):
+    """Converter scaling the value when the line mentions one of the units"""
+    def convert(value, line):
+        for unit, factor in multiplier_units:
+            if unit in line:
+                return value * factor
+        return value
+    return convert
+
+
+def _thousands_if_small(value, line):
+    # WBC reported in thousands (6.5 x10^3/uL) rather than cells/uL
+    return value * 1000 if value < 100 else value
+
+
+# field -> (label pattern at the start of a line, pattern that disqualifies the line, converter, plausible range)
+RULES = {
+    'serum_creatinine': (r'(?:serum\s+)?creatinine(?:\s*,\s*serum)?', r'urine|clearance|kinase|ratio|gfr',
+                         _per_line([('mol', 1 / 88.4)]), (0.1, 30)),
+    'blood_urea': (r'(?:blood\s+urea\s+nitrogen|urea\s+nitrogen|blood\s+urea|serum\s+urea|urea|bun)\b', r'urine|ratio',
+                   None, (1, 500)),
+    'hemoglobin': (r'(?:ha?emoglobin|hgb|hb)\b', r'a1c|glyc|corpuscular|mchc?\b', None, (2, 25)),
+    'sodium': (r'(?:serum\s+)?(?:sodium|na\+?)(?![a-z])', r'urine', None, (90, 200)),
+    'potassium': (r'(?:serum\s+)?(?:potassium|k\+?)(?![a-z])', r'urine', None, (1, 10)),
+    'blood_glucose': (r'(?:random\s+|fasting\s+|post\s*prandial\s+)?(?:blood\s+|plasma\s+)?(?:glucose|sugar)', r'urine|a1c',
+                      _per_line([('mmol', 18.0)]), (20, 1000)),
+    'packed_cell_volume': (r'(?:packed\s+cell\s+volume|pcv|ha?ematocrit|hct)\b', None, None, (5, 80)),
+    'white_blood_cell_count': (r'(?:total\s+)?(?:wbc|white\s+blood\s+cells?|leu[ck]ocytes?|tlc)\b', r'urine|differential',
+                               _thousands_if_small, (500, 100000)),
+    'red_blood_cell_count': (r'(?:total\s+)?(?:rbc|red\s+blood\s+cells?|erythrocytes?)\b', r'urine|distribution|rdw',
+                             None, (1, 10)),
+    'specific_gravity': (r'(?:urine\s+)?(?:specific\s+gravity|sp\.?\s*gr\.?)', None, None, (1.0, 1.05)),
+    'egfr': (r'(?:e\s*gfr|estimated\s+glomerular\s+filtration\s+rate)', None, None, (1, 200)),
+}
+# Urea reported as BUN (urea nitrogen) or in mmol/L is converted to urea in mg/dL
+_UREA_NITROGEN = re.compile(r'nitrogen|\bbun\b')
+RANGES = {field: rule[3] for field, rule in RULES.items()}
+RANGES.update({'age': (0, 120), 'bp_systolic': (50, 260), 'bp_diastolic': (30, 160)})
+
+_COMPILED = {
+    field: (
+        re.compile(r'^[\W_]*' + label + r'[^\d\n]{0,40}?' + NUMBER, re.IGNORECASE),
+        re.compile(exclude, re.IGNORECASE) if exclude else None,
+        convert,
+    )
+    for field, (label, exclude, convert, _) in RULES.items()
+}
+_BLOOD_PRESSURE = re.compile(r'^[\W_]*(?:blood\s+pressure|bp)\b[^\d\n]{0,20}(\d{2,3})\s*/\s*(\d{2,3})', re.IGNORECASE)
+_AGE_SEX = re.compile(r'\bage\s*/\s*(?:sex|gender)\b[^\d\n]{0,10}(\d{1,3})\s*(?:y(?:ea)?r?s?\.?)?\s*/\s*(male|female|m|f)\b', re.IGNORECASE)
+_AGE = re.compile(r'\bage\b[^\d\n]{0,12}(\d{1,3})', re.IGNORECASE)
+_SEX = re.compile(r'\b(?:sex|gender)\b[^a-z\n]{0,12}(male|female|m|f)\b', re.IGNORECASE)
+_PATIENT_ID = re.compile(r'\b(?:patient\s*id|pid|mrn|uhid)\b\s*[:#.\-]?\s*([A-Za-z0-9][A-Za-z0-9\-_/]*)', re.IGNORECASE)
+_PATIENT_NAME = re.compile(
+    r"\b(?:patient(?:'s)?\s+name|name)\s*[:\-]\s*(?:(?:mr|mrs|ms|miss|dr)\.?\s+)?([A-Za-z][A-Za-z .']{1,60}?)\s*(?:\s{2,}|\||$|\bage\b|\bsex\b|\bgender\b)",
+    re.IGNORECASE
+)
+_DATE = re.compile(
+    r'\b(?:collected(?:\s+on)?|collection\s+date|sample\s+date|report(?:ed)?\s+(?:date|on)|date)\b[^\d\n]{0,20}'
+    r'(\d{4}-\d{2}-\d{2}|\d{1,2}[/.\-]\d{1,2}[/.\-]\d{4}|\d{1,2}[\s\-][A-Za-z]{3,9}[\s\-,]+\d{4})',
+    re.IGNORECASE
+)
+_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y' if DAY_FIRST else '%m/%d/%Y', '%d.%m.%Y' if DAY_FIRST else '%m.%d.%Y',
+                 '%d-%m-%Y' if DAY_FIRST else '%m-%d-%Y', '%d %b %Y', '%d %B %Y')
+
+
+def _number(text):
+    return float(text.replace(',', ''))
+
+
+def _in_range(field, value):
+    low, high = RANGES[field]
+    return low <= value <= high
+
+
+def _parse_date(text):
+    text = text.strip()
+    if re.search(r'[A-Za-z]', text):
+        # "15-Mar-2025", "15 March, 2025" -> "15 Mar 2025"
+        text = re.sub(r'[\s,\-]+', ' ', text)
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_text(text):
+    """Lab values and patient details found in a report's text, as a record dict"""
+    record = {}
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        lowered = line.lower()
+
+        if 'age' not in record:
+            match = _AGE_SEX.search(line)
+            if match and _in_range('age', int(match.group(1))):
+                record['age'] = int(match.group(1))
+                record.setdefault('gender', 'female' if match.group(2).lower().startswith('f') else 'male')
+            else:
+                match = _AGE.search(line)
+                if match and _in_range('age', int(match.group(1))):
+                    record['age'] = int(match.group(1))
+        if 'gender' not in record:
+            match = _SEX.search(line)
+            if match:
+                record['gender'] = 'female' if match.group(1).lower().startswith('f') else 'male'
+        if 'patient_id' not in record:
+            match = _PATIENT_ID.search(line)
+            if match:
+                record['patient_id'] = match.group(1)
+        if 'patient_name' not in record:
+            match = _PATIENT_NAME.search(line)
+            if match and match.group(1).strip():
+                record['patient_name'] = match.group(1).strip()
+        if 'date' not in record:
+            match = _DATE.search(line)
+            if match:
+                parsed = _parse_date(match.group(1))
+                if parsed:
+                    record['date'] = parsed
+        if 'bp_systolic' not in record:
+            match = _BLOOD_PRESSURE.search(line)
+            if match:
+                systolic, diastolic = int(match.group(1)), int(match.group(2))
+                if _in_range('bp_systolic', systolic) and _in_range('bp_diastolic', diastolic):
+                    record['bp_systolic'], record['bp_diastolic'] = systolic, diastolic
+                continue
+
+        cleaned = EXPONENT.sub(' ', line)
+        for field, (pattern, exclude, convert) in _COMPILED.items():
+            if field in record:
+                continue
+            match = pattern.search(cleaned)
+            if match is None or (exclude is not None and exclude.search(lowered)):
+                continue
+            value = _number(match.group(1))
+            if field == 'blood_urea':
+                if 'mmol' in lowered:
+                    value *= 6.006
+                elif _UREA_NITROGEN.search(lowered):
+                    value *= 2.14
+            elif field == 'hemoglobin' and 'g/l' in lowered and 'g/dl' not in lowered:
+                value /= 10
+            elif convert is not None:
+                value = convert(value, lowered)
+            if _in_range(field, value):
+                record[field] = round(value, 3)
+            break  # one analyte per line
+    return record
+
+
+def _reader(data):
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(BytesIO(data))
+    if reader.is_encrypted:
+        # Many lab portals "encrypt" with an empty user password
+        reader.decrypt('')
+    return reader
+
+
+def page_count(data):
+    return len(_reader(data).pages)
+
+
+def extract_pages(data, start=0, stop=None):
+    """Text of pages [start, stop) of a PDF; runs in the pool's worker processes"""
+    pages = _reader(data).pages
+    stop = len(pages) if stop is None else min(stop, len(pages))
+    return [pages[i].extract_text() or '' for i in range(start, stop)]
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    """This process's extraction pool, or None to extract in-process"""
+    global _pool, _pool_pid
+    if PDF_WORKERS <= 0:
+        return None
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                try:
+                    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                    context = multiprocessing.get_context(method)
+                    if method == 'forkserver':
+                        # Workers need this module (and PyPDF2), not the web app's __main__
+                        context.set_forkserver_preload([__name__])
+                    _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=context)
+                except (OSError, ValueError, NotImplementedError) as e:
+                    # e.g. no /dev/shm for the pool's semaphores on serverless platforms
+                    logger.warning(f"PDF extraction pool unavailable ({e}); extracting in-process")
+                    _pool = None
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _extract_texts(files):
+    """{index: [page texts]} for (index, data) pairs, fanning page ranges out over the pool"""
+    tasks = []
+    texts = {}
+    errors = {}
+    for index, data in files:
+        try:
+            pages = page_count(data)
+        except Exception as e:
+            errors[index] = f"could not read PDF: {e}"
+            continue
+        texts[index] = [None] * pages
+        tasks.extend((index, start, min(start + PAGES_PER_TASK, pages)) for start in range(0, pages, PAGES_PER_TASK))
+
+    data_by_index = dict(files)
+    pool = _executor() if len(tasks) > 1 else None
+    if pool is not None:
+        try:
+            futures = [(task, pool.submit(extract_pages, data_by_index[task[0]], task[1], task[2])) for task in tasks]
+            results = [(task, future.result()) for task, future in futures]
+        except Exception as e:
+            # A broken pool (killed worker, no semaphores...) shouldn't lose the upload
+            logger.warning(f"PDF extraction pool failed ({e}); extracting in-process")
+            pool = None
+    if pool is None:
+        results = []
+        for task in tasks:
+            index, start, stop = task
+            if index in errors:
+                continue
+            try:
+                results.append((task, extract_pages(data_by_index[index], start, stop)))
+            except Exception as e:
+                errors[index] = f"could not extract text: {e}"
+
+    for (index, start, _), pages in results:
+        texts[index][start:start + len(pages)] = pages
+    for index in errors:
+        texts.pop(index, None)
+    return texts, errors
+
+
+class ExtractionCache:
+    """Extracted records keyed by file SHA-256 and EXTRACTOR_VERSION"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def get_many(self, digests):
+        if not digests:
+            return {}
+        digests = list(digests)
+        rows = self.db.connection().execute(
+            f"SELECT sha256, data FROM pdf_extractions WHERE version = ? AND sha256 IN ({', '.join('?' * len(digests))})",
+            [EXTRACTOR_VERSION] + digests
+        ).fetchall()
+        return {row[0]: json.loads(row[1]) for row in rows}
+
+    def put_many(self, records):
+        conn = self.db.connection()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO pdf_extractions (sha256, version, data, created_at) VALUES (?, ?, ?, ?)',
+                [(digest, EXTRACTOR_VERSION, json.dumps(record), now) for digest, record in records.items()]
+            )
+
+
+def extract_reports(files, cache=None):
+    """Extract every (name, data) PDF; returns one dict per file, in order:
+    {'name', 'sha256', 'record' (or None), 'cached', 'error' (or None)}
+    """
+    digests = [hashlib.sha256(data).hexdigest() for _, data in files]
+    cached = cache.get_many(set(digests)) if cache is not None else {}
+
+    # Identical files in one upload are extracted once
+    pending = {}
+    for digest, (_, data) in zip(digests, files):
+        if digest not in cached and digest not in pending:
+            pending[digest] = data
+    order = list(pending)
+    texts, errors = _extract_texts([(i, pending[digest]) for i, digest in enumerate(order)])
+
+    extracted = {}
+    for i, digest in enumerate(order):
+        if i in texts:
+            extracted[digest] = parse_text('\n'.join(texts[i]))
+            extracted[digest]['pages'] = len(texts[i])
+    if cache is not None and extracted:
+        cache.put_many(extracted)
+
+    reports = []
+    for digest, (name, _) in zip(digests, files):
+        record = cached.get(digest) or extracted.get(digest)
+        error = errors.get(order.index(digest)) if digest in pending else None
+        reports.append({'name': name, 'sha256': digest, 'record': record, 'cached': digest in cached, 'error': error})
+    return reports
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("usage: python -m models.pdf_extract REPORT.pdf [...]")
+        return 1
+    files = []
+    for path in argv:
+        with open(path, 'rb') as fh:
+            files.append((os.path.basename(path), fh.read()))
+    start = time.perf_counter()
+    reports = extract_reports(files)
+    elapsed = time.perf_counter() - start
+    for report in reports:
+        print(f"{report['name']}: {report['error'] or json.dumps(report['record'], sort_keys=True)}")
+    print(f"{len(files)} file(s) in {elapsed:.2f}s with {PDF_WORKERS} worker process(es)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Bounded LRU cache for CKD predictions.
+
+Entries are keyed by a hash of the prepared feature vector, the normalized
+gender and the eGFR inputs, salted with the model version so a new model
+never serves predictions made by an old one.  Entries also expire after a
+TTL.  Hit/miss/eviction counters are kept for the status endpoint.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    @staticmethod
+    def make_key(features, gender, age, creatinine, version):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{version}|{gender}|".encode())
+        digest.update(np.asarray(features, dtype=np.float64).tobytes())
+        digest.update(np.array([age, creatinine], dtype=np.float64).tobytes())
+        return digest.digest()
+
+    def get(self, key):
+        """Return a shallow copy of the cached result, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, result = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Callers add patient fields to the result, so never hand out the stored dict
+        return dict(result)
+
+    def put(self, key, result):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
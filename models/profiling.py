@@ -0,0 +1,160 @@
+"""
+On-demand cProfile profiling of individual requests.
+
+A request is profiled when any of these applies:
+  * it carries an X-CKD-Profile header equal to CKD_PROFILE_TOKEN (the header
+    is ignored while no token is configured)
+  * an admin adds ?profile=1 to the URL
+  * it is picked by sampling: CKD_PROFILE_SAMPLE_RATE (0..1, default 0) of the
+    requests to the endpoints listed in CKD_PROFILE_ENDPOINTS (comma-separated
+    endpoint names, e.g. "upload_file,doctor_dashboard"; empty means all)
+
+The CKD_PROFILE_KEEP most recent profiles (default 20), each with its
+CKD_PROFILE_TOP functions by cumulative time (default 30), are kept in the
+shared SQLite database, so /admin/profiles shows the requests profiled by
+every gunicorn worker, whichever one answers.  Only one request per process
+is profiled at a time:
+cProfile can't profile two threads at once on Python 3.12+, and a burst of
+flagged requests shouldn't all pay the profiler's overhead.  When a request
+isn't flagged the hook does a few dict lookups and nothing else.
+"""
+import cProfile
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS request_profiles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    summary TEXT NOT NULL,
+    functions TEXT NOT NULL
+)
+"""
+
+PROFILE_HEADER = 'X-CKD-Profile'
+PROFILE_TOKEN = os.environ.get('CKD_PROFILE_TOKEN', '')
+SAMPLE_RATE = float(os.environ.get('CKD_PROFILE_SAMPLE_RATE', 0))
+SAMPLE_ENDPOINTS = frozenset(name.strip() for name in os.environ.get('CKD_PROFILE_ENDPOINTS', '').split(',') if name.strip())
+KEEP = int(os.environ.get('CKD_PROFILE_KEEP', 20))
+TOP = int(os.environ.get('CKD_PROFILE_TOP', 30))
+
+
+class ProfileStore:
+    """The most recent request profiles, newest first, in the request_profiles table"""
+
+    def __init__(self, db, keep=KEEP, top=TOP):
+        self.db = db
+        self.keep = keep
+        self.top = top
+
+    def add(self, profiler, info):
+        stats = pstats.Stats(profiler)
+        functions = []
+        for (filename, line, name), (primitive, calls, own, cumulative, _) in stats.stats.items():
+            functions.append({
+                'function': f"{filename}:{line}({name})" if line else name,
+                'calls': calls,
+                'primitive_calls': primitive,
+                'total_time': own,
+                'cumulative_time': cumulative,
+            })
+        functions.sort(key=lambda function: function['cumulative_time'], reverse=True)
+        summary = dict(info, total_calls=stats.total_calls)
+        conn = self.db.connection()
+        with conn:
+            profile_id = conn.execute(
+                'INSERT INTO request_profiles (summary, functions) VALUES (?, ?)',
+                (json.dumps(summary), json.dumps(functions[:self.top]))
+            ).lastrowid
+            conn.execute('DELETE FROM request_profiles WHERE id <= ?', (profile_id - self.keep,))
+        return dict(summary, id=profile_id, functions=functions[:self.top])
+
+    def list(self):
+        """Summaries without the function tables"""
+        rows = self.db.connection().execute(
+            'SELECT id, summary FROM request_profiles ORDER BY id DESC LIMIT ?', (self.keep,)
+        ).fetchall()
+        return [dict(json.loads(row[1]), id=row[0]) for row in rows]
+
+    def get(self, profile_id):
+        row = self.db.connection().execute(
+            'SELECT summary, functions FROM request_profiles WHERE id = ?', (profile_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(json.loads(row[0]), id=profile_id, functions=json.loads(row[1]))
+
+    def clear(self):
+        conn = self.db.connection()
+        with conn:
+            conn.execute('DELETE FROM request_profiles')
+
+
+# Held while a request is being profiled; requests flagged meanwhile run unprofiled
+_active = threading.Lock()
+
+
+def _trigger(request, session):
+    """Why this request should be profiled, or None"""
+    if PROFILE_TOKEN and hmac.compare_digest(request.headers.get(PROFILE_HEADER, ''), PROFILE_TOKEN):
+        return 'header'
+    if request.args.get('profile') == '1' and session.get('admin_logged_in'):
+        return 'admin'
+    if SAMPLE_RATE and (not SAMPLE_ENDPOINTS or request.endpoint in SAMPLE_ENDPOINTS) and random.random() < SAMPLE_RATE:
+        return 'sample'
+    return None
+
+
+def init_app(app, profiles):
+    """Profile the requests of a Flask app that are flagged for it, saving them to a ProfileStore"""
+    from flask import g, request, session
+
+    @app.before_request
+    def _start_profile():
+        trigger = _trigger(request, session)
+        if trigger is None or not _active.acquire(blocking=False):
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) already owns the interpreter's profiling hook
+            _active.release()
+            return
+        g.profile = (profiler, trigger, time.time(), time.perf_counter())
+
+    @app.after_request
+    def _profile_status(response):
+        if 'profile' in g:
+            g.profile_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_profile(exc):
+        state = g.pop('profile', None)
+        if state is None:
+            return
+        profiler, trigger, started_at, started = state
+        try:
+            profiler.disable()
+        finally:
+            _active.release()
+        duration = time.perf_counter() - started
+        record = profiles.add(profiler, {
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': g.pop('profile_status', 500),
+            'trigger': trigger,
+            'started': datetime.fromtimestamp(started_at).isoformat(timespec='seconds'),
+            'duration': duration,
+        })
+        logger.info(f"Profiled {request.method} {request.path} ({trigger}) in {duration * 1e3:.1f} ms as profile {record['id']}")
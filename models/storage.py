@@ -0,0 +1,785 @@
+"""
+SQLite-backed storage for users, patients and patient lab history.
+
+Every gunicorn worker (and every background job thread) talks to the same
+database file, so data is consistent across processes and survives restarts.
+The database runs in WAL mode, so readers never block the single writer.
+Each thread gets its own connection, created lazily and recreated after a
+fork.  Statements are parameterized and reused from sqlite3's per-connection
+statement cache.
+
+The database path comes from CKD_DB_PATH.  It defaults to
+instance/ckd.sqlite3, or to the temp directory on Vercel, where the
+deployment bundle is read-only.
+"""
+import base64
+import binascii
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from . import clinical, cohort, lab_series, pdf_extract, profiling
+from .lab_series import LabSeriesRepository
+
+logger = logging.getLogger(__name__)
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if os.environ.get('VERCEL') or os.environ.get('VERCEL_ENV'):
+    DEFAULT_DB_PATH = os.path.join(tempfile.gettempdir(), 'ckd.sqlite3')
+else:
+    DEFAULT_DB_PATH = os.path.join(_ROOT, 'instance', 'ckd.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    role TEXT NOT NULL,
+    email TEXT,
+    specialization TEXT
+);
+
+CREATE TABLE IF NOT EXISTS patients (
+    patient_id TEXT PRIMARY KEY,
+    patient_name TEXT,
+    age REAL,
+    risk_percentage INTEGER,
+    risk_level TEXT,
+    stage INTEGER,
+    egfr REAL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS patient_profiles (
+    username TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS lab_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    date TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_lab_history_username_date ON lab_history (username, date);
+"""
+
+
+
+def _add_lab_series(conn):
+    conn.execute(lab_series.SCHEMA)
+    lab_series.rebuild(conn)
+
+
+def _add_egfr_trends(conn):
+    for statement in cohort.SCHEMA.split(';'):
+        conn.execute(statement)
+    cohort.refresh(conn)
+
+
+def _add_pdf_extractions(conn):
+    conn.execute(pdf_extract.SCHEMA)
+
+
+def _chunk_lab_series(conn):
+    conn.execute('DROP TABLE lab_series')
+    conn.execute(lab_series.SCHEMA)
+    lab_series.rebuild(conn)
+
+
+def _add_request_profiles(conn):
+    conn.execute(profiling.SCHEMA)
+
+
+def _refresh_egfr_trends(conn):
+    cohort.refresh(conn)
+
+
+# Applied in order on top of SCHEMA; PRAGMA user_version records how many have run.
+# Each is a SQL script or a function taking the connection.
+MIGRATIONS = [
+    # 1: keyset pagination for the doctor dashboard. Sort columns hold -1 instead of
+    # NULL so (sort key, patient_id) row-value comparisons never meet a NULL.
+    """
+    ALTER TABLE patients ADD COLUMN name_key TEXT NOT NULL DEFAULT '';
+    ALTER TABLE patients ADD COLUMN id_key TEXT NOT NULL DEFAULT '';
+    UPDATE patients SET
+        name_key = lower(coalesce(patient_name, '')),
+        id_key = lower(patient_id),
+        age = coalesce(age, -1),
+        risk_percentage = coalesce(risk_percentage, -1),
+        stage = coalesce(stage, -1),
+        egfr = coalesce(egfr, -1);
+    DROP INDEX IF EXISTS idx_patients_risk;
+    DROP INDEX IF EXISTS idx_patients_stage;
+    CREATE INDEX idx_patients_name ON patients (name_key, patient_id);
+    CREATE INDEX idx_patients_id_key ON patients (id_key);
+    CREATE INDEX idx_patients_age ON patients (age, patient_id);
+    CREATE INDEX idx_patients_risk ON patients (risk_percentage, patient_id);
+    CREATE INDEX idx_patients_stage ON patients (stage, patient_id);
+    CREATE INDEX idx_patients_egfr ON patients (egfr, patient_id);
+    CREATE INDEX idx_patients_risk_level ON patients (risk_level);
+    """,
+    # 2: columnar lab history for trend charts (models/lab_series.py)
+    _add_lab_series,
+    # 3: registry-wide eGFR slopes (models/cohort.py)
+    _add_egfr_trends,
+    # 4: cache of lab values extracted from PDF reports (models/pdf_extract.py)
+    _add_pdf_extractions,
+    # 5: AUTO_<n> patient ids come from a counter, allocated inside the inserting transaction
+    """
+    CREATE TABLE id_sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    INSERT INTO id_sequences (name, value)
+        SELECT 'patient_auto', coalesce(max(CAST(substr(patient_id, 6) AS INTEGER)), 0)
+        FROM patients WHERE patient_id GLOB 'AUTO_[0-9]*';
+    """,
+    # 6: background job state and free upload trials, shared by every worker process
+    """
+    CREATE TABLE jobs (
+        id TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        status TEXT NOT NULL,
+        finished_at REAL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX idx_jobs_finished ON jobs (finished_at);
+    CREATE TABLE upload_trials (
+        username TEXT PRIMARY KEY,
+        used INTEGER NOT NULL DEFAULT 0,
+        pending INTEGER NOT NULL DEFAULT 0
+    );
+    """,
+    # 7: the eGFR formula each patient's egfr/stage was computed with, so a formula
+    # change can re-stage the stored patients (PatientRepository.restage)
+    """
+    ALTER TABLE patients ADD COLUMN egfr_formula TEXT;
+    CREATE INDEX idx_patients_egfr_formula ON patients (egfr_formula);
+    """,
+    # 8: cohort trends use each result's stored eGFR before deriving one from creatinine
+    _refresh_egfr_trends,
+    # 9: timestamps for reclaiming what a killed worker leaves behind: jobs.updated_at,
+    # and one row per held upload trial instead of a pending counter
+    """
+    ALTER TABLE jobs ADD COLUMN updated_at REAL NOT NULL DEFAULT 0;
+    CREATE INDEX idx_jobs_active ON jobs (status, updated_at);
+    CREATE TABLE upload_trial_holds (
+        id TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX idx_upload_trial_holds_username ON upload_trial_holds (username);
+    CREATE INDEX idx_upload_trial_holds_created ON upload_trial_holds (created_at);
+    CREATE TABLE upload_trials_new (
+        username TEXT PRIMARY KEY,
+        used INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT INTO upload_trials_new (username, used) SELECT username, used FROM upload_trials;
+    DROP TABLE upload_trials;
+    ALTER TABLE upload_trials_new RENAME TO upload_trials;
+    """,
+    # 10: request profiles, shared by every worker process (models/profiling.py)
+    _add_request_profiles,
+    # 11: lab series columns stored in fixed-size chunks so appends don't rewrite the history
+    _chunk_lab_series,
+]
+
+
+def _auto_number(patient_id):
+    """n for an 'AUTO_<n>' patient id, else None"""
+    patient_id = str(patient_id)
+    if patient_id.startswith('AUTO_') and patient_id[5:].isdigit():
+        return int(patient_id[5:])
+    return None
+
+
+def _json_default(value):
+    # numpy scalars and similar expose .item()
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    return json.dumps(value, default=_json_default, separators=(',', ':'))
+
+
+class Database:
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('CKD_DB_PATH') or DEFAULT_DB_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        conn = self.connection()
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= len(MIGRATIONS):
+            return
+        conn.isolation_level = None
+        try:
+            # Serialize concurrently booting workers; re-read the version under the lock
+            conn.execute('BEGIN IMMEDIATE')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                if callable(migration):
+                    migration(conn)
+                else:
+                    for statement in migration.split(';'):
+                        if statement.strip():
+                            conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {number}')
+                logger.info(f"Applied database migration {number}")
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.isolation_level = ''
+
+    def connection(self):
+        """Return this thread's connection, opening one if needed"""
+        conn = getattr(self._local, 'conn', None)
+        # Connections must not cross a fork (e.g. a preloaded gunicorn master)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class UserRepository:
+    """Users by id and by username, both served from SQLite indexes.
+
+    Loaded User objects are kept in a small per-process LRU so the
+    Flask-Login user loader, which runs on every authenticated request,
+    usually skips the database.  Entries expire after `ttl` seconds, which
+    bounds how long a change made by another worker can go unseen; changes
+    made through this repository invalidate the entry immediately.
+    """
+
+    def __init__(self, db, user_class, cache_size=None, ttl=None):
+        self.db = db
+        self.user_class = user_class
+        self.cache_size = int(os.environ.get('CKD_USER_CACHE_SIZE', 1024) if cache_size is None else cache_size)
+        self.ttl = float(os.environ.get('CKD_USER_CACHE_TTL', 60) if ttl is None else ttl)
+        self._cache = OrderedDict()
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def _build(self, row):
+        if row is None:
+            return None
+        user = self.user_class(str(row['id']), row['username'], row['password_hash'], row['role'])
+        user.email = row['email']
+        user.specialization = row['specialization']
+        self._remember(row['id'], user)
+        return user
+
+    def _remember(self, user_id, user):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[user_id] = (time.monotonic() + self.ttl, user)
+            self._cache.move_to_end(user_id)
+            self._ids[user.username] = user_id
+            while len(self._cache) > self.cache_size:
+                _, (_, evicted) = self._cache.popitem(last=False)
+                self._ids.pop(evicted.username, None)
+
+    def _cached(self, user_id):
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._cache[user_id]
+                self._ids.pop(user.username, None)
+                return None
+            self._cache.move_to_end(user_id)
+            return user
+
+    def invalidate(self, user_id=None):
+        """Drop one cached user, or all of them"""
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+                self._ids.clear()
+                return
+            entry = self._cache.pop(int(user_id), None)
+            if entry is not None:
+                self._ids.pop(entry[1].username, None)
+
+    def get_by_id(self, user_id):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        user = self._cached(user_id)
+        if user is not None:
+            return user
+        row = self.db.connection().execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        return self._build(row)
+
+    def get_by_username(self, username):
+        user_id = self._ids.get(username)
+        user = self._cached(user_id) if user_id is not None else None
+        if user is not None:
+            return user
+        row = self.db.connection().execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+        return self._build(row)
+
+    def exists(self, username):
+        return self.db.connection().execute(
+            'SELECT 1 FROM users WHERE username = ?', (username,)
+        ).fetchone() is not None
+
+    def all(self, role=None):
+        conn = self.db.connection()
+        if role is None:
+            rows = conn.execute('SELECT * FROM users ORDER BY id').fetchall()
+        else:
+            rows = conn.execute('SELECT * FROM users WHERE role = ? ORDER BY id', (role,)).fetchall()
+        return [self._build(row) for row in rows]
+
+    def add(self, username, password_hash, role, email=None, specialization=None, user_id=None):
+        """Insert a user; ids are allocated by SQLite and never reused.
+
+        Raises sqlite3.IntegrityError if the username is taken.
+        """
+        conn = self.db.connection()
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO users (id, username, password_hash, role, email, specialization) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (user_id, username, password_hash, role, email, specialization)
+            )
+        self.invalidate(cursor.lastrowid)
+        return self.get_by_id(cursor.lastrowid)
+
+    def update_password(self, user_id, password_hash):
+        conn = self.db.connection()
+        with conn:
+            conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, int(user_id)))
+        self.invalidate(user_id)
+
+
+def _sort_value(value):
+    """Numeric sort key; missing or non-numeric values sort first as -1"""
+    try:
+        return float(value) if value is not None else -1
+    except (TypeError, ValueError):
+        return -1
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Raises ValueError for a cursor this module did not produce"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('invalid cursor')
+    return values
+
+
+class PatientRepository:
+    """Doctor-managed patient records keyed by patient_id"""
+
+    UPSERT = (
+        'INSERT OR {conflict} INTO patients '
+        '(patient_id, patient_name, age, risk_percentage, risk_level, stage, egfr, data, updated_at, '
+        'name_key, id_key, egfr_formula) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+    )
+
+    # API sort key -> indexed column; every index ends in patient_id as the tie-breaker
+    SORT_COLUMNS = {
+        'name': 'name_key',
+        'patient_id': 'id_key',
+        'age': 'age',
+        'risk': 'risk_percentage',
+        'risk_percentage': 'risk_percentage',
+        'risk_level': 'risk_percentage',
+        'stage': 'stage',
+        'egfr': 'egfr',
+    }
+    MAX_PAGE_SIZE = 200
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def _params(record, now):
+        patient_id = str(record['patient_id'])
+        name = record.get('patient_name')
+        return (
+            patient_id,
+            name,
+            _sort_value(record.get('age')),
+            _sort_value(record.get('risk_percentage')),
+            record.get('risk_level'),
+            _sort_value(record.get('stage')),
+            _sort_value(record.get('egfr')),
+            dumps(record),
+            now,
+            str(name or '').lower(),
+            patient_id.lower(),
+            # Predictions are staged with the deployment's formula
+            clinical.resolve_formula(None),
+        )
+
+    def get(self, patient_id):
+        row = self.db.connection().execute(
+            'SELECT data FROM patients WHERE patient_id = ?', (str(patient_id),)
+        ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def exists(self, patient_id):
+        return self.db.connection().execute(
+            'SELECT 1 FROM patients WHERE patient_id = ?', (str(patient_id),)
+        ).fetchone() is not None
+
+    def count(self):
+        return self.db.connection().execute('SELECT COUNT(*) FROM patients').fetchone()[0]
+
+    def all(self):
+        rows = self.db.connection().execute('SELECT data FROM patients ORDER BY rowid').fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def page(self, search=None, risk_level=None, stage=None, sort='risk', descending=True,
+             limit=50, cursor=None):
+        """One page of patients in sort order, plus the cursor for the next page (or None).
+
+        Keyset pagination: the cursor holds the last row's (sort key, patient_id),
+        so each page is an index range scan costing O(log n + limit) however deep
+        the client has paged.  `search` is a case-insensitive prefix of the
+        patient name or ID.  Raises ValueError for an unknown sort key or a bad cursor.
+        """
+        if sort not in self.SORT_COLUMNS:
+            raise ValueError(f"unknown sort key '{sort}'")
+        column = self.SORT_COLUMNS[sort]
+        limit = max(1, min(int(limit), self.MAX_PAGE_SIZE))
+        conditions, params = [], []
+
+        if search:
+            prefix = search.strip().lower()
+            conditions.append('(name_key >= ? AND name_key < ? OR id_key >= ? AND id_key < ?)')
+            params.extend([prefix, prefix + '\uffff'] * 2)
+        if risk_level:
+            conditions.append('risk_level = ?')
+            params.append(risk_level)
+        if stage not in (None, ''):
+            conditions.append('stage = ?')
+            params.append(_sort_value(stage))
+        if cursor:
+            last_key, last_id = decode_cursor(cursor)
+            conditions.append(f"({column}, patient_id) {'<' if descending else '>'} (?, ?)")
+            params.extend([last_key, last_id])
+
+        direction = 'DESC' if descending else 'ASC'
+        sql = (
+            f"SELECT data, {column} AS sort_key, patient_id FROM patients"
+            f"{' WHERE ' + ' AND '.join(conditions) if conditions else ''} "
+            f"ORDER BY {column} {direction}, patient_id {direction} LIMIT ?"
+        )
+        # Fetch one extra row to learn whether another page exists
+        rows = self.db.connection().execute(sql, params + [limit + 1]).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1]['sort_key'], rows[-1]['patient_id']])
+        return [json.loads(row['data']) for row in rows], next_cursor
+
+    def summary(self):
+        """Dashboard totals from the indexed columns, without decoding any patient JSON"""
+        conn = self.db.connection()
+        total, average_risk = conn.execute(
+            'SELECT COUNT(*), AVG(CASE WHEN risk_percentage >= 0 THEN risk_percentage END) FROM patients'
+        ).fetchone()
+        risk_levels = dict(conn.execute(
+            'SELECT risk_level, COUNT(*) FROM patients WHERE risk_level IS NOT NULL GROUP BY risk_level'
+        ).fetchall())
+        stages = {int(stage): count for stage, count in conn.execute(
+            'SELECT stage, COUNT(*) FROM patients WHERE stage >= 1 GROUP BY stage'
+        ).fetchall()}
+        return {
+            'total': total,
+            'average_risk': round(average_risk or 0, 1),
+            'risk_levels': risk_levels,
+            'stages': stages,
+        }
+
+    def save(self, record):
+        self.save_many([record])
+
+    def save_many(self, records, replace=True):
+        """Bulk upsert in a single transaction; with replace=False existing patients are kept.
+
+        Records without a patient_id are given the next AUTO_<n> ids (set on the
+        record dicts).  The ids are taken from the id_sequences counter inside
+        the same write transaction and the rows are inserted without REPLACE,
+        so concurrent uploads in any worker never share, or overwrite, an id.
+        """
+        now = time.time()
+        records = list(records)
+        anonymous = [record for record in records if not record.get('patient_id')]
+        identified = [record for record in records if record.get('patient_id')]
+        # An uploaded id in the AUTO_<n> form moves the counter past it
+        explicit = [_auto_number(record['patient_id']) for record in identified]
+        explicit = max((number for number in explicit if number is not None), default=None)
+        conn = self.db.connection()
+        with conn:
+            if anonymous or explicit is not None:
+                # Take the write lock before reading the counter
+                conn.execute('BEGIN IMMEDIATE')
+                last = conn.execute(
+                    "SELECT value FROM id_sequences WHERE name = 'patient_auto'"
+                ).fetchone()[0]
+                last = max(last, explicit or 0)
+                conn.execute(
+                    "UPDATE id_sequences SET value = ? WHERE name = 'patient_auto'", (last + len(anonymous),)
+                )
+                for number, record in enumerate(anonymous, start=last + 1):
+                    record['patient_id'] = f"AUTO_{number}"
+                conn.executemany(self.UPSERT.format(conflict='ABORT'),
+                                 [self._params(record, now) for record in anonymous])
+            if identified:
+                sql = self.UPSERT.format(conflict='REPLACE' if replace else 'IGNORE')
+                conn.executemany(sql, [self._params(record, now) for record in identified])
+
+
+    def restage(self, formula=None):
+        """Recompute eGFR and stage of the patients stored under another eGFR formula.
+
+        Runs when CKD_EGFR_FORMULA changes, so the dashboard never mixes
+        formulas: one vectorized clinical.restage() pass over the stale
+        patients and one bulk UPDATE, in a single write transaction.
+        Returns the number of patients re-staged.
+        """
+        formula = clinical.resolve_formula(formula)
+        conn = self.db.connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # Range terms rather than != so the lookup is an index search when nothing is stale
+            records = [json.loads(row['data']) for row in conn.execute(
+                'SELECT data FROM patients WHERE egfr_formula IS NULL OR egfr_formula < ? OR egfr_formula > ?',
+                (formula, formula)
+            )]
+            clinical.restage(records, formula)
+            conn.executemany(
+                'UPDATE patients SET egfr = ?, stage = ?, data = ?, egfr_formula = ? WHERE patient_id = ?',
+                [(_sort_value(record['egfr']), _sort_value(record['stage']), dumps(record), formula,
+                  str(record['patient_id'])) for record in records]
+            )
+        if records:
+            logger.info(f"Re-staged {len(records)} patients with the {formula} eGFR formula")
+        return len(records)
+
+
+class PatientRecordRepository:
+    """Patient-portal profiles and their lab history, keyed by username"""
+
+    def __init__(self, db):
+        self.db = db
+        self.series = LabSeriesRepository(db)
+
+    def get(self, username):
+        """Return the profile with its 'history' (newest first), or None"""
+        record = self.profile(username)
+        if record is None:
+            return None
+        record['history'] = self.history(username)
+        return record
+
+    def profile(self, username):
+        """The profile alone, without loading any lab history"""
+        row = self.db.connection().execute(
+            'SELECT data FROM patient_profiles WHERE username = ?', (username,)
+        ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def history(self, username):
+        rows = self.db.connection().execute(
+            'SELECT data FROM lab_history WHERE username = ? ORDER BY date DESC, id DESC', (username,)
+        ).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def exists(self, username):
+        return self.db.connection().execute(
+            'SELECT 1 FROM patient_profiles WHERE username = ?', (username,)
+        ).fetchone() is not None
+
+    def save_profile(self, username, profile, replace=True):
+        profile = {key: value for key, value in profile.items() if key != 'history'}
+        conn = self.db.connection()
+        with conn:
+            cursor = conn.execute(
+                f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO patient_profiles (username, data) VALUES (?, ?)",
+                (username, dumps(profile))
+            )
+            if cursor.rowcount:
+                # Age and sex feed the eGFR of every result, so recompute this patient's trend
+                cohort.update(conn, username, [], profile, in_order=False)
+
+    def add_labs(self, username, entries):
+        """Bulk-append lab results, and their columnar series, in one transaction; each entry needs a 'date'"""
+        entries = list(entries)
+        conn = self.db.connection()
+        with conn:
+            conn.executemany(
+                'INSERT INTO lab_history (username, date, data) VALUES (?, ?, ?)',
+                [(username, entry['date'], dumps(entry)) for entry in entries]
+            )
+            in_order = self.series.append(conn, username, entries)
+            cohort.update(conn, username, entries, self.profile(username) or {}, in_order)
+
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def get_database():
+    """Process-wide Database instance, created on first use"""
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = Database()
+                logger.info(f"Using SQLite database at {_database.path}")
+    return _database
+
+
+class JobRepository:
+    """Background job state (see models/jobs.py), so any worker can answer a status poll"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def save(self, state):
+        """Insert or overwrite one job; state is Job.state(), a JSON-able dict"""
+        conn = self.db.connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO jobs (id, owner, status, finished_at, updated_at, data) VALUES (?, ?, ?, ?, ?, ?)',
+                (state['id'], str(state['owner']), state['status'], state['finished_at'], time.time(), dumps(state))
+            )
+
+    def get(self, job_id):
+        """The job's state plus 'updated_at', when it was last saved; None if unknown"""
+        row = self.db.connection().execute('SELECT data, updated_at FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        state = json.loads(row['data'])
+        state['updated_at'] = row['updated_at']
+        return state
+
+    def prune(self, finished_before):
+        """Delete jobs that finished before the given time"""
+        conn = self.db.connection()
+        with conn:
+            conn.execute('DELETE FROM jobs WHERE finished_at < ?', (finished_before,))
+
+    def fail_stale(self, saved_before, message):
+        """Mark queued or running jobs last saved before the given time failed; returns how many"""
+        conn = self.db.connection()
+        with conn:
+            rows = conn.execute(
+                "SELECT id, data FROM jobs WHERE status IN ('queued', 'running') AND updated_at < ?", (saved_before,)
+            ).fetchall()
+            now = time.time()
+            for row in rows:
+                state = json.loads(row['data'])
+                state.update(status='failed', finished_at=now, message=message)
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, updated_at = ?, data = ? WHERE id = ?",
+                    (now, now, dumps(state), row['id'])
+                )
+        return len(rows)
+
+
+class UploadTrialRepository:
+    """Free lab-report uploads per patient.
+
+    A trial is held while its upload is processed and only spent (used) when
+    processing succeeds.  Each hold is a timestamped row, so a hold left
+    behind by a worker killed mid-upload expires after hold_timeout seconds
+    (CKD_UPLOAD_HOLD_TIMEOUT) instead of blocking the patient for good.
+    Holds and spends are kept in SQLite, so every worker sees the same
+    allowance.
+    """
+
+    def __init__(self, db, allowance=2, hold_timeout=None):
+        self.db = db
+        self.allowance = allowance
+        self.hold_timeout = float(os.environ.get('CKD_UPLOAD_HOLD_TIMEOUT', 900) if hold_timeout is None else hold_timeout)
+
+    def _used(self, conn, username):
+        row = conn.execute('SELECT used FROM upload_trials WHERE username = ?', (username,)).fetchone()
+        return row['used'] if row else 0
+
+    def _expire(self, conn):
+        expired = conn.execute(
+            'DELETE FROM upload_trial_holds WHERE created_at < ?', (time.time() - self.hold_timeout,)
+        ).rowcount
+        if expired:
+            logger.warning(f"Released {expired} upload trial holds left by interrupted uploads")
+        return expired
+
+    def get(self, username):
+        used = self._used(self.db.connection(), username)
+        return {'remaining': max(self.allowance - used, 0), 'used': used}
+
+    def expire(self):
+        """Release holds older than hold_timeout; returns how many"""
+        conn = self.db.connection()
+        with conn:
+            return self._expire(conn)
+
+    def reserve(self, username):
+        """Hold one of the patient's free trials for an upload; returns the hold id, or None if none are left"""
+        conn = self.db.connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._expire(conn)
+            pending = conn.execute(
+                'SELECT count(*) FROM upload_trial_holds WHERE username = ?', (username,)
+            ).fetchone()[0]
+            if self.allowance - self._used(conn, username) - pending <= 0:
+                return None
+            hold = uuid.uuid4().hex
+            conn.execute('INSERT INTO upload_trial_holds (id, username, created_at) VALUES (?, ?, ?)',
+                         (hold, username, time.time()))
+        return hold
+
+    def settle(self, username, hold, spent):
+        """Release a held trial, spending it if the upload was processed; returns the updated counts"""
+        conn = self.db.connection()
+        with conn:
+            conn.execute('DELETE FROM upload_trial_holds WHERE id = ?', (hold,))
+            if spent:
+                conn.execute(
+                    'INSERT INTO upload_trials (username, used) VALUES (?, 1) '
+                    'ON CONFLICT (username) DO UPDATE SET used = used + 1',
+                    (username,)
+                )
+        return self.get(username)
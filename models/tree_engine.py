@@ -0,0 +1,311 @@
+"""
+Flat NumPy inference engine for the CKD random forest.
+
+The fitted sklearn forest is exported into a handful of contiguous arrays
+(split feature, threshold, children and positive-class leaf probability,
+one row per node across all trees) and evaluated level by level for every
+row and tree at once.  Leaves point at themselves, so a fixed number of
+vectorized steps (the forest's max depth) reaches every leaf without
+per-node branching.  Only NumPy is needed at inference time.
+
+The same traversal also yields per-row feature attributions (tree-path
+decomposition): each split moves the positive-class probability from the
+parent's value to the child's, and that change is credited to the split
+feature.  Averaged over trees, bias + sum(contributions) equals the
+predicted probability.
+
+compact() repacks the arrays into the smallest dtypes that keep every
+prediction identical (float32 thresholds rounded down, uint8/uint16 feature
+and node indices).  compact(value_bits=16) also quantizes leaf probabilities
+to 16-bit integers, which is smaller still but only approximately equal.
+
+Run ``python -m models.tree_engine`` to check parity against sklearn and
+compare latency and size; it exits non-zero when any representation's
+probabilities drift from sklearn's by more than parity_tolerance() allows, or
+its attributions stop adding up.
+"""
+import os
+import sys
+
+import numpy as np
+
+ARRAY_NAMES = ('feature', 'threshold', 'left', 'right', 'value', 'roots', 'max_depth')
+# Only present for engines with quantized leaf values
+OPTIONAL_ARRAY_NAMES = ('value_scale',)
+
+
+def _index_dtype(size):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if size <= np.iinfo(dtype).max:
+            return dtype
+    return np.intp
+
+
+class ForestEngine:
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth, value_scale=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        # Quantized engines store integer leaf values; probability = value * value_scale
+        self.value_scale = None if value_scale is None else float(value_scale)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @property
+    def nbytes(self):
+        return sum(np.asarray(array).nbytes for array in self.to_arrays().values())
+
+    def node_values(self, nodes=slice(None)):
+        """Positive-class probability stored at the given nodes (all nodes by default)"""
+        if self.value_scale is None:
+            return self.value[nodes]
+        return self.value[nodes] * self.value_scale
+
+    @classmethod
+    def from_sklearn(cls, forest, positive_class=1):
+        """Export a fitted RandomForestClassifier (or a single decision tree)"""
+        estimators = getattr(forest, 'estimators_', [forest])
+        class_index = list(forest.classes_).index(positive_class)
+
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in estimators:
+            tree = estimator.tree_
+            n = tree.node_count
+            index = np.arange(n)
+            leaf = tree.children_left == -1
+
+            # Normalize exactly as DecisionTreeClassifier.predict_proba does
+            proba = tree.value[:, 0, :]
+            normalizer = proba.sum(axis=1)
+            normalizer[normalizer == 0.0] = 1.0
+            proba = proba / normalizer[:, None]
+
+            features.append(np.where(leaf, 0, tree.feature))
+            thresholds.append(np.where(leaf, np.inf, tree.threshold))
+            lefts.append(np.where(leaf, index, tree.children_left) + offset)
+            rights.append(np.where(leaf, index, tree.children_right) + offset)
+            values.append(proba[:, class_index])
+            roots.append(offset)
+            offset += n
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            value=np.concatenate(values).astype(np.float64),
+            roots=np.array(roots, dtype=np.intp),
+            max_depth=max_depth,
+        )
+
+    def compact(self, value_bits=None):
+        """Return a copy packed into small dtypes.
+
+        Thresholds become float32 rounded *down*: for float32 inputs x,
+        x <= t and x <= floor32(t) always agree, so splits are unchanged.
+        Feature and node indices use the smallest unsigned type that fits.
+        Predictions stay bit-identical unless value_bits is given, in which
+        case leaf probabilities are quantized to that many bits (8 or 16).
+        """
+        threshold = self.threshold.astype(np.float32)
+        rounded_up = threshold.astype(np.float64) > self.threshold
+        threshold[rounded_up] = np.nextafter(threshold[rounded_up], np.float32(-np.inf))
+        node_dtype = _index_dtype(self.n_nodes)
+
+        value, value_scale = self.node_values(), None
+        if value_bits is not None:
+            dtype = {8: np.uint8, 16: np.uint16}[value_bits]
+            levels = np.iinfo(dtype).max
+            value, value_scale = np.round(value * levels).astype(dtype), 1.0 / levels
+
+        return ForestEngine(
+            feature=self.feature.astype(_index_dtype(int(self.feature.max()))),
+            threshold=threshold,
+            left=self.left.astype(node_dtype),
+            right=self.right.astype(node_dtype),
+            value=value,
+            roots=self.roots.astype(node_dtype),
+            max_depth=self.max_depth,
+            value_scale=value_scale,
+        )
+
+    def apply(self, X):
+        """Return the (n_rows, n_trees) leaf index reached by every row in every tree"""
+        # sklearn evaluates trees on float32 inputs; compare the same way for identical splits
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.repeat(self.roots[None, :], X.shape[0], axis=0)
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def predict_positive(self, X):
+        """Positive-class probability per row, matching forest.predict_proba(X)[:, 1]"""
+        nodes = self.apply(X)
+        # Summing tree by tree (axis 0 of the transpose) keeps sklearn's accumulation order
+        return self.node_values(nodes.T).sum(axis=0) / self.n_trees
+
+    def explain(self, X):
+        """Return (probability, contributions) for every row.
+
+        contributions has shape (n_rows, n_features) in probability units.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        n_rows, n_features = X.shape
+        rows = np.arange(n_rows)[:, None]
+        nodes = np.repeat(self.roots[None, :], n_rows, axis=0)
+        contributions = np.zeros(n_rows * n_features)
+        for _ in range(self.max_depth):
+            feature = self.feature[nodes]
+            go_left = X[rows, feature] <= self.threshold[nodes]
+            children = np.where(go_left, self.left[nodes], self.right[nodes])
+            # Leaves loop back to themselves, so their delta is exactly zero
+            delta = self.node_values(children) - self.node_values(nodes)
+            contributions += np.bincount(
+                (rows * n_features + feature).ravel(), weights=delta.ravel(), minlength=n_rows * n_features
+            )
+            nodes = children
+        probability = self.node_values(nodes.T).sum(axis=0) / self.n_trees
+        return probability, contributions.reshape(n_rows, n_features) / self.n_trees
+
+    @property
+    def bias(self):
+        """Mean root probability: the prediction before any split is applied"""
+        return float(self.node_values(self.roots).mean())
+
+    def to_arrays(self):
+        arrays = {
+            'feature': self.feature,
+            'threshold': self.threshold,
+            'left': self.left,
+            'right': self.right,
+            'value': self.value,
+            'roots': self.roots,
+            'max_depth': np.array(self.max_depth),
+        }
+        if self.value_scale is not None:
+            arrays['value_scale'] = np.array(self.value_scale)
+        return arrays
+
+    def save(self, directory):
+        """Write one uncompressed .npy file per array so load() can memory-map them"""
+        os.makedirs(directory, exist_ok=True)
+        for name, array in self.to_arrays().items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """Load an engine saved by save().
+
+        With mmap_mode='r' the arrays are mapped read-only from the page cache,
+        so every worker process serving the same artifact shares one physical copy.
+        """
+        names = ARRAY_NAMES + tuple(
+            name for name in OPTIONAL_ARRAY_NAMES if os.path.isfile(os.path.join(path, f"{name}.npy"))
+        )
+        return cls(**{
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode if name in ARRAY_NAMES[:-1] else None)
+            for name in names
+        })
+
+
+# Largest |difference| accepted by the checks; the engine reproduces sklearn up to float rounding
+PARITY_TOLERANCE = 1e-12
+
+
+def parity_tolerance(engine):
+    """Largest |probability difference| from sklearn allowed for this engine.
+
+    compact() keeps predictions exact; quantizing leaf values moves each by at
+    most half a step, and so the mean over trees as well.
+    """
+    if engine.value_scale is None:
+        return PARITY_TOLERANCE
+    return engine.value_scale / 2 + PARITY_TOLERANCE
+
+
+def check_parity(forest, X, engine=None):
+    """Return the largest absolute difference between the engine and sklearn on X"""
+    engine = engine or ForestEngine.from_sklearn(forest)
+    expected = forest.predict_proba(X)[:, list(forest.classes_).index(1)]
+    return float(np.max(np.abs(engine.predict_positive(X) - expected)))
+
+
+def check_additivity(engine, X):
+    """Return the largest |bias + sum(contributions) - probability| of explain() on X"""
+    probability, contributions = engine.explain(X)
+    return float(np.max(np.abs(engine.bias + contributions.sum(axis=1) - probability)))
+
+
+def main():
+    import io
+    import time
+
+    import joblib
+
+    from .ckd_model import ckd_model
+
+    rng = np.random.default_rng(0)
+    scaled = rng.normal(size=(5000, len(ckd_model.feature_names))) * 2
+    engine = ForestEngine.from_sklearn(ckd_model.model)
+    print(f"trees: {engine.n_trees}, nodes: {engine.n_nodes}, max depth: {engine.max_depth}")
+
+    expected = ckd_model.model.predict_proba(scaled)[:, 1]
+    dump = io.BytesIO()
+    joblib.dump({'scaler': ckd_model.scaler, 'model': ckd_model.model}, dump)
+    print(f"{'representation':<22} {'bytes':>8} {'max |diff|':>11} {'risk % diffs':>13}")
+    print(f"{'sklearn (joblib dump)':<22} {len(dump.getvalue()):8d} {0:11.3g} {0:13d}")
+    variants = (('engine float64', engine), ('engine compact', engine.compact()),
+                ('engine compact+q16', engine.compact(value_bits=16)),
+                ('engine compact+q8', engine.compact(value_bits=8)))
+    failures = []
+    for label, variant in variants:
+        probability = variant.predict_positive(scaled)
+        # Risk percentages are truncated to whole points, as CKDModel reports them
+        risk_diffs = int(np.count_nonzero((probability * 100).astype(int) != (expected * 100).astype(int)))
+        print(f"{label:<22} {variant.nbytes:8d} {np.max(np.abs(probability - expected)):11.3g} {risk_diffs:13d}")
+        difference, tolerance = check_parity(ckd_model.model, scaled, variant), parity_tolerance(variant)
+        if difference > tolerance:
+            failures.append(f"{label}: max |diff| {difference:.3g} from sklearn exceeds {tolerance:.3g}")
+        additivity = check_additivity(variant, scaled)
+        if additivity > PARITY_TOLERANCE:
+            failures.append(f"{label}: attributions miss the probability by up to {additivity:.3g}")
+
+    print()
+    for label, fn in (('sklearn', lambda row: ckd_model.model.predict_proba(row)),
+                      ('engine', lambda row: engine.predict_positive(row)),
+                      ('engine compact', lambda row, compact=variants[1][1]: compact.predict_positive(row))):
+        start = time.perf_counter()
+        for row in scaled[:500]:
+            fn(row[None, :])
+        print(f"{label}: {(time.perf_counter() - start) / 500 * 1e6:.0f} us per single-row call")
+
+    if failures:
+        print()
+        for failure in failures:
+            print(f"FAIL {failure}")
+        return 1
+    print("\nparity OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
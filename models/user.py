@@ -1,7 +1,12 @@
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash
-from models.ckd_model import ckd_model
-import os
+from models.model_loader import load_model_conditionally
+from models.passwords import hash_password
+from models.storage import (get_database, UserRepository, PatientRepository, PatientRecordRepository, JobRepository,
+                            UploadTrialRepository)
+from models.cohort import CohortRepository
+from models.pdf_extract import ExtractionCache
+from models.jobs import JobManager
+from models.profiling import ProfileStore
 
 class User(UserMixin):
     def __init__(self, id, username, password_hash, role):
@@ -16,11 +21,22 @@ class User(UserMixin):
     def is_patient(self):
         return self.role == 'patient'
 
-users_db = {
-    'doctor1': User('1', 'doctor1', generate_password_hash('doctor123'), 'doctor'),
-    'patient1': User('2', 'patient1', generate_password_hash('patient123'), 'patient'),
-    'admin': User('3', 'admin', generate_password_hash('admin123'), 'doctor'),
-}
+db = get_database()
+users_db = UserRepository(db, User)
+patients_data = PatientRepository(db)
+patient_records = PatientRecordRepository(db)
+cohort_trends = CohortRepository(db)
+pdf_extractions = ExtractionCache(db)
+job_manager = JobManager(JobRepository(db))
+upload_trials = UploadTrialRepository(db)
+request_profiles = ProfileStore(db)
+
+# Demo accounts: (id, username, password, role)
+sample_users = [
+    (1, 'doctor1', 'doctor123', 'doctor'),
+    (2, 'patient1', 'patient123', 'patient'),
+    (3, 'admin', 'admin123', 'doctor'),
+]
 
 # Add sample patient data for the 3 patients
 sample_patients = [
@@ -113,16 +129,7 @@ sample_patients = [
     }
 ]
 
-# Process the sample patients with the CKD model to generate predictions
-patients_data = {}
-for patient in sample_patients:
-    # Only process if not on Vercel to save build time
-    if not os.environ.get('VERCEL'):
-        prediction = ckd_model.predict_risk(patient)
-        patient.update(prediction)
-    patients_data[patient['patient_id']] = patient
-
-patient_records = {
+patient_records_seed = {
     'patient1': {
         'name': 'John Doe',
         'age': 55,
@@ -158,4 +165,35 @@ patient_records = {
             }
         ]
     }
-}
\ No newline at end of file
+}
+
+def seed_sample_data():
+    """Insert the demo users and patients that aren't in the database yet"""
+    for user_id, username, password, role in sample_users:
+        if not users_db.exists(username):
+            try:
+                users_db.add(username, hash_password(password), role, user_id=user_id)
+            except Exception:
+                # Another worker seeded it first
+                pass
+    
+    missing = [patient for patient in sample_patients if not patients_data.exists(patient['patient_id'])]
+    if missing:
+        # Process the sample patients with the CKD model to generate predictions
+        # (the loader picks the dependency-free model on Vercel)
+        ckd_model = load_model_conditionally()
+        for patient in missing:
+            patient.update(ckd_model.predict_risk(patient))
+        patients_data.save_many(missing, replace=False)
+    
+    for username, record in patient_records_seed.items():
+        if not patient_records.exists(username):
+            patient_records.save_profile(username, record, replace=False)
+            patient_records.add_labs(username, record['history'])
+
+seed_sample_data()
+# Patients staged under a previous CKD_EGFR_FORMULA are re-staged by whichever worker starts first
+patients_data.restage()
+# Jobs and trial holds a killed or restarted worker left behind are released
+job_manager.reclaim()
+upload_trials.expire()
@@ -1,13 +1,15 @@
 """
-Lightweight model for Vercel deployment to reduce bundle size
+Lightweight model for Vercel deployment to reduce bundle size.
+
+Scores with the compact forest export (models/ckd_forest.json.gz) using only
+the standard library, so numpy/pandas/scikit-learn aren't needed.
 """
-import numpy as np
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
-import joblib
 import os
 import logging
 
+from . import clinical, metrics
+from .compact_forest import CompactForest, DEFAULT_PATH
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,7 +17,8 @@ logger = logging.getLogger(__name__)
 class LightweightCKDModel:
     def __init__(self):
         self.model = None
-        self.scaler = StandardScaler()
+        self.version = None
+        self.egfr_formula = clinical.DEFAULT_FORMULA
         self.feature_names = [
             'age', 'bp_systolic', 'bp_diastolic', 'specific_gravity',
             'albumin', 'sugar', 'red_blood_cells', 'pus_cell',
@@ -25,20 +28,50 @@ class LightweightCKDModel:
             'diabetes_mellitus', 'coronary_artery_disease', 'appetite',
             'pedal_edema', 'anemia'
         ]
+        self.load_model()
         logger.info("Lightweight CKD Model initialized")
     
+    def load_model(self, path=DEFAULT_PATH):
+        try:
+            model = CompactForest.load(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Compact model not available ({e}) - predictions will be disabled")
+            return
+        if model.feature_names != self.feature_names:
+            logger.warning("Compact model feature schema differs - predictions will be disabled")
+            return
+        self.model = model
+        self.version = model.version
+    
     def predict_risk(self, patient_data):
-        """Return default values to avoid loading heavy model on Vercel"""
-        logger.info("Using lightweight prediction (no model loaded)")
+        with metrics.timer('egfr'):
+            egfr = self.calculate_egfr(patient_data.get('age', 50), patient_data.get('serum_creatinine', 1.0), patient_data.get('gender', 'male'))
+            stage = clinical.ckd_stage(egfr)
         
-        stage = self.calculate_ckd_stage(patient_data)
+        if self.model is None:
+            # Return default values when the compact export wasn't shipped
+            return {
+                'risk_percentage': 0,
+                'stage': stage,
+                'risk_level': 'Unknown - Model not loaded on Vercel',
+                'feature_importance': [],
+                'egfr': egfr
+            }
         
+        with metrics.timer('feature_preparation'):
+            features = self.prepare_features(patient_data)
+        with metrics.timer('forest_inference'):
+            risk_prob, contributions = self.model.explain(features)
+        risk_percentage = int(risk_prob * 100)
+        
+        with metrics.timer('attributions'):
+            feature_importance = self.get_feature_importance(features, contributions)
         return {
-            'risk_percentage': 0,
+            'risk_percentage': risk_percentage,
             'stage': stage,
-            'risk_level': 'Unknown - Model not loaded on Vercel',
-            'feature_importance': [],
-            'egfr': self.calculate_egfr(patient_data.get('age'), patient_data.get('serum_creatinine', 1.0), patient_data.get('gender', 'male'))
+            'risk_level': self.get_risk_level(risk_percentage),
+            'feature_importance': feature_importance,
+            'egfr': egfr
         }
     
     def prepare_features(self, data):
@@ -51,33 +84,14 @@ class LightweightCKDModel:
         return features
     
     def calculate_egfr(self, age, creatinine, gender):
-        if creatinine <= 0:
-            creatinine = 1.0
-        
-        if gender.lower() == 'female':
-            egfr = 186 * (creatinine ** -1.154) * (age ** -0.203) * 0.742
-        else:
-            egfr = 186 * (creatinine ** -1.154) * (age ** -0.203)
-        
-        return round(egfr, 2)
+        return clinical.egfr(age, creatinine, gender, self.egfr_formula)
     
     def calculate_ckd_stage(self, data):
-        egfr = self.calculate_egfr(
+        return clinical.ckd_stage(self.calculate_egfr(
             data.get('age', 50),
             data.get('serum_creatinine', 1.0),
             data.get('gender', 'male')
-        )
-        
-        if egfr >= 90:
-            return 1
-        elif egfr >= 60:
-            return 2
-        elif egfr >= 30:
-            return 3
-        elif egfr >= 15:
-            return 4
-        else:
-            return 5
+        ))
     
     def get_risk_level(self, risk_percentage):
         if risk_percentage < 20:
@@ -89,6 +103,24 @@ class LightweightCKDModel:
         else:
             return 'Critical'
     
+    def get_feature_importance(self, features, contributions, top_k=5):
+        """Top-k per-patient risk factors, in the same shape as CKDModel's attributions"""
+        total = sum(abs(contribution) for contribution in contributions) or 1.0
+        ranked = sorted(
+            (i for i, contribution in enumerate(contributions) if contribution != 0),
+            key=lambda i: abs(contributions[i]), reverse=True
+        )[:top_k]
+        
+        return [
+            {
+                'name': self.feature_names[i].replace('_', ' ').title(),
+                'value': round(features[i], 2),
+                'importance': round(abs(contributions[i]) / total * 100, 2),
+                'contribution': round(contributions[i] * 100, 2)
+            }
+            for i in ranked
+        ]
+    
     def predict_batch(self, patient_list):
         results = []
         for patient in patient_list:
@@ -16,6 +16,13 @@ setup(
         'Werkzeug==3.0.1',
         'PyPDF2==3.0.1',
     ],
+    extras_require={
+        # python -m models.assets build: image resizing/WebP and Brotli variants
+        'build': [
+            'Pillow==10.4.0',
+            'Brotli==1.1.0',
+        ],
+    },
     entry_points={
         'console_scripts': [
             'vois-ckd=app:main',
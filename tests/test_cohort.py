@@ -0,0 +1,31 @@
+from array import array
+import math
+
+import pytest
+
+from models import clinical, cohort
+
+
+def test_entry_egfr_prefers_stored_value():
+    assert cohort.entry_egfr({'serum_creatinine': 2.4, 'egfr': 28}, 62, 'male') == 28
+    derived = cohort.entry_egfr({'serum_creatinine': 2.4, 'egfr': math.nan}, 62, 'male')
+    assert derived == clinical.egfr(62, 2.4, 'male')
+    assert cohort.entry_egfr({'serum_creatinine': None}, 62, 'male') is None
+
+
+def test_grouped_refresh_matches_fallback():
+    if cohort.np is None:
+        pytest.skip('NumPy is not installed')
+    series = {
+        'patient1': (array('d', [738000, 738100, 738200]), array('d', [2.4, 2.6, 3.0]), array('d', [28, math.nan, 21])),
+        'patient2': (array('d', [738000, 738050]), None, array('d', [60, 55])),
+    }
+    profiles = {'patient1': {'age': 62, 'gender': 'male'}}
+    formula = clinical.resolve_formula(None)
+    grouped = cohort._compute_grouped(series, profiles, formula)
+    each = cohort._compute_each(series, profiles, formula)
+    for fast, slow in zip(sorted(grouped), sorted(each)):
+        assert fast[:2] == slow[:2]
+        assert fast[2:] == pytest.approx(slow[2:])
+    first_egfr = {row[0]: row[cohort.COLUMNS.index('first_egfr')] for row in grouped}
+    assert first_egfr == {'patient1': 28, 'patient2': 60}
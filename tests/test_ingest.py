@@ -0,0 +1,46 @@
+import io
+
+from models import clinical
+from models.ingest import ingest_lab_report
+
+
+class EstimatingModel:
+    """Predicts from a fixed estimated eGFR, whatever the row says"""
+    feature_names = ['age', 'serum_creatinine', 'egfr']
+
+    def __init__(self, estimate):
+        self.estimate = estimate
+
+    def predict_batch(self, records):
+        return [{'risk_percentage': 40, 'risk_level': 'Moderate', 'stage': clinical.ckd_stage(self.estimate),
+                 'egfr': self.estimate} for _ in records]
+
+
+class Records:
+    def __init__(self):
+        self.labs = []
+
+    def profile(self, username):
+        return {'age': 62, 'gender': 'male'}
+
+    def add_labs(self, username, entries):
+        self.labs.extend(entries)
+
+
+def test_measured_egfr_restages_entry():
+    records = Records()
+    report = b'date,serum_creatinine,egfr\n2025-03-15,2.4,28\n'
+    summary = ingest_lab_report(io.BytesIO(report), EstimatingModel(estimate=45.0), records, 'patient1')
+    entry = summary['latest']
+    assert entry['egfr'] == 28
+    assert entry['stage'] == 4
+    assert (entry['risk_percentage'], entry['risk_level']) == (40, 'Moderate')
+
+
+def test_estimate_used_for_all_fields_without_measured_egfr():
+    records = Records()
+    report = b'date,serum_creatinine\n2025-03-15,1.6\n'
+    summary = ingest_lab_report(io.BytesIO(report), EstimatingModel(estimate=45.0), records, 'patient1')
+    entry = summary['latest']
+    assert (entry['egfr'], entry['stage']) == (45.0, 3)
+    assert records.labs == [entry]
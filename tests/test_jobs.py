@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+from models import jobs
+from models.storage import Database, JobRepository, UploadTrialRepository
+
+
+@pytest.fixture
+def db(tmp_path):
+    return Database(str(tmp_path / 'ckd.sqlite3'))
+
+
+def test_expired_hold_frees_the_trial(db):
+    trials = UploadTrialRepository(db, allowance=1, hold_timeout=60)
+    hold = trials.reserve('patient1')
+    assert hold is not None
+    assert trials.reserve('patient1') is None
+    # The worker holding the trial was killed before settling it
+    with db.connection() as conn:
+        conn.execute('UPDATE upload_trial_holds SET created_at = ?', (time.time() - 120,))
+    hold = trials.reserve('patient1')
+    assert hold is not None
+    assert trials.settle('patient1', hold, spent=True) == {'remaining': 0, 'used': 1}
+    assert trials.reserve('patient1') is None
+
+
+def test_orphaned_job_is_reported_failed(db):
+    store = JobRepository(db)
+    job = jobs.Job('lab_report', 2, store)
+    job.status = 'running'
+    job.save()
+    manager = jobs.JobManager(store)
+    assert manager.get(job.id).status == 'running'
+    with db.connection() as conn:
+        conn.execute('UPDATE jobs SET updated_at = ?', (time.time() - jobs.JOB_TIMEOUT - 1,))
+    orphan = manager.get(job.id)
+    assert orphan.status == 'failed'
+    assert orphan.finished
+    assert orphan.message == jobs.ORPHANED_MESSAGE
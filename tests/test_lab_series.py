@@ -0,0 +1,59 @@
+import math
+import sqlite3
+
+import pytest
+
+from models import lab_series
+from models.lab_series import SCHEMA, LabSeries, LabSeriesRepository
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute(SCHEMA)
+    return conn
+
+
+class Db:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def connection(self):
+        return self.conn
+
+
+def _lab(day, creatinine=None, egfr=None):
+    return {'date': f'2025-01-{day:02d}', 'serum_creatinine': creatinine, 'egfr': egfr}
+
+
+def _same(series, expected):
+    assert list(series.days) == list(expected.days)
+    for name, column in expected.columns.items():
+        assert [None if math.isnan(v) else v for v in series.columns[name]] == \
+            [None if math.isnan(v) else v for v in column]
+
+
+@pytest.mark.parametrize('chunk_size', [2, 3, 512])
+def test_appends_in_place_and_merges_back_dated_results(conn, monkeypatch, chunk_size):
+    monkeypatch.setattr(lab_series, 'CHUNK_SIZE', chunk_size)
+    repository = LabSeriesRepository(Db(conn))
+    batches = [[_lab(3, 1.1, 70)], [_lab(5, 1.3), _lab(4, None, 66)], [_lab(5, 1.4, 60)],
+               [_lab(6, 1.5), _lab(7, 1.6), _lab(8, 1.7, 50), _lab(9, 1.8)], [_lab(1, 0.9, 80)], [_lab(10, 2.0)]]
+    expected = LabSeries()
+    results = []
+    for batch in batches:
+        results.append(repository.append(conn, 'patient1', batch))
+        expected.append(batch)
+    assert results == [True, True, True, True, False, True]
+    _same(repository.get('patient1'), expected)
+
+
+def test_missing_analyte_row_is_padded(conn, monkeypatch):
+    monkeypatch.setattr(lab_series, 'CHUNK_SIZE', 2)
+    repository = LabSeriesRepository(Db(conn))
+    repository.append(conn, 'patient1', [_lab(1, 1.0, 80), _lab(2, 1.1, 75), _lab(3, 1.1, 72)])
+    conn.execute("DELETE FROM lab_series WHERE analyte = 'hemoglobin'")
+    repository.append(conn, 'patient1', [dict(_lab(4, 1.2, 70), hemoglobin=11.0)])
+    assert repository.get('patient1').values('hemoglobin') == [None, None, None, 11.0]
+    assert repository.get('patient1').values('egfr') == [80, 75, 72, 70]
@@ -0,0 +1,24 @@
+import cProfile
+
+from models.profiling import ProfileStore
+from models.storage import Database
+
+
+def _profile():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    sorted(range(100))
+    profiler.disable()
+    return profiler
+
+
+def test_profiles_are_shared_between_workers_and_pruned(tmp_path):
+    db = Database(str(tmp_path / 'ckd.sqlite3'))
+    worker_a, worker_b = ProfileStore(db, keep=2), ProfileStore(db, keep=2)
+    first = worker_a.add(_profile(), {'path': '/a'})
+    worker_b.add(_profile(), {'path': '/b'})
+    worker_a.add(_profile(), {'path': '/c'})
+    assert [profile['path'] for profile in worker_b.list()] == ['/c', '/b']
+    assert worker_b.get(first['id']) is None
+    latest = worker_b.get(worker_b.list()[0]['id'])
+    assert latest['functions'] and latest['total_calls'] > 0
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from models.tree_engine import PARITY_TOLERANCE, ForestEngine, check_additivity, check_parity, parity_tolerance
+
+ensemble = pytest.importorskip('sklearn.ensemble')
+
+
+@pytest.fixture(scope='module')
+def forest_and_rows():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(400, 6))
+    y = (X[:, 0] + X[:, 1] * X[:, 2] + rng.normal(scale=0.5, size=400) > 0).astype(int)
+    forest = ensemble.RandomForestClassifier(n_estimators=25, max_depth=6, random_state=0).fit(X, y)
+    return forest, rng.normal(size=(2000, 6)) * 2
+
+
+def test_engine_matches_sklearn(forest_and_rows):
+    forest, X = forest_and_rows
+    assert check_parity(forest, X) <= PARITY_TOLERANCE
+
+
+def test_attributions_add_up_to_probability(forest_and_rows):
+    forest, X = forest_and_rows
+    assert check_additivity(ForestEngine.from_sklearn(forest), X) <= PARITY_TOLERANCE
+
+
+@pytest.mark.parametrize('value_bits', [None, 16, 8])
+def test_compact_engines_stay_within_tolerance(forest_and_rows, value_bits):
+    forest, X = forest_and_rows
+    compact = ForestEngine.from_sklearn(forest).compact(value_bits=value_bits)
+    tolerance = parity_tolerance(compact)
+    if value_bits is None:
+        assert tolerance == PARITY_TOLERANCE
+    else:
+        assert tolerance < 2.0 ** -(value_bits - 1)
+    assert check_parity(forest, X, compact) <= tolerance
+    assert check_additivity(compact, X) <= PARITY_TOLERANCE